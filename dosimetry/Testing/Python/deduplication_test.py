@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+from optimize_test import film, PARAMETERS
+from src.logic_subprocess import solve_regions, open_channel
+from src.threaded_backend import solve_regions_in_threads
+
+
+class DeduplicationTest(unittest.TestCase):
+    """Solving each unique RGB triplet once gives the same doses as solving every pixel."""
+
+    def setUp(self):
+        # every triplet of the scan appears four times
+        self.images = [np.tile(film(6, 30), (4, 1, 1)), film(5, 7, seed=1)]
+        self.parameters = {
+            **PARAMETERS,
+            "engine": "vectorized",
+            "number_of_processes": 2,
+            "tile_rows": 5,
+        }
+        open_channel(lambda frame: None)
+
+    def assertSameDoses(self, solve):
+        reference = solve(self.images, {**self.parameters, "deduplicate": 0})
+        doses = solve(self.images, {**self.parameters, "deduplicate": 1})
+        for image, dose, expected in zip(self.images, doses, reference):
+            self.assertEqual(dose.shape, image.shape[:2])
+            np.testing.assert_array_equal(dose, expected)
+
+    def test_processes(self):
+        self.assertSameDoses(solve_regions)
+
+    def test_threads(self):
+        self.assertSameDoses(solve_regions_in_threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.dose_cache import DoseCache
+
+
+class DoseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "dose_cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        pixels = np.array([[1, 2, 3], [65535, 0, 7], [4, 5, 6]], dtype=np.uint16)
+        with DoseCache(self.path, "model", 10) as cache:
+            cache.store(pixels[:2], np.array([100, 2500], dtype=np.uint16))
+        with DoseCache(self.path, "model", 10) as cache:
+            doses, found = cache.lookup(pixels)
+            np.testing.assert_array_equal(found, [True, True, False])
+            np.testing.assert_array_equal(doses, [100, 2500, 0])
+            self.assertEqual(cache.statistics()["hits"], 2)
+            self.assertEqual(cache.statistics()["misses"], 1)
+
+    def test_models_are_separate(self):
+        pixels = np.array([[1, 2, 3]], dtype=np.uint16)
+        with DoseCache(self.path, "model", 10) as cache:
+            cache.store(pixels, np.array([100], dtype=np.uint16))
+        with DoseCache(self.path, "other model", 10) as cache:
+            _, found = cache.lookup(pixels)
+            self.assertFalse(found.any())
+
+    def test_size_limit(self):
+        pixels = np.arange(30, dtype=np.uint16).reshape(10, 3)
+        with DoseCache(self.path, "model", 4) as cache:
+            cache.store(pixels, np.arange(10, dtype=np.uint16))
+            _, found = cache.lookup(pixels)
+            self.assertEqual(int(found.sum()), 4)
+            self.assertEqual(cache.statistics()["entries"], 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from src.job_queue import JobQueue, PENDING, RUNNING, DONE, FAILED, CANCELLED
+
+TIMEOUT = 5.0
+
+
+class Runner(object):
+    """Runner whose jobs block until released by name, cancelling releases them with an error."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.granted = {}
+        self.events = {}
+        self.cancelled = []
+
+    def event(self, name):
+        with self.lock:
+            return self.events.setdefault(name, threading.Event())
+
+    def run(self, job_id, arguments, cpus, progressUpdate):
+        name = arguments["name"]
+        with self.lock:
+            self.granted[name] = cpus
+        progressUpdate(0.5)
+        if not self.event(name).wait(TIMEOUT):
+            raise TimeoutError(name)
+        if job_id in self.cancelled:
+            raise RuntimeError("cancelled")
+        return f"{name} done"
+
+    def cancel(self, job_id):
+        self.cancelled.append(job_id)
+        for event in list(self.events.values()):
+            event.set()
+
+    def release(self, name):
+        self.event(name).set()
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "job_queue.json")
+        self.runner = Runner()
+
+    def tearDown(self):
+        for event in self.runner.events.values():
+            event.set()
+        self.directory.cleanup()
+
+    def queue(self, cpu_budget=4):
+        queue = JobQueue(self.path, cpu_budget)
+        queue.register_runner("test", self.runner.run, self.runner.cancel)
+        return queue
+
+    def status(self, queue, job_id):
+        return {job["id"]: job for job in queue.snapshot()}[job_id]["status"]
+
+    def waitFor(self, condition):
+        deadline = time.time() + TIMEOUT
+        while not condition():
+            if time.time() > deadline:
+                self.fail("timed out")
+            time.sleep(0.01)
+
+    def waitForStatus(self, queue, job_id, status):
+        self.waitFor(lambda: self.status(queue, job_id) == status)
+
+    def test_cpu_budget(self):
+        queue = self.queue(cpu_budget=4)
+        a = queue.submit("test", "a", {"name": "a"}, cpus=3)
+        b = queue.submit("test", "b", {"name": "b"}, cpus=2)
+        c = queue.submit("test", "c", {"name": "c"}, cpus=1)
+        self.waitFor(lambda: "a" in self.runner.granted)
+        # b does not fit next to a, jobs start in submission order
+        self.assertEqual(self.status(queue, b), PENDING)
+        self.assertEqual(self.status(queue, c), PENDING)
+
+        self.runner.release("a")
+        self.waitForStatus(queue, a, DONE)
+        self.waitFor(lambda: {"b", "c"} <= set(self.runner.granted))
+        self.assertEqual(self.runner.granted, {"a": 3, "b": 2, "c": 1})
+        self.runner.release("b")
+        self.runner.release("c")
+        self.waitForStatus(queue, c, DONE)
+
+    def test_job_larger_than_budget_runs_alone(self):
+        queue = self.queue(cpu_budget=2)
+        big = queue.submit("test", "big", {"name": "big"}, cpus=8)
+        small = queue.submit("test", "small", {"name": "small"}, cpus=1)
+        self.waitFor(lambda: "big" in self.runner.granted)
+        self.assertEqual(self.runner.granted["big"], 2)
+        self.assertEqual(self.status(queue, small), PENDING)
+        self.runner.release("big")
+        self.runner.release("small")
+        self.waitForStatus(queue, small, DONE)
+        self.assertEqual(self.status(queue, big), DONE)
+
+    def test_cancel_queued_job(self):
+        queue = self.queue(cpu_budget=1)
+        running = queue.submit("test", "running", {"name": "running"})
+        queued = queue.submit("test", "queued", {"name": "queued"})
+        queue.cancel(queued)
+        self.assertEqual(self.status(queue, queued), CANCELLED)
+        self.runner.release("running")
+        self.waitForStatus(queue, running, DONE)
+        self.assertNotIn("queued", self.runner.granted)
+        self.assertEqual(self.runner.cancelled, [])
+
+    def test_cancel_running_job(self):
+        queue = self.queue()
+        job = queue.submit("test", "job", {"name": "job"})
+        self.waitForStatus(queue, job, RUNNING)
+        queue.cancel(job)
+        self.waitForStatus(queue, job, CANCELLED)
+        self.assertEqual(self.runner.cancelled, [job])
+
+    def test_failed_job(self):
+        queue = JobQueue(self.path, 1)
+
+        def fail(job_id, arguments, cpus, progressUpdate):
+            raise ValueError("broken scan")
+
+        queue.register_runner("failing", fail)
+        job = queue.submit("failing", "job", {})
+        self.waitForStatus(queue, job, FAILED)
+        self.assertEqual(queue.snapshot()[0]["message"], "broken scan")
+
+    def test_restore_persisted_jobs(self):
+        queue = JobQueue(self.path, 2)
+        # no runner registered yet, as after a restart before the modules load
+        job = queue.submit("test", "job", {"name": "job"}, cpus=2)
+        done = queue.submit("test", "done", {"name": "done"})
+        with open(self.path, "r") as f:
+            jobs = json.load(f)
+        jobs[0]["status"] = RUNNING
+        jobs[0]["granted"] = 2
+        jobs[1]["status"] = DONE
+        with open(self.path, "w") as f:
+            json.dump(jobs, f)
+
+        restored = JobQueue(self.path, 2)
+        self.assertEqual(
+            [(job["status"], job["granted"]) for job in restored.snapshot()],
+            [(PENDING, 0), (DONE, 0)],
+        )
+        restored.register_runner("test", self.runner.run, self.runner.cancel)
+        self.runner.release("job")
+        self.waitForStatus(restored, job, DONE)
+        self.assertNotIn("done", self.runner.granted)
+        with open(self.path, "r") as f:
+            self.assertEqual([job["status"] for job in json.load(f)], [DONE, DONE])
+        self.assertEqual(self.status(restored, done), DONE)
+
+    def test_main_thread_jobs(self):
+        queue = JobQueue(self.path, 2)
+        calls = []
+
+        def run(job_id, arguments, cpus, progressUpdate):
+            calls.append(threading.current_thread())
+            return "ok"
+
+        queue.register_runner("scene", run, main_thread=True)
+        job = queue.submit("scene", "job", {})
+        self.assertEqual(self.status(queue, job), PENDING)
+        queue.run_main_thread_jobs()
+        self.assertEqual(calls, [threading.current_thread()])
+        self.assertEqual(self.status(queue, job), DONE)
+
+
+if __name__ == "__main__":
+    unittest.main()
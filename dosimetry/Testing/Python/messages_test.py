@@ -0,0 +1,44 @@
+import io
+import unittest
+from src.messages import MessageChannel, read_frames, MESSAGE, PROGRESS
+
+
+class MessagesTest(unittest.TestCase):
+    def test_round_trip(self):
+        stream = io.BytesIO()
+        channel = MessageChannel(stream.write, refresh_rate=0)
+        channel.message("sample", "psm_1234")
+        channel.message("statistic", "name=value;with;separators")
+        channel.stage("solve")
+        channel.progress(0.5)
+        channel.progress(1.0)
+        stream.seek(0)
+
+        frames = list(read_frames(stream))
+        self.assertEqual(frames[0], (MESSAGE, ("sample", "psm_1234")))
+        self.assertEqual(
+            frames[1], (MESSAGE, ("statistic", "name=value;with;separators"))
+        )
+        self.assertEqual([kind for kind, _ in frames[2:]], [PROGRESS, PROGRESS])
+        self.assertEqual(frames[2][1]["stage"], "solve")
+        self.assertEqual(frames[2][1]["progress"], 0.5)
+        self.assertEqual(frames[3][1]["progress"], 1.0)
+
+    def test_progress_is_throttled_except_stage_end(self):
+        frames = []
+        channel = MessageChannel(frames.append, refresh_rate=0.001)
+        channel.stage("solve")
+        for progress in [0.25, 0.5, 0.75, 1.0]:
+            channel.progress(progress)
+        # the first update comes right at the start of the stage
+        self.assertEqual(len(frames), 2)
+
+    def test_truncated_stream(self):
+        stream = io.BytesIO()
+        MessageChannel(stream.write).message("tag", "value")
+        stream = io.BytesIO(stream.getvalue()[:3])
+        self.assertEqual(list(read_frames(stream)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.optimize import (
+    optimize,
+    optimize_scalar,
+    optimize_single_channel,
+    rational_func,
+)
+
+CALIBRATION = {
+    "r": {"a": 240.0, "b": 0.2, "c": 300.0},
+    "g": {"a": 425.0, "b": 0.25, "c": 500.0},
+    "b": {"a": 540.0, "b": 0.3, "c": 900.0},
+}
+PARAMETERS = {
+    "tolerance": 0.01,
+    "max_iterations": 1000,
+    "normalization_factor": 65536,
+    "max_dose": 3000.0,
+    "calibration_parameters": CALIBRATION,
+}
+NORMALIZATION = {
+    "control_stripe_dose": 0.0,
+    "recalibration_stripe_dose": 1000.0,
+    "control_rgb_mean": {"r": 0.8 * 65536, "g": 0.85 * 65536, "b": 0.6 * 65536},
+    "recalibration_rgb_mean": {"r": 0.3 * 65536, "g": 0.4 * 65536, "b": 0.45 * 65536},
+}
+# doses of a noise-free scan, every engine and solver finds them within a rounding error
+KNOWN_DOSES = np.linspace(300, 2800, 400).reshape(8, 50)
+KNOWN_DOSE_TOLERANCE = 2
+
+
+def film(rows, columns, seed=0):
+    """Noisy scan of a dose gradient over [0, 2500] cGy with a few unexposed pixels."""
+    rng = np.random.default_rng(seed)
+    doses = np.linspace(0, 2500, rows * columns)
+    pixels = np.stack(
+        [
+            rational_func(doses, *[CALIBRATION[c][k] for k in "abc"])
+            for c in ["r", "g", "b"]
+        ],
+        axis=-1,
+    )
+    pixels = pixels * rng.normal(1, 0.01, pixels.shape)
+    pixels = np.clip(pixels * 65536, 0, 65535).astype(np.uint16)
+    pixels[:5] = 63000
+    return pixels.reshape(rows, columns, 3)
+
+
+def exposed_film(doses):
+    """Noise-free scan of a film exposed to doses, the last row is left unexposed."""
+    pixels = np.stack(
+        [
+            rational_func(doses, *[CALIBRATION[c][k] for k in "abc"])
+            for c in ["r", "g", "b"]
+        ],
+        axis=-1,
+    )
+    pixels = np.round(pixels * 65536).astype(np.uint16)
+    pixels[-1] = 64000
+    return pixels
+
+
+class KnownDosesTest(unittest.TestCase):
+    """Engines and solvers recover the doses a noise-free film was exposed to."""
+
+    def assertKnownDoses(self, parameters, solve=optimize):
+        doses = solve(exposed_film(KNOWN_DOSES), {**PARAMETERS, **parameters})
+        self.assertEqual(doses.shape, KNOWN_DOSES.shape)
+        np.testing.assert_array_equal(doses[-1], 0)
+        np.testing.assert_allclose(
+            doses[:-1], KNOWN_DOSES[:-1], atol=KNOWN_DOSE_TOLERANCE
+        )
+
+    def test_golden(self):
+        self.assertKnownDoses({"engine": "vectorized", "solver": "golden"})
+
+    def test_brent(self):
+        self.assertKnownDoses({"engine": "vectorized", "solver": "brent"})
+
+    def test_newton(self):
+        self.assertKnownDoses({"engine": "vectorized", "solver": "newton"})
+
+    def test_table(self):
+        for solver in ["golden", "brent", "newton"]:
+            with self.subTest(solver=solver):
+                self.assertKnownDoses({"engine": "table", "solver": solver})
+
+    def test_unexposed_tile(self):
+        # no pixel to solve, the derivative solvers get empty brackets
+        img = np.full((4, 16, 3), 64000, dtype=np.uint16)
+        for engine in [
+            {"engine": "vectorized"},
+            {"engine": "table"},
+            {"engine": "warm", "warm_start_margin": 100.0},
+            {
+                "engine": "vectorized",
+                "inverse_bracket": 1,
+                "inverse_bracket_margin": 50.0,
+            },
+        ]:
+            for solver in ["brent", "newton"]:
+                with self.subTest(solver=solver, **engine):
+                    doses = optimize(img, {**PARAMETERS, **engine, "solver": solver})
+                    np.testing.assert_array_equal(doses, np.zeros((4, 16)))
+
+    def test_inverse_bracket(self):
+        for solver in ["golden", "brent", "newton"]:
+            with self.subTest(solver=solver):
+                self.assertKnownDoses(
+                    {
+                        "engine": "vectorized",
+                        "solver": solver,
+                        "inverse_bracket": 1,
+                        "inverse_bracket_margin": 50.0,
+                    }
+                )
+
+    def test_single_channel(self):
+        for method in ["red", "weighted"]:
+            with self.subTest(method=method):
+                self.assertKnownDoses({"method": method}, optimize_single_channel)
+
+    def test_scalar_engine_rejects_derivative_solvers(self):
+        with self.assertRaises(ValueError):
+            optimize(exposed_film(KNOWN_DOSES), {**PARAMETERS, "solver": "brent"})
+
+
+class OptimizeTest(unittest.TestCase):
+    """The vectorized engine returns the same uint16 dose map as the scalar loop."""
+
+    def assertSameAsScalar(self, parameters):
+        img = film(12, 40)
+        reference = np.stack([optimize_scalar(row, parameters) for row in img])
+        doses = optimize(img, {**parameters, "engine": "vectorized"})
+        self.assertEqual(doses.dtype, np.uint16)
+        np.testing.assert_array_equal(doses, reference)
+
+    def test_vectorized(self):
+        self.assertSameAsScalar(PARAMETERS)
+
+    def test_vectorized_with_normalization(self):
+        self.assertSameAsScalar({**PARAMETERS, **NORMALIZATION})
+
+    def test_warm_engine_is_not_cached(self):
+        # the warm engine seeds pixels from their neighbours, so its doses
+        # must not depend on the cache or on how rows are split
+        img = film(12, 40)
+        parameters = {**PARAMETERS, "engine": "warm", "warm_start_margin": 100.0}
+        reference = np.stack([optimize(row, parameters) for row in img])
+        with tempfile.TemporaryDirectory() as directory:
+            cached = {
+                **parameters,
+                "cache_size": 1000000,
+                "cachePath": os.path.join(directory, "dose_cache.sqlite"),
+            }
+            for _ in range(2):
+                np.testing.assert_array_equal(optimize(img, cached), reference)
+
+
+if __name__ == "__main__":
+    unittest.main()
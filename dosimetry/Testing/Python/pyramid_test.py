@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from optimize_test import exposed_film, PARAMETERS, KNOWN_DOSE_TOLERANCE
+from src.logic_subprocess import solve_regions, open_channel
+from src.threaded_backend import solve_regions_in_threads
+
+# large enough for a coarse level with pyramid_factor 2
+DOSES = np.linspace(300, 2800, 32 * 40).reshape(32, 40)
+
+
+class PyramidTest(unittest.TestCase):
+    """The pyramid solve recovers known doses on both backends."""
+
+    def setUp(self):
+        self.parameters = {
+            **PARAMETERS,
+            "engine": "vectorized",
+            "pyramid_factor": 2,
+            "pyramid_margin": 100.0,
+            "number_of_processes": 2,
+            "tile_rows": 8,
+        }
+        open_channel(lambda frame: None)
+
+    def assertKnownDoses(self, solve):
+        for solver in ["golden", "newton"]:
+            with self.subTest(solver=solver):
+                (doses,) = solve(
+                    [exposed_film(DOSES)], {**self.parameters, "solver": solver}
+                )
+                np.testing.assert_array_equal(doses[-1], 0)
+                np.testing.assert_allclose(
+                    doses[:-1], DOSES[:-1], atol=KNOWN_DOSE_TOLERANCE
+                )
+
+    def test_processes(self):
+        self.assertKnownDoses(solve_regions)
+
+    def test_threads(self):
+        self.assertKnownDoses(solve_regions_in_threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import tifffile
+import SimpleITK as sitk
+from src.scan_reader import (
+    read_scan_regions,
+    read_scan_overview,
+    downsample,
+    scan_information,
+    region_origin,
+)
+
+ROI_BOUNDS = {
+    "sample": (10, 89, 20, 129),
+    "control": (0, 0, 0, 149),
+    "recalibration": (95, 99, 140, 149),
+}
+
+
+class ScanReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.scan = (
+            np.random.default_rng(0).integers(0, 65535, (100, 150, 3)).astype(np.uint16)
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertReadsBack(self, path, scan):
+        regions = read_scan_regions(path, ROI_BOUNDS)
+        for key, (row_min, row_max, col_min, col_max) in ROI_BOUNDS.items():
+            np.testing.assert_array_equal(
+                regions[key], scan[row_min : row_max + 1, col_min : col_max + 1]
+            )
+        overview, factor = read_scan_overview(path, max_size=40)
+        self.assertEqual(factor, 4)
+        np.testing.assert_array_equal(overview, downsample(scan, factor))
+
+    def test_strips(self):
+        path = os.path.join(self.directory.name, "strips.tif")
+        tifffile.imwrite(path, self.scan, rowsperstrip=7)
+        self.assertReadsBack(path, self.scan)
+
+    def test_compressed_tiles(self):
+        path = os.path.join(self.directory.name, "tiles.tif")
+        tifffile.imwrite(path, self.scan, tile=(32, 32), compression="zlib")
+        self.assertReadsBack(path, self.scan)
+
+    def test_grayscale(self):
+        path = os.path.join(self.directory.name, "gray.tif")
+        tifffile.imwrite(path, self.scan[:, :, 0], rowsperstrip=3)
+        self.assertReadsBack(path, self.scan[:, :, 0])
+
+
+class RegionOriginTest(unittest.TestCase):
+    def test_region_is_placed_over_the_scan(self):
+        scan = sitk.GetImageFromArray(np.zeros((100, 150), dtype=np.uint16))
+        scan.SetSpacing((0.25, 0.5))
+        scan.SetOrigin((-3.0, 7.5))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "scan.nrrd")
+            sitk.WriteImage(scan, path)
+            shape, spacing, origin = scan_information(path)
+        self.assertEqual(shape, (100, 150))
+
+        bounds = (10, 89, 20, 129)
+        region = sitk.GetImageFromArray(np.zeros((80, 110), dtype=np.uint16))
+        region.SetSpacing(spacing)
+        region.SetOrigin(region_origin(origin, spacing, bounds))
+        for row, col in [(0, 0), (79, 109), (5, 17)]:
+            self.assertEqual(
+                region.TransformIndexToPhysicalPoint((col, row)),
+                scan.TransformIndexToPhysicalPoint((col + 20, row + 10)),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
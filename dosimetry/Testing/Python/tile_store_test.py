@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.tile_store import TileStore, TileRowWriter
+
+
+class TileStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "result.tiles")
+        self.image = (
+            np.random.default_rng(0).integers(0, 3000, (100, 77)).astype(np.uint16)
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        store = TileStore.create(self.path, self.image.shape, np.uint16, 16)
+        store.write_image(self.image)
+        store.finish()
+
+        store = TileStore(self.path)
+        self.assertTrue(store.index["complete"])
+        self.assertEqual(len(store.index["tiles"]), 7 * 5)
+        np.testing.assert_array_equal(store.read(), self.image)
+        for rows, cols in [
+            ((0, 1), (76, 77)),
+            ((15, 17), (15, 33)),
+            ((90, 200), (0, 5)),
+        ]:
+            np.testing.assert_array_equal(
+                store.read(rows[0], rows[1], cols[0], cols[1]),
+                self.image[rows[0] : rows[1], cols[0] : cols[1]],
+            )
+
+    def test_tile_rows_are_written_when_solved(self):
+        store = TileStore.create(self.path, self.image.shape, np.uint16, 16)
+        writer = TileRowWriter(store, self.image)
+        writer.rows_solved(0, 20)
+        self.assertTrue(os.path.exists(store.tile_path(0, 4)))
+        self.assertFalse(os.path.exists(store.tile_path(1, 0)))
+        # tiles not written yet read as zeros
+        np.testing.assert_array_equal(store.read(16, 32), 0)
+        writer.rows_solved(20, 100)
+        np.testing.assert_array_equal(store.read(), self.image)
+
+    def test_nrrd(self):
+        store = TileStore.create(
+            self.path, self.image.shape, np.uint16, 32, (0.25, 0.5), (1.5, -2.0)
+        )
+        store.write_image(self.image)
+        nrrdPath = os.path.join(self.directory.name, "result.nrrd")
+        store.to_nrrd(nrrdPath)
+
+        with open(nrrdPath, "rb") as f:
+            header, data = f.read().split(b"\n\n", 1)
+        self.assertIn(b"sizes: 77 100", header)
+        self.assertIn(b"space directions: (0.25,0) (0,0.5)", header)
+        self.assertIn(b"space origin: (1.5,-2)", header)
+        np.testing.assert_array_equal(
+            np.frombuffer(data, "<u2").reshape(self.image.shape), self.image
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
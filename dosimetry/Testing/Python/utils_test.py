@@ -0,0 +1,43 @@
+import unittest
+from src.utils import split_into_tiles
+
+
+class SplitIntoTilesTest(unittest.TestCase):
+    def assertCoversRows(self, tiles, n_rows):
+        """Row blocks are non-empty, in order and cover every row exactly once."""
+        self.assertGreater(len(tiles), 0)
+        self.assertEqual(tiles[0][0], 0)
+        self.assertEqual(tiles[-1][1], n_rows)
+        for (start, stop), (next_start, _) in zip(tiles, tiles[1:]):
+            self.assertEqual(stop, next_start)
+        for start, stop in tiles:
+            self.assertLess(start, stop)
+
+    def test_uneven_heights(self):
+        for n_rows in [7, 101, 1023]:
+            for tile_rows in [0, 1, 3, 10, 64, 5000]:
+                with self.subTest(n_rows=n_rows, tile_rows=tile_rows):
+                    tiles = split_into_tiles(n_rows, 37, 6, tile_rows)
+                    self.assertCoversRows(tiles, n_rows)
+                    if tile_rows > 0:
+                        heights = [stop - start for start, stop in tiles]
+                        self.assertTrue(
+                            all(h == min(tile_rows, n_rows) for h in heights[:-1])
+                        )
+
+    def test_single_row(self):
+        for n_columns in [1, 5000]:
+            for tile_rows in [0, 1, 8]:
+                with self.subTest(n_columns=n_columns, tile_rows=tile_rows):
+                    self.assertEqual(
+                        split_into_tiles(1, n_columns, 4, tile_rows), [(0, 1)]
+                    )
+
+    def test_automatic_height_keeps_workers_busy(self):
+        tiles = split_into_tiles(4000, 10, 4)
+        self.assertCoversRows(tiles, 4000)
+        self.assertGreaterEqual(len(tiles), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+from optimize_test import PARAMETERS
+from src import worker_tuning
+from src.worker_tuning import (
+    resolve_worker_count,
+    available_memory,
+    benchmark_path,
+    machine_key,
+    MIN_PIXELS_PER_WORKER,
+    WORKER_MEMORY_BYTES,
+)
+
+AUTO = {**PARAMETERS, "engine": "vectorized", "number_of_processes": "auto"}
+PLENTY_OF_MEMORY = 1024 * WORKER_MEMORY_BYTES
+
+
+class ResolveWorkerCountTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patches = [
+            mock.patch.object(
+                worker_tuning, "user_cache_directory", lambda: self.directory.name
+            ),
+            mock.patch.object(
+                worker_tuning, "available_memory", lambda: PLENTY_OF_MEMORY
+            ),
+            mock.patch("os.cpu_count", lambda: 12),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def record(self, n_workers):
+        with open(benchmark_path(), "w") as f:
+            json.dump({machine_key(): {"number_of_processes": n_workers}}, f)
+
+    def test_explicit_count(self):
+        for value in [3, "3"]:
+            self.assertEqual(
+                resolve_worker_count({**AUTO, "number_of_processes": value}, 10), 3
+            )
+
+    def test_cpu_count_without_benchmark(self):
+        self.assertEqual(resolve_worker_count(AUTO, None, benchmark=False), 12)
+
+    def test_recorded_count(self):
+        self.record(5)
+        self.assertEqual(resolve_worker_count(AUTO, None), 5)
+
+    def test_small_regions(self):
+        self.record(8)
+        self.assertEqual(resolve_worker_count(AUTO, 3 * MIN_PIXELS_PER_WORKER - 1), 3)
+        self.assertEqual(resolve_worker_count(AUTO, 1), 1)
+
+    def test_available_memory(self):
+        self.record(8)
+        with mock.patch.object(
+            worker_tuning, "available_memory", lambda: 2 * WORKER_MEMORY_BYTES + 1
+        ):
+            self.assertEqual(resolve_worker_count(AUTO, None), 2)
+        with mock.patch.object(worker_tuning, "available_memory", lambda: 0):
+            self.assertEqual(resolve_worker_count(AUTO, None), 1)
+
+    def test_benchmark_is_recorded_once(self):
+        with mock.patch.object(worker_tuning, "BENCHMARK_PIXELS", 512), mock.patch(
+            "os.cpu_count", lambda: 2
+        ):
+            n_workers = resolve_worker_count(AUTO, None)
+            self.assertIn(n_workers, [1, 2])
+            self.assertTrue(os.path.exists(benchmark_path()))
+            with mock.patch.object(
+                worker_tuning, "benchmark_worker_count", side_effect=AssertionError
+            ):
+                self.assertEqual(resolve_worker_count(AUTO, None), n_workers)
+
+
+class AvailableMemoryTest(unittest.TestCase):
+    def test_meminfo(self):
+        # MemAvailable includes the page cache, MemFree does not
+        with tempfile.NamedTemporaryFile("w", suffix="meminfo", delete=False) as f:
+            f.write(
+                "MemTotal:  8000000 kB\nMemFree:  1000 kB\nMemAvailable:  6000000 kB\n"
+            )
+        self.addCleanup(os.remove, f.name)
+        with mock.patch.object(worker_tuning, "MEMINFO_PATH", f.name):
+            self.assertEqual(available_memory(), 6000000 * 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
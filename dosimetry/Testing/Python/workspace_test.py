@@ -0,0 +1,96 @@
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+import sys
+import unittest
+from src.workspace import Workspace, OWNER_FILE, LEFTOVER_GRACE, sweep_leftovers
+
+
+class Cancelled(Exception):
+    pass
+
+
+def make_workspace(root, name, owner=None, age=0, size=0):
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    if owner is not None:
+        with open(os.path.join(path, OWNER_FILE), "w") as f:
+            f.write(str(owner))
+    with open(os.path.join(path, "dose.npy"), "wb") as f:
+        f.write(b"\0" * size)
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+    return path
+
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+class WorkspaceTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_sweep_removes_only_stale(self):
+        stale = 2 * LEFTOVER_GRACE
+        active = make_workspace(self.root, "active", owner=os.getpid(), age=stale)
+        released = make_workspace(self.root, "released", age=stale)
+        crashed = make_workspace(self.root, "crashed", owner=exited_pid(), age=stale)
+        fresh = make_workspace(self.root, "fresh")
+
+        sweep_leftovers(self.root, 0)
+
+        self.assertTrue(os.path.isdir(active))
+        self.assertTrue(os.path.isdir(fresh))
+        self.assertFalse(os.path.exists(released))
+        self.assertFalse(os.path.exists(crashed))
+
+    def test_sweep_keeps_newest_within_cap(self):
+        oldest = make_workspace(self.root, "oldest", age=4 * LEFTOVER_GRACE, size=100)
+        older = make_workspace(self.root, "older", age=3 * LEFTOVER_GRACE, size=100)
+        newest = make_workspace(self.root, "newest", age=2 * LEFTOVER_GRACE, size=100)
+
+        sweep_leftovers(self.root, 150)
+
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(older))
+        self.assertTrue(os.path.isdir(newest))
+
+    def test_active_workspace_survives_sweep(self):
+        with Workspace(self.root, "run") as path:
+            os.utime(path, (time.time() - 2 * LEFTOVER_GRACE,) * 2)
+            with Workspace(self.root, "other") as other:
+                self.assertTrue(os.path.isdir(path))
+                self.assertNotEqual(path, other)
+            self.assertTrue(os.path.isdir(path))
+        self.assertEqual(os.listdir(self.root), [])
+
+    def test_discarded_on_cancel(self):
+        with self.assertRaises(Cancelled):
+            with Workspace(self.root, "run", discard_on=Cancelled) as path:
+                raise Cancelled()
+        self.assertFalse(os.path.exists(path))
+
+    def test_kept_on_failure_as_leftover(self):
+        with self.assertRaises(ValueError):
+            with Workspace(self.root, "run", discard_on=Cancelled) as path:
+                with open(os.path.join(path, "run.log"), "w") as f:
+                    f.write("failed")
+                raise ValueError()
+        self.assertTrue(os.path.isdir(path))
+        self.assertFalse(os.path.exists(os.path.join(path, OWNER_FILE)))
+
+        os.utime(path, (time.time() - 2 * LEFTOVER_GRACE,) * 2)
+        with Workspace(self.root, "next"):
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
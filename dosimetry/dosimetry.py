@@ -33,6 +33,11 @@ try:
 except ModuleNotFoundError:
     slicer.util.pip_install("imageio")
 
+try:
+    import tifffile
+except ModuleNotFoundError:
+    slicer.util.pip_install("tifffile")
+
 """
     Imports for compatibility with Slicer
 """
@@ -74,6 +79,15 @@ class dosimetry(ScriptedLoadableModule):
 
         # Additional initialization step after application startup is complete
         slicer.app.connect("startupCompleted()", registerSampleData)
+        slicer.app.connect("startupCompleted()", registerJobRunner)
+
+
+def registerJobRunner():
+    """Let the shared job queue run (and resume) queued dosimetry jobs."""
+    from src.job_queue import job_queue
+
+    runner = DosimetryJobRunner()
+    job_queue().register_runner("dosimetry", runner.run, runner.cancel)
 
 
 def registerSampleData():
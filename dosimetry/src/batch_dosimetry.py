@@ -0,0 +1,343 @@
+"""
+Headless dosimetry of a directory of TIFF scans, without the Slicer GUI.
+Run it with the Python of Slicer from the dosimetry module directory:
+
+    PythonSlicer -m src.batch_dosimetry <scans directory> <calibration file> [options]
+
+Stripes are detected on every scan, all scans are solved by one worker pool
+and a dose map per scan plus a summary CSV with the control and
+recalibration stripe statistics are written to the output directory.
+"""
+
+import os
+from src.native_threads import pin_native_threads
+
+if __name__ == "__main__":
+    # numpy sizes its thread pools when it is imported, the limits of this
+    # process and of the workers it starts are set before the imports below
+    pin_native_threads(os.environ)
+
+import csv
+import json
+import time
+import logging
+import argparse
+import cv2
+import numpy as np
+import SimpleITK as sitk
+from src.detect_dosimetry_stripes import (
+    detect_dosimetry_stripes,
+    scale_roi_coordinates,
+)
+from src.dosimetry_settings import DEFAULT_SETTINGS, parse_settings, create_parameters
+from src.logic_subprocess import (
+    solve_regions,
+    open_channel,
+    ensure_persistent_pool,
+    stop_persistent_pool,
+    install_termination_handler,
+)
+from src.messages import decode_frame, PROGRESS
+from src.optimize import optimize_single_channel
+from src.scan_reader import (
+    scan_information,
+    read_scan_overview,
+    read_scan_regions,
+    region_origin,
+)
+from src.tile_store import TileStore, TILE_STORE_EXTENSION
+from src.workspace import Workspace, scratch_root
+
+SCAN_EXTENSIONS = (".tif", ".tiff")
+SUMMARY_FILE_NAME = "dosimetry_summary.csv"
+SUMMARY_COLUMNS = [
+    "scan",
+    "status",
+    "result",
+    "control_mean",
+    "control_std",
+    "recalibration_mean",
+    "recalibration_std",
+    "seconds",
+    "error",
+]
+# progress lines per second in the log, a batch runs for hours
+PROGRESS_REFRESH_RATE = 0.2
+# size [mm] of the control and recalibration ROIs, as in the module GUI
+DEFAULT_ROI_SIZE = (10.0, 10.0)
+
+
+def scan_paths(scan_directory):
+    return sorted(
+        os.path.join(scan_directory, name)
+        for name in os.listdir(scan_directory)
+        if name.lower().endswith(SCAN_EXTENSIONS)
+    )
+
+
+def load_settings(preset_path=None):
+    """DEFAULT_SETTINGS overridden by a preset saved by the module GUI, parsed."""
+    values = dict(DEFAULT_SETTINGS)
+    if preset_path is not None:
+        with open(preset_path, "r") as f:
+            values.update(json.load(f))
+    return parse_settings(values)
+
+
+def stripe_bounds(roi_coordinates, shape, spacing, roi_size=DEFAULT_ROI_SIZE):
+    """
+    (row_min, row_max, col_min, col_max) of the stripes found by
+    detect_dosimetry_stripes, limits included. The sample keeps its detected
+    size, the control and recalibration ROIs are roi_size millimetres.
+    """
+    sizes = {"sample": (roi_coordinates["sample"]["w"], roi_coordinates["sample"]["h"])}
+    for name in ["control", "recalibration"]:
+        sizes[name] = (
+            int(round(roi_size[0] / spacing[0])),
+            int(round(roi_size[1] / spacing[1])),
+        )
+
+    bounds = {}
+    for name, coordinates in roi_coordinates.items():
+        width, height = sizes[name]
+        col_min = max(0, coordinates["x"] - width // 2)
+        row_min = max(0, coordinates["y"] - height // 2)
+        col_max = min(shape[1] - 1, col_min + width - 1)
+        row_max = min(shape[0] - 1, row_min + height - 1)
+        bounds[name] = (row_min, row_max, col_min, col_max)
+    return bounds
+
+
+def log_frame(frame):
+    kind, value = decode_frame(frame)
+    if kind == PROGRESS:
+        logging.info(
+            f"  {value['stage']}: {value['progress'] * 100:.0f}%"
+            + (f", {value['eta']:.0f} s left" if value["eta"] >= 0 else "")
+        )
+    else:
+        logging.debug(f"  {value[0]}: {value[1]}")
+
+
+def process_scan(
+    scan_path,
+    job_id,
+    calibration_path,
+    output_directory,
+    settings,
+    temp_dir,
+    control_dose=None,
+    recalibration_dose=None,
+    roi_size=DEFAULT_ROI_SIZE,
+):
+    """
+    Detects the stripes of one scan on its overview, saves its dose map and
+    returns its summary row. Only the overview and the stripes of the scan
+    are read, never the whole scan.
+    """
+    shape, spacing, origin = scan_information(scan_path)
+    overview, factor = read_scan_overview(scan_path)
+
+    recalibration = control_dose is not None and recalibration_dose is not None
+    roi_coordinates = scale_roi_coordinates(
+        detect_dosimetry_stripes(overview, recalibration), factor
+    )
+    del overview
+    roi_bounds = stripe_bounds(roi_coordinates, shape, spacing, roi_size)
+    roi_regions = read_scan_regions(scan_path, roi_bounds)
+    # the dose map is placed over the sample stripe of the scan
+    origin = region_origin(origin, spacing, roi_bounds["sample"])
+
+    parameters_path = os.path.join(temp_dir, f"{job_id}.json")
+    parameters = create_parameters(
+        calibration_path,
+        output_directory,
+        settings,
+        control_dose,
+        recalibration_dose,
+        roi_regions,
+        None,
+        None,
+        None,
+        temp_dir,
+    )
+    parameters["jobId"] = job_id
+    parameters["parametersPath"] = parameters_path
+    with open(parameters_path, "w") as f:
+        json.dump(parameters, f, indent=2)
+
+    keys = ["sample", "control", "recalibration"] if recalibration else ["sample"]
+    images = []
+    for key in keys:
+        img = roi_regions[key]
+        if settings["median_kernel_size"] >= 1:
+            img = cv2.medianBlur(img, ksize=settings["median_kernel_size"])
+        images.append(img)
+
+    scan_name = os.path.splitext(os.path.basename(scan_path))[0]
+    store = None
+    if settings["tiled_output"]:
+        result_path = os.path.join(
+            output_directory, f"{scan_name}_dosimetry_result{TILE_STORE_EXTENSION}"
+        )
+        store = TileStore.create(
+            result_path,
+            images[0].shape,
+            np.uint16,
+            settings["output_tile_size"],
+            spacing,
+            origin,
+        )
+
+    if settings["method"] != "triple":
+        doses = [optimize_single_channel(img, parameters) for img in images]
+        if store is not None:
+            store.write_image(doses[0])
+    else:
+        ensure_persistent_pool(parameters)
+        doses = solve_regions(images, parameters, [store] + [None] * (len(images) - 1))
+    doses = dict(zip(keys, doses))
+
+    if store is not None:
+        store.finish()
+    else:
+        result_path = os.path.join(
+            output_directory, f"{scan_name}_dosimetry_result.nrrd"
+        )
+        result = sitk.GetImageFromArray(doses["sample"])
+        result.SetOrigin(origin)
+        result.SetSpacing(spacing)
+        sitk.WriteImage(result, result_path)
+
+    row = {"result": result_path}
+    if recalibration:
+        for key in ["control", "recalibration"]:
+            row[f"{key}_mean"] = f"{float(np.mean(doses[key])):.2f}"
+            row[f"{key}_std"] = f"{float(np.std(doses[key])):.2f}"
+    return row
+
+
+def write_summary(summary_path, rows):
+    with open(summary_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS, restval="")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_batch(
+    scan_directory,
+    calibration_path,
+    output_directory,
+    settings,
+    control_dose=None,
+    recalibration_dose=None,
+    roi_size=DEFAULT_ROI_SIZE,
+):
+    """
+    Dosimetry of every TIFF scan of scan_directory. A scan that fails is
+    recorded in the summary and the batch goes on with the next one.
+    Returns the summary rows.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    paths = scan_paths(scan_directory)
+    rows = []
+    workspace = Workspace(
+        scratch_root(settings), "batch", settings["scratch_leftover_cap"] * 2**20
+    )
+    with workspace as temp_dir:
+        try:
+            for index, path in enumerate(paths):
+                logging.info(f"[{index + 1}/{len(paths)}] {os.path.basename(path)}")
+                startTime = time.time()
+                row = {"scan": os.path.basename(path)}
+                try:
+                    row.update(
+                        process_scan(
+                            path,
+                            f"{os.getpid()}-{index}",
+                            calibration_path,
+                            output_directory,
+                            settings,
+                            temp_dir,
+                            control_dose,
+                            recalibration_dose,
+                            roi_size,
+                        )
+                    )
+                    row["status"] = "done"
+                except Exception as e:
+                    logging.exception(f"Dosimetry of {path} failed")
+                    row["status"] = "failed"
+                    row["error"] = str(e) or type(e).__name__
+                row["seconds"] = f"{time.time() - startTime:.1f}"
+                rows.append(row)
+                write_summary(os.path.join(output_directory, SUMMARY_FILE_NAME), rows)
+        finally:
+            stop_persistent_pool()
+    return rows
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Dosimetry of every TIFF scan in a directory, without the Slicer GUI."
+    )
+    parser.add_argument("scan_directory", help="directory with the TIFF scans")
+    parser.add_argument(
+        "calibration_file", help="calibration file of Stripe Calibration"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="directory of the dose maps and the summary (default: scan directory)",
+    )
+    parser.add_argument(
+        "--settings", help="advanced settings preset saved by the Dosimetry module"
+    )
+    parser.add_argument(
+        "--control-dose",
+        type=float,
+        help="control stripe dose [cGy], with --recalibration-dose enables recalibration",
+    )
+    parser.add_argument(
+        "--recalibration-dose", type=float, help="recalibration stripe dose [cGy]"
+    )
+    parser.add_argument(
+        "--roi-size",
+        type=float,
+        nargs=2,
+        default=DEFAULT_ROI_SIZE,
+        metavar=("HORIZONTAL", "VERTICAL"),
+        help="size of the control and recalibration ROIs [mm]",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    arguments = parser.parse_args(argv)
+    if (arguments.control_dose is None) != (arguments.recalibration_dose is None):
+        parser.error("--control-dose and --recalibration-dose go together")
+    return arguments
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if arguments.verbose else logging.INFO,
+        format="%(asctime)s %(message)s",
+    )
+    install_termination_handler()
+    open_channel(log_frame, PROGRESS_REFRESH_RATE)
+
+    rows = run_batch(
+        arguments.scan_directory,
+        arguments.calibration_file,
+        arguments.output or arguments.scan_directory,
+        load_settings(arguments.settings),
+        arguments.control_dose,
+        arguments.recalibration_dose,
+        arguments.roi_size,
+    )
+    failed = sum(row["status"] == "failed" for row in rows)
+    logging.info(f"{len(rows) - failed} of {len(rows)} scans done")
+    return 1 if failed > 0 else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
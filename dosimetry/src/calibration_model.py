@@ -0,0 +1,163 @@
+import numpy as np
+
+
+def get_calibration_coefficients(parameters):
+    red_parameters = parameters["calibration_parameters"]["r"]
+    green_parameters = parameters["calibration_parameters"]["g"]
+    blue_parameters = parameters["calibration_parameters"]["b"]
+    return [
+        [red_parameters["a"], red_parameters["b"], red_parameters["c"]],
+        [green_parameters["a"], green_parameters["b"], green_parameters["c"]],
+        [blue_parameters["a"], blue_parameters["b"], blue_parameters["c"]],
+    ]
+
+
+def get_normalizations(parameters):
+    # returns None when the film was scanned without control/recalibration stripes
+    if "control_stripe_dose" not in parameters:
+        return None
+    NORM_FACTOR = parameters["normalization_factor"]
+    return [
+        {
+            "dose": parameters["control_stripe_dose"],
+            "means": [
+                parameters["control_rgb_mean"]["r"] / NORM_FACTOR,
+                parameters["control_rgb_mean"]["g"] / NORM_FACTOR,
+                parameters["control_rgb_mean"]["b"] / NORM_FACTOR,
+            ],
+        },
+        {
+            "dose": parameters["recalibration_stripe_dose"],
+            "means": [
+                parameters["recalibration_rgb_mean"]["r"] / NORM_FACTOR,
+                parameters["recalibration_rgb_mean"]["g"] / NORM_FACTOR,
+                parameters["recalibration_rgb_mean"]["b"] / NORM_FACTOR,
+            ],
+        },
+    ]
+
+
+class CalibrationModel(object):
+    """
+    Rational calibration model (a + b * dose) / (c + dose) of the three film
+    channels, optionally rescaled to the control and recalibration stripes.
+    All per-channel constants are computed once and stored as (3, 1) arrays,
+    so every method is batched over an array of doses.
+    The arithmetic follows omega / omega_with_normalizations step by step,
+    objective values are bit-identical to the reference functions.
+    """
+
+    def __init__(self, coefficients, normalizations=None):
+        coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.a = coefficients[:, 0:1]
+        self.b = coefficients[:, 1:2]
+        self.c = coefficients[:, 2:3]
+        self.bc_minus_a = self.b * self.c - self.a
+
+        # without normalization value = 1 * (value - 0) + 0, which is exact
+        self.slope = np.ones((3, 1))
+        self.cp2 = np.zeros((3, 1))
+        self.cr2 = np.zeros((3, 1))
+        if normalizations is not None:
+            cp1 = self.__rational(normalizations[0]["dose"])
+            cp2 = self.__rational(normalizations[1]["dose"])
+            cr1 = np.asarray(normalizations[0]["means"], dtype=np.float64)[:, None]
+            cr2 = np.asarray(normalizations[1]["means"], dtype=np.float64)[:, None]
+            self.slope = (cr1 - cr2) / (cp1 - cp2)
+            self.cp2 = cp2
+            self.cr2 = cr2
+
+        self.tables = {}
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        return cls(
+            get_calibration_coefficients(parameters), get_normalizations(parameters)
+        )
+
+    def __rational(self, doses):
+        return (self.a + self.b * doses) / (self.c + doses)
+
+    def value(self, doses):
+        """Normalized channel values predicted for doses, shape (3, N)."""
+        return self.slope * (self.__rational(doses) - self.cp2) + self.cr2
+
+    def value_derivatives(self, doses):
+        """First and second derivative of value with respect to dose, shape (3, N) each."""
+        d1 = self.slope * self.bc_minus_a / (self.c + doses) ** 2
+        d2 = -2 * d1 / (self.c + doses)
+        return d1, d2
+
+    def inverse(self, values):
+        """
+        Dose estimated independently from each channel, values are normalized
+        pixel values with shape (3, N). Channels outside of the calibrated
+        range give negative or non-finite doses.
+        """
+        rational = (values - self.cr2) / self.slope + self.cp2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.a - self.c * rational) / (rational - self.b)
+
+    def od(self, doses):
+        """Optical densities -log(value) predicted for doses, shape (3, N)."""
+        return -np.log(self.value(doses))
+
+    def objective(self, densities, doses):
+        """omega for pixel densities with shape (3, N) at doses with shape (N,)."""
+        deltas = densities / self.od(doses)
+        return (
+            (deltas[0] - deltas[1]) ** 2
+            + (deltas[0] - deltas[2]) ** 2
+            + (deltas[2] - deltas[1]) ** 2
+        )
+
+    def derivatives(self, densities, doses):
+        """Closed-form first and second derivative of objective with respect to dose."""
+        value = self.value(doses)
+        d1, d2 = self.value_derivatives(doses)
+
+        r = -np.log(value)
+        r1 = -d1 / value
+        r2 = -(d2 * value - d1**2) / value**2
+
+        delta = densities / r
+        delta1 = -densities * r1 / r**2
+        delta2 = -densities * r2 / r**2 + 2 * densities * r1**2 / r**3
+
+        gradient = 0
+        hessian = 0
+        for i, j in [(0, 1), (0, 2), (2, 1)]:
+            difference = delta[i] - delta[j]
+            difference1 = delta1[i] - delta1[j]
+            difference2 = delta2[i] - delta2[j]
+            gradient = gradient + 2 * difference * difference1
+            hessian = hessian + 2 * (difference1**2 + difference * difference2)
+        return gradient, hessian
+
+    def table(self, max_dose, step):
+        """
+        Dose grid from 0 to max_dose with the grid side of the expanded objective.
+        For pixel densities D and u = 1 / od on the grid
+        omega = 2 * sum_i D_i^2 u_i^2 - 2 * sum_{i<j} D_i D_j u_i u_j,
+        so omega for all pixels and grid doses is the matrix product of
+        table_features(D) and the (6, grid size) array returned here.
+        Returns (grid, features, valid) where valid masks grid doses with a
+        finite optical density. Tables are cached on the model.
+        """
+        if (max_dose, step) not in self.tables:
+            n_steps = int(np.ceil(max_dose / step))
+            grid = np.linspace(0, max_dose, n_steps + 1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                u = 1 / self.od(grid)
+            features = 2 * np.concatenate([u**2, -u[[0, 0, 1]] * u[[1, 2, 2]]], axis=0)
+            valid = np.all(np.isfinite(features), axis=0)
+            features[:, ~valid] = 0
+            self.tables[(max_dose, step)] = (grid, features, valid)
+        return self.tables[(max_dose, step)]
+
+    @staticmethod
+    def table_features(densities):
+        """Pixel side of the expanded objective, shape (N, 6)."""
+        return np.concatenate(
+            [densities**2, densities[[0, 0, 1]] * densities[[1, 2, 2]]], axis=0
+        ).T
@@ -100,3 +100,23 @@ def detect_dosimetry_stripes(stripes_tiff, recalibration_stripes_present):
             cy = int(M["m01"] / M["m00"])
             roi_coordinates[name] = {"x": cx, "y": cy}
     return roi_coordinates
+
+
+def scale_roi_coordinates(roi_coordinates, factor):
+    """
+    Coordinates found by detect_dosimetry_stripes on an overview downsampled
+    by factor, in pixels of the full resolution scan. The sample loses one
+    overview pixel on every side, as its edges are only known to factor pixels.
+    """
+    if factor == 1:
+        return roi_coordinates
+    scaled = {}
+    for name, coordinates in roi_coordinates.items():
+        scaled[name] = {
+            "x": coordinates["x"] * factor + factor // 2,
+            "y": coordinates["y"] * factor + factor // 2,
+        }
+        if "w" in coordinates:
+            scaled[name]["w"] = max(factor, (coordinates["w"] - 2) * factor)
+            scaled[name]["h"] = max(factor, (coordinates["h"] - 2) * factor)
+    return scaled
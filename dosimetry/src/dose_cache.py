@@ -0,0 +1,132 @@
+import os
+import time
+import sqlite3
+import numpy as np
+
+
+def pack_triplets(pixels):
+    # r, g and b are uint16, so a triplet fits in a single sqlite INTEGER
+    pixels = pixels.reshape(-1, 3).astype(np.int64)
+    return (pixels[:, 0] << 32) | (pixels[:, 1] << 16) | pixels[:, 2]
+
+
+class DoseCache(object):
+    """
+    LRU-bounded sqlite store mapping RGB triplets to solved doses.
+    Entries of different calibration models live in the same file and share
+    the max_entries budget. The database runs in WAL mode, so several pool
+    workers can read it concurrently while one of them writes.
+    hits and misses count lookups of this instance, statistics() returns
+    the counters accumulated in the file by all processes.
+    """
+
+    def __init__(self, path, model_key, max_entries):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.model_key = model_key
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS doses ("
+                "model TEXT, triplet INTEGER, dose INTEGER, last_used REAL, "
+                "PRIMARY KEY (model, triplet)) WITHOUT ROWID"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS doses_last_used ON doses (last_used)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS statistics (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO statistics VALUES (?, 0)",
+                [("hits",), ("misses",), ("entries",)],
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, pixels):
+        """
+        Returns (doses, found) for an array of RGB triplets with shape (N, 3),
+        doses of triplets that are not cached are left as 0.
+        """
+        triplets = pack_triplets(pixels)
+        doses = np.zeros(triplets.shape[0], dtype=np.uint16)
+        found = np.zeros(triplets.shape[0], dtype=bool)
+
+        self.connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS wanted (id INTEGER, triplet INTEGER)"
+        )
+        self.connection.execute("DELETE FROM wanted")
+        self.connection.executemany(
+            "INSERT INTO wanted VALUES (?, ?)", enumerate(triplets.tolist())
+        )
+        rows = self.connection.execute(
+            "SELECT wanted.id, doses.dose FROM wanted "
+            "JOIN doses ON doses.model = ? AND doses.triplet = wanted.triplet",
+            (self.model_key,),
+        ).fetchall()
+        self.connection.commit()
+
+        if len(rows) > 0:
+            ids, values = np.array(rows, dtype=np.int64).T
+            doses[ids] = values
+            found[ids] = True
+
+        hits = int(found.sum())
+        self.hits += hits
+        self.misses += triplets.shape[0] - hits
+        self.__touch(triplets[found], hits, triplets.shape[0] - hits)
+        return doses, found
+
+    def store(self, pixels, doses):
+        triplets = pack_triplets(pixels)
+        now = time.time()
+        with self.connection:
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO doses VALUES (?, ?, ?, ?)",
+                [
+                    (self.model_key, triplet, dose, now)
+                    for triplet, dose in zip(triplets.tolist(), doses.tolist())
+                ],
+            )
+            self.__increment("entries", cursor.rowcount)
+            entries = self.connection.execute(
+                "SELECT value FROM statistics WHERE name = 'entries'"
+            ).fetchone()[0]
+            if entries > self.max_entries:
+                cursor = self.connection.execute(
+                    "DELETE FROM doses WHERE (model, triplet) IN "
+                    "(SELECT model, triplet FROM doses ORDER BY last_used LIMIT ?)",
+                    (entries - self.max_entries,),
+                )
+                self.__increment("entries", -cursor.rowcount)
+
+    def statistics(self):
+        rows = self.connection.execute("SELECT name, value FROM statistics").fetchall()
+        return dict(rows)
+
+    def __touch(self, triplets, hits, misses):
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE doses SET last_used = ? WHERE model = ? AND triplet = ?",
+                [(now, self.model_key, triplet) for triplet in triplets.tolist()],
+            )
+            self.__increment("hits", hits)
+            self.__increment("misses", misses)
+
+    def __increment(self, name, value):
+        self.connection.execute(
+            "UPDATE statistics SET value = value + ? WHERE name = ?", (value, name)
+        )
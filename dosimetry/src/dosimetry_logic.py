@@ -9,15 +9,48 @@ from slicer.ScriptedLoadableModule import *
 from slicer import vtkMRMLVectorVolumeNode, vtkMRMLScalarVolumeNode
 
 import slicer.util
+import sitkUtils
+import vtk
 from src.dosimetry_parameter_node import dosimetryParameterNode
-from src.detect_dosimetry_stripes import detect_dosimetry_stripes
-from src.utils import isFloat
+from src.detect_dosimetry_stripes import (
+    detect_dosimetry_stripes,
+    scale_roi_coordinates,
+)
+from src.dosimetry_settings import create_parameters
+from src.messages import read_frames, decode_frame, PROGRESS
+from src.optimize import optimize_single_channel
+from src.scan_reader import (
+    image_overview,
+    read_scan_regions,
+    scan_information,
+    region_origin,
+)
+from src.shared_arrays import SharedArray
+from src.tile_store import TileStore, TILE_STORE_EXTENSION
+from src.threaded_backend import solve_regions_in_threads
+from src.dosimetry_service import CANCEL_JOB
+from src.workspace import Workspace, scratch_root, input_key
+from src.native_threads import pin_native_threads
 import subprocess
+import secrets
+import signal
+import threading
+from multiprocessing.connection import Client
 import SimpleITK as sitk
-import shutil
 import cv2
 import numpy as np
 
+# worker service shared by all logic instances of the Slicer session
+DOSIMETRY_SERVICE = {}
+
+# seconds a cancelled worker gets to release its pool before it is killed
+TERMINATE_TIMEOUT = 10.0
+
+
+class DosimetryCancelledError(Exception):
+    pass
+
+
 # DosimetryLogic
 #
 
@@ -35,6 +68,9 @@ class dosimetryLogic(ScriptedLoadableModuleLogic):
     def __init__(self) -> None:
         """Called when the logic class is instantiated. Can be used for initializing member variables."""
         ScriptedLoadableModuleLogic.__init__(self)
+        self.__cancelEvent = threading.Event()
+        self.__runningProcess = None
+        self.__runningConnection = None
 
     def getParameterNode(self):
         return dosimetryParameterNode(super().getParameterNode())
@@ -49,83 +85,347 @@ class dosimetryLogic(ScriptedLoadableModuleLogic):
         controlStripeDose=None,
         recalibrationStripeDose=None,
         progressUpdate=None,
+        statusUpdate=None,
+    ):
+        """
+        Run the processing algorithm and wait for the result.
+        Can be used without GUI widget.
+        """
+        roiRegions = self.extractRoiRegions(inputImage, roiNodes)
+        return self.runDosimetryOnRegions(
+            roiRegions,
+            calibrationFilePath,
+            outputDirectoryPath,
+            advancedSettings,
+            controlStripeDose,
+            recalibrationStripeDose,
+            progressUpdate,
+            statusUpdate,
+        )
+
+    def runDosimetryOnRegions(
+        self,
+        roiRegions,
+        calibrationFilePath: str,
+        outputDirectoryPath: str,
+        advancedSettings,
+        controlStripeDose=None,
+        recalibrationStripeDose=None,
+        progressUpdate=None,
+        statusUpdate=None,
+        sampleStorePath=None,
     ):
+        """
+        Dosimetry of regions returned by extractRoiRegions. The scene is not
+        accessed, so this can run in a background thread. cancelDosimetry()
+        called from another thread stops the run, which then raises
+        DosimetryCancelledError. Every run keeps its files in a workspace of
+        its own, see src.workspace. The sample doses are also saved to the
+        TileStore at sampleStorePath, when given.
+        """
         import time
 
+        self.__cancelEvent.clear()
         startTime = time.time()
-        logging.info(f"Processing started")
+        method = advancedSettings.get("method", "triple")
+        logging.info(f"Processing started, method: {method}")
 
         workDir = os.path.join(os.path.dirname(__file__), "..")
-        tempDir = os.path.join(workDir, "temp")
-        os.makedirs(tempDir, exist_ok=True)
 
-        roiRegions = self.__extractRoiRegions(inputImage, roiNodes)
+        def reportProgress(value):
+            if self.__cancelEvent.is_set():
+                raise DosimetryCancelledError()
+            if progressUpdate is not None:
+                progressUpdate(value)
+
+        backend = advancedSettings.get("backend", "subprocess")
+        if method != "triple" or backend == "inprocess":
+            store = TileStore(sampleStorePath) if sampleStorePath is not None else None
+            if method != "triple":
+                solveRegions = lambda images, parameters: [
+                    optimize_single_channel(img, parameters) for img in images
+                ]
+            else:
+                # the sample comes first, its tile rows are saved as they are solved
+                solveRegions = lambda images, parameters: solve_regions_in_threads(
+                    images,
+                    parameters,
+                    reportProgress,
+                    [store] + [None] * (len(images) - 1),
+                )
+            result = self.__runInProcessDosimetry(
+                roiRegions,
+                calibrationFilePath,
+                outputDirectoryPath,
+                advancedSettings,
+                controlStripeDose,
+                recalibrationStripeDose,
+                solveRegions,
+            )
+            if store is not None:
+                if method != "triple":
+                    store.write_image(result[0])
+                store.finish()
+            reportProgress(1.0)
+            stopTime = time.time()
+            logging.info(
+                f"Processing ({method}, in process) completed in {stopTime-startTime:.2f} seconds"
+            )
+            return result
 
-        sampleRegionFilePath = self.__exportRegion(
-            roiRegions, "sample", tempDir, advancedSettings["median_kernel_size"]
-        )
-        controlRegionFilePath, recalibrationRegionFilePath = None, None
+        # regions and the result are handed over in shared memory named in
+        # the parameters, no image files are written
+        keys = ["sample"]
         if controlStripeDose is not None and recalibrationStripeDose is not None:
-            controlRegionFilePath = self.__exportRegion(
-                roiRegions, "control", tempDir, advancedSettings["median_kernel_size"]
+            keys.extend(["control", "recalibration"])
+        regions = {}
+        try:
+            for key in keys:
+                regions[key] = SharedArray.copy_of(
+                    self.__filterRegion(
+                        roiRegions[key], advancedSettings["median_kernel_size"]
+                    )
+                )
+            regions["result"] = SharedArray.create(
+                regions["sample"].shape[:2], np.uint16
             )
-            recalibrationRegionFilePath = self.__exportRegion(
-                roiRegions,
-                "recalibration",
-                tempDir,
-                advancedSettings["median_kernel_size"],
+            descriptors = {key: block.descriptor for key, block in regions.items()}
+
+            workspace = Workspace(
+                scratch_root(advancedSettings),
+                input_key(
+                    [regions[key].array for key in keys],
+                    calibrationFilePath,
+                    controlStripeDose,
+                    recalibrationStripeDose,
+                    sorted(advancedSettings.items()),
+                ),
+                advancedSettings.get("scratch_leftover_cap", 64) * 2**20,
+                discard_on=DosimetryCancelledError,
             )
+            with workspace as tempDir:
+                parameters = create_parameters(
+                    calibrationFilePath,
+                    outputDirectoryPath,
+                    advancedSettings,
+                    controlStripeDose,
+                    recalibrationStripeDose,
+                    roiRegions,
+                    descriptors["sample"],
+                    descriptors.get("control"),
+                    descriptors.get("recalibration"),
+                    tempDir,
+                )
+                parameters["sampleResult"] = descriptors["result"]
+                parameters["sampleStore"] = sampleStorePath
+                parameters_path = os.path.join(tempDir, "sample.json")
+                with open(parameters_path, "w") as f:
+                    json.dump(parameters, f, indent=2)
+
+                messages = None
+                if advancedSettings.get("service_idle_timeout", 0) > 0:
+                    messages = self.__serviceMessages(
+                        workDir, parameters_path, advancedSettings
+                    )
+                if messages is None:
+                    process = self.__createProcessingProcess(
+                        workDir, tempDir, parameters_path
+                    )
+                    messages = self.__monitorProcessing(process, tempDir)
+                    self.__runningProcess = process
+                if self.__cancelEvent.is_set():
+                    self.__cancelRunningJob()
+
+                resultReported = False
+                control_mean, control_std, recalibration_mean, recalibration_std = (
+                    None,
+                    None,
+                    None,
+                    None,
+                )
+                cacheStatistics = {}
+                for kind, message in messages:
+                    if kind == PROGRESS:
+                        if progressUpdate is not None:
+                            progressUpdate(message["progress"])
+                        if statusUpdate is not None:
+                            statusUpdate(message["stage"], message["eta"])
+                        continue
+                    tag, value = message
+                    if tag == "sample":
+                        resultReported = True
+                    elif tag in ["cache_hits", "cache_misses", "cache_entries"]:
+                        cacheStatistics[tag] = int(value)
+                    elif tag == "statistic":
+                        logging.info(f"Solver statistic {value}")
+                    elif tag == "error":
+                        logging.error(f"Dosimetry service error: {value}")
+                    elif tag == "dedupe_ratio":
+                        logging.info(
+                            f"Unique RGB triplets: {float(value) * 100:.2f}% of all pixels"
+                        )
+                    elif tag == "control_mean":
+                        control_mean = float(value)
+                    elif tag == "control_std":
+                        control_std = float(value)
+                    elif tag == "recalibration_mean":
+                        recalibration_mean = float(value)
+                    elif tag == "recalibration_std":
+                        recalibration_std = float(value)
+
+                self.__runningProcess = None
+                self.__runningConnection = None
+                if self.__cancelEvent.is_set():
+                    logging.info("Processing cancelled")
+                    raise DosimetryCancelledError()
+
+                if len(cacheStatistics) > 0:
+                    logging.info(
+                        "Dose cache: {cache_hits} hits, {cache_misses} misses, {cache_entries} entries".format(
+                            **cacheStatistics
+                        )
+                    )
+
+                assert resultReported
+                img = regions["result"].array.copy()
+        finally:
+            for block in regions.values():
+                block.close()
+                block.unlink()
 
-        parameters = self.__createParametersDict(
-            calibrationFilePath,
-            outputDirectoryPath,
-            advancedSettings,
-            controlStripeDose,
-            recalibrationStripeDose,
-            roiRegions,
-            sampleRegionFilePath,
-            controlRegionFilePath,
-            recalibrationRegionFilePath,
-            tempDir,
+        stopTime = time.time()
+        logging.info(
+            f"Processing ({method}) completed in {stopTime-startTime:.2f} seconds"
         )
-        parameters_path = os.path.join(tempDir, "sample.json")
-        with open(parameters_path, "w") as f:
-            json.dump(parameters, f, indent=2)
+        return img, control_mean, control_std, recalibration_mean, recalibration_std
 
-        process = self.__createProcessingProcess(workDir, parameters_path)
+    def createDosimetryJob(
+        self,
+        inputImage: vtkMRMLVectorVolumeNode,
+        calibrationFilePath: str,
+        outputDirectoryPath: str,
+        roiNodes,
+        advancedSettings,
+        controlStripeDose=None,
+        recalibrationStripeDose=None,
+    ):
+        """
+        Arguments of a queued dosimetry job. The scan is referenced by its file
+        and the ROIs by their IJK bounds, so the job runs without the scene and
+        survives a restart of Slicer.
+        """
+        storageNode = inputImage.GetStorageNode()
+        if storageNode is None or not storageNode.GetFileName():
+            raise ValueError("Input volume has to be loaded from a file to be queued")
+        return {
+            "scanPath": storageNode.GetFileName(),
+            "roiBounds": self.roiBounds(inputImage, roiNodes),
+            "calibrationFilePath": calibrationFilePath,
+            "outputDirectoryPath": outputDirectoryPath,
+            "advancedSettings": advancedSettings,
+            "controlStripeDose": controlStripeDose,
+            "recalibrationStripeDose": recalibrationStripeDose,
+        }
 
-        result_path = None
-        control_mean, control_std, recalibration_mean, recalibration_std = (
-            None,
-            None,
-            None,
-            None,
+    def runDosimetryJob(self, jobId, arguments, cpus, progressUpdate=None):
+        """
+        Runs a job created by createDosimetryJob with cpus workers, returns a
+        summary message. Only the ROIs of the scan file are read. With the
+        tiled_output setting the dose map is saved as a TileStore while it is
+        solved, instead of as one NRRD file at the end. The dose map is placed
+        over the sample ROI of the scan.
+        """
+        _shape, spacing, scanOrigin = scan_information(arguments["scanPath"])
+        origin = region_origin(scanOrigin, spacing, arguments["roiBounds"]["sample"])
+        roiRegions = read_scan_regions(arguments["scanPath"], arguments["roiBounds"])
+        scanName = os.path.splitext(os.path.basename(arguments["scanPath"]))[0]
+        storePath = None
+        if arguments["advancedSettings"].get("tiled_output", 0):
+            storePath = os.path.join(
+                arguments["outputDirectoryPath"],
+                f"{scanName}_dosimetry_result{TILE_STORE_EXTENSION}",
+            )
+            TileStore.create(
+                storePath,
+                roiRegions["sample"].shape,
+                np.uint16,
+                arguments["advancedSettings"]["output_tile_size"],
+                spacing,
+                origin,
+            )
+
+        (
+            calibrated_image,
+            control_mean,
+            control_std,
+            recalibration_mean,
+            recalibration_std,
+        ) = self.runDosimetryOnRegions(
+            roiRegions,
+            arguments["calibrationFilePath"],
+            arguments["outputDirectoryPath"],
+            {**arguments["advancedSettings"], "number_of_processes": cpus},
+            arguments["controlStripeDose"],
+            arguments["recalibrationStripeDose"],
+            progressUpdate,
+            sampleStorePath=storePath,
         )
-        for message in self.__monitorProcessing(process):
-            tag, value = message.split(";", 1)
-            value = value.strip()
-            tag = tag.strip()
-            if tag == "progress":
-                if progressUpdate is not None and isFloat(value):
-                    progressUpdate(float(value))
-            elif tag == "sample":
-                result_path = value
-            elif tag == "control_mean":
-                control_mean = float(value)
-            elif tag == "control_std":
-                control_std = float(value)
-            elif tag == "recalibration_mean":
-                recalibration_mean = float(value)
-            elif tag == "recalibration_std":
-                recalibration_std = float(value)
-
-        assert result_path is not None
-        imgSITK = sitk.ReadImage(result_path)
-        img = sitk.GetArrayFromImage(imgSITK)
 
-        stopTime = time.time()
-        logging.info(f"Processing completed in {stopTime-startTime:.2f} seconds")
-        return img, control_mean, control_std, recalibration_mean, recalibration_std
+        saveFileName = storePath
+        if storePath is None:
+            saveFileName = os.path.join(
+                arguments["outputDirectoryPath"], f"{scanName}_dosimetry_result.nrrd"
+            )
+            saveImg = sitk.GetImageFromArray(calibrated_image)
+            saveImg.SetOrigin(origin)
+            saveImg.SetSpacing(spacing)
+            sitk.WriteImage(saveImg, saveFileName)
+
+        message = f"Saved {saveFileName}"
+        if control_mean is not None:
+            message += (
+                f", control mean {control_mean:.2f} std {control_std:.2f}"
+                f", recalibration mean {recalibration_mean:.2f} std {recalibration_std:.2f}"
+            )
+        return message
+
+    def cancelDosimetry(self):
+        """Stops a run of runDosimetryOnRegions executing in another thread."""
+        self.__cancelEvent.set()
+        self.__cancelRunningJob()
+
+    def __cancelRunningJob(self):
+        """
+        Terminates the per-run process. A job of the worker service is
+        cancelled over its connection instead, the service keeps running.
+        """
+        process = self.__runningProcess
+        if process is not None:
+            self.__terminateProcess(process)
+        connection = self.__runningConnection
+        if connection is not None:
+            try:
+                connection.send(CANCEL_JOB)
+            except OSError:
+                # the job has finished and its connection is closed
+                pass
+
+    def __terminateProcess(self, process):
+        """
+        Asks the worker to exit, it then cancels its pending tasks and releases
+        its shared memory. Workers that do not exit in time are killed.
+        """
+        if process.poll() is not None:
+            return
+        if os.name == "nt":
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            process.terminate()
+        threading.Timer(TERMINATE_TIMEOUT, self.__killProcess, args=(process,)).start()
+
+    def __killProcess(self, process):
+        if process.poll() is None:
+            process.kill()
 
     def detectStripes(self, volume_node, recalibration_stripes_present):
         """
@@ -136,111 +436,244 @@ class dosimetryLogic(ScriptedLoadableModuleLogic):
         if not volume_node or recalibration_stripes_present is None:
             raise ValueError("Input or output volume is invalid")
 
-        img = slicer.util.arrayFromVolume(volume_node)
-        img = img.reshape((img.shape[-3], img.shape[-2], img.shape[-1]))
-        output = detect_dosimetry_stripes(img, recalibration_stripes_present)
-
-        return output
+        # large scans are detected on an overview, the detection time grows with the pixel count
+        overview, factor = image_overview(self.__volumeArray(volume_node))
+        output = detect_dosimetry_stripes(overview, recalibration_stripes_present)
 
-    def __exportRegion(self, roiRegions, key, tempDir, kernel_size):
-        img = roiRegions[key]
+        return scale_roi_coordinates(output, factor)
 
-        if kernel_size >= 1:
-            img = cv2.medianBlur(img, ksize=kernel_size)
-
-        imSITK = sitk.GetImageFromArray(img)
-        fname = os.path.join(tempDir, f"{key}.nii")
-        sitk.WriteImage(imSITK, fname)
-        return fname
-
-    def __createParametersDict(
+    def __runInProcessDosimetry(
         self,
+        roiRegions,
         calibrationFilePath,
         outputDirectoryPath,
         advancedSettings,
         controlStripeDose,
         recalibrationStripeDose,
-        roiRegions,
-        sampleRegionFilePath,
-        controlRegionFilePath,
-        recalibrationRegionFilePath,
-        tempDir,
+        solveRegions,
     ):
-        parameters = {
-            **advancedSettings,
-            "outputDirectoryPath": outputDirectoryPath,
-            "sampleRegionFilePath": sampleRegionFilePath,
-            "tempPath": tempDir,
-        }
-
+        """
+        Dose of every region computed in this process by solveRegions(images, parameters),
+        no worker subprocess is started and no temporary region files are written.
+        """
+        parameters = create_parameters(
+            calibrationFilePath,
+            outputDirectoryPath,
+            advancedSettings,
+            controlStripeDose,
+            recalibrationStripeDose,
+            roiRegions,
+            None,
+            None,
+            None,
+            None,
+        )
+        keys = ["sample"]
         if controlStripeDose is not None and recalibrationStripeDose is not None:
-            control_rgb_mean = {
-                c: roiRegions["control"][:, :, i].mean()
-                for i, c in enumerate(["r", "g", "b"])
-            }
-            recalibration_rgb_mean = {
-                c: roiRegions["recalibration"][:, :, i].mean()
-                for i, c in enumerate(["r", "g", "b"])
-            }
-            parameters["control_stripe_dose"] = controlStripeDose
-            parameters["recalibration_stripe_dose"] = recalibrationStripeDose
-            parameters["control_rgb_mean"] = control_rgb_mean
-            parameters["recalibration_rgb_mean"] = recalibration_rgb_mean
-            parameters["controlRegionFilePath"] = controlRegionFilePath
-            parameters["recalibrationRegionFilePath"] = recalibrationRegionFilePath
-
-        with open(calibrationFilePath, "r") as f:
-            calibration_parameters = json.load(f)
-        parameters["calibration_parameters"] = calibration_parameters
-        return parameters
-
-    def __createProcessingProcess(self, workDir, parameters_path):
-        slicerDir = os.getcwd()
+            keys.extend(["control", "recalibration"])
+        images = solveRegions(
+            [
+                self.__filterRegion(
+                    roiRegions[key], advancedSettings["median_kernel_size"]
+                )
+                for key in keys
+            ],
+            parameters,
+        )
+        doses = dict(zip(keys, images))
+
+        control_mean, control_std, recalibration_mean, recalibration_std = (
+            None,
+            None,
+            None,
+            None,
+        )
+        if "control" in doses:
+            control_mean = float(doses["control"].mean())
+            control_std = float(doses["control"].std())
+            recalibration_mean = float(doses["recalibration"].mean())
+            recalibration_std = float(doses["recalibration"].std())
+        return (
+            doses["sample"],
+            control_mean,
+            control_std,
+            recalibration_mean,
+            recalibration_std,
+        )
+
+    def __filterRegion(self, img, kernel_size):
+        if kernel_size >= 1:
+            img = cv2.medianBlur(img, ksize=kernel_size)
+        return img
+
+    def __processingEnvironment(self):
         env = os.environ.copy()
         env["PYTHONPATH"] = (
-            env["PYTHONPATH"]
+            env.get("PYTHONPATH", "")
             + os.pathsep
             + os.path.join(os.path.dirname(__file__), "..").replace("\\\\", "/")
         )
+        return pin_native_threads(env)
+
+    def __pythonSlicerExecutable(self):
+        """PythonSlicer launcher of the running Slicer, on Windows and Linux alike."""
+        slicerDir = getattr(slicer.app, "slicerHome", None) or os.getcwd()
+        return os.path.join(slicerDir, "bin", "PythonSlicer")
+
+    def __creationFlags(self):
+        # Windows only: no console window, and a process group of its own so
+        # that a cancel can send CTRL_BREAK_EVENT to the worker
+        return getattr(subprocess, "CREATE_NO_WINDOW", 0) | getattr(
+            subprocess, "CREATE_NEW_PROCESS_GROUP", 0
+        )
+
+    def __createProcessingProcess(self, workDir, tempDir, parameters_path):
         cmd = [
-            os.path.join(slicerDir, "bin", "PythonSlicer"),
+            self.__pythonSlicerExecutable(),
             os.path.join(workDir, "src", "logic_subprocess.py"),
             parameters_path,
         ]
         process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            creationflags=(subprocess.CREATE_NO_WINDOW),
-            env=env,
-            text=True,
+            stderr=open(os.path.join(tempDir, "dosimetry_subprocess.log"), "w"),
+            creationflags=self.__creationFlags(),
+            env=self.__processingEnvironment(),
         )
         return process
 
-    def __monitorProcessing(self, process):
-        while True:
-            line = process.stdout.readline()
-            if not line:
-                break
-            yield line
-        stderr_output = process.stderr.read()
-        if stderr_output:
+    def __startService(self, workDir, logDir, idleTimeout):
+        """Starts the dosimetry worker service and waits until it reports its address."""
+        os.makedirs(logDir, exist_ok=True)
+        authkey = secrets.token_bytes(32)
+        env = self.__processingEnvironment()
+        env["DOSIMETRY_SERVICE_KEY"] = authkey.hex()
+        cmd = [
+            self.__pythonSlicerExecutable(),
+            os.path.join(workDir, "src", "dosimetry_service.py"),
+            str(idleTimeout),
+        ]
+        process = subprocess.Popen(
+            cmd,
+            cwd=workDir,
+            stdout=subprocess.PIPE,
+            stderr=open(os.path.join(logDir, "dosimetry_service.log"), "a"),
+            creationflags=self.__creationFlags(),
+            env=env,
+            text=True,
+        )
+        tag, value = process.stdout.readline().strip().split(";", 1)
+        assert tag == "address"
+        host, port = value.rsplit(":", 1)
+        DOSIMETRY_SERVICE["process"] = process
+        DOSIMETRY_SERVICE["address"] = (host, int(port))
+        DOSIMETRY_SERVICE["authkey"] = authkey
+        logging.info(f"Dosimetry service started on {host}:{port}")
+
+    def __serviceMessages(self, workDir, parameters_path, advancedSettings):
+        """
+        Submits the job to the worker service, starting it first when it is
+        not running. Returns None when the service cannot be reached, the
+        caller then falls back to a per-run process.
+        """
+        try:
+            process = DOSIMETRY_SERVICE.get("process")
+            if process is None or process.poll() is not None:
+                # the service outlives the run, its log goes to the scratch root
+                self.__startService(
+                    workDir,
+                    scratch_root(advancedSettings),
+                    advancedSettings["service_idle_timeout"],
+                )
+            connection = Client(
+                DOSIMETRY_SERVICE["address"], authkey=DOSIMETRY_SERVICE["authkey"]
+            )
+            connection.send(os.path.abspath(parameters_path))
+            self.__runningConnection = connection
+        except Exception as e:
+            logging.warning(f"Dosimetry service unavailable ({e}), using a new process")
+            DOSIMETRY_SERVICE.clear()
+            return None
+        return self.__monitorService(connection)
+
+    def __monitorService(self, connection):
+        with connection:
+            while True:
+                try:
+                    frame = connection.recv_bytes()
+                except EOFError:
+                    if not self.__cancelEvent.is_set():
+                        logging.error("Dosimetry service closed the connection")
+                    break
+                if len(frame) == 0:
+                    break
+                yield decode_frame(frame)
+
+    def __monitorProcessing(self, process, tempDir):
+        yield from read_frames(process.stdout)
+        returnCode = process.wait()
+        with open(os.path.join(tempDir, "dosimetry_subprocess.log"), "r") as f:
+            stderr_output = f.read()
+        if stderr_output and not self.__cancelEvent.is_set():
             logging.error(f"Error: {stderr_output.strip()}")
-        logging.info(f"Finished with code: {process.wait()}")
+        logging.info(f"Finished with code: {returnCode}")
 
-    def __extractRoiRegions(self, volume_node, roi_nodes):
+    def createResultVolume(
+        self, inputImage, sampleBounds, calibratedImage, name="dosimetry_result"
+    ):
+        """
+        Scalar volume node with the dose of the sample region, placed over the
+        sample of inputImage: same spacing and orientation, origin at the first
+        voxel of sampleBounds returned by roiBounds.
+        """
+        row_min, row_max, col_min, col_max = sampleBounds
+        ijkToRas = vtk.vtkMatrix4x4()
+        inputImage.GetIJKToRASMatrix(ijkToRas)
+        origin = ijkToRas.MultiplyPoint([col_min, row_min, 0, 1])
+        for i in range(3):
+            ijkToRas.SetElement(i, 3, origin[i])
+        return slicer.util.addVolumeFromArray(
+            calibratedImage[np.newaxis],
+            ijkToRAS=ijkToRas,
+            name=slicer.mrmlScene.GenerateUniqueName(name),
+            nodeClassName="vtkMRMLScalarVolumeNode",
+        )
+
+    def saveVolumeInBackground(self, volumeNode, fileName):
+        """
+        Writes volumeNode to fileName in a background thread. The voxels are
+        copied first, so the node can be used while the file is written.
+        Returns a dict whose "done" event is set once the file is written,
+        with the exception in "error" if writing failed.
+        """
+        image = sitkUtils.PullVolumeFromSlicer(volumeNode)
+        save = {"fileName": fileName, "done": threading.Event(), "error": None}
+
+        def write():
+            try:
+                sitk.WriteImage(image, fileName)
+            except Exception as e:
+                save["error"] = e
+            save["done"].set()
+
+        threading.Thread(target=write, daemon=True).start()
+        return save
+
+    def extractRoiRegions(self, volume_node, roi_nodes):
         """Extract regions in IJK format and convert to arrays."""
-        # Get image properties
-        image_data = slicer.util.arrayFromVolume(volume_node)  # Get numpy array
-        image_data = image_data.reshape(
-            (image_data.shape[-3], image_data.shape[-2], image_data.shape[-1])
+        return self.cropRegions(
+            self.__volumeArray(volume_node), self.roiBounds(volume_node, roi_nodes)
         )
 
+    def roiBounds(self, volume_node, roi_nodes):
+        """IJK bounds (row_min, row_max, col_min, col_max) of every ROI node, limits included."""
+        # Get image properties
+        image_data = self.__volumeArray(volume_node)
         spacing = volume_node.GetSpacing()
         origin = volume_node.GetOrigin()
 
         # Prepare result storage
-        roi_regions = {}
+        roi_bounds = {}
 
         for key, roi_node in roi_nodes.items():
             # Get ROI parameters
@@ -258,10 +691,42 @@ class dosimetryLogic(ScriptedLoadableModuleLogic):
             col_max = min(image_data.shape[1] - 1, col_max)
             row_max = min(image_data.shape[0] - 1, row_max)
 
-            # Extract region as numpy array
-            roi_pixels = image_data[row_min : row_max + 1, col_min : col_max + 1]
+            roi_bounds[key] = (row_min, row_max, col_min, col_max)
+
+        return roi_bounds
 
-            # Store result
-            roi_regions[key] = roi_pixels
+    def cropRegions(self, image_data, roi_bounds):
+        """Views of image_data inside roi_bounds returned by roiBounds."""
+        return {
+            key: image_data[row_min : row_max + 1, col_min : col_max + 1]
+            for key, (row_min, row_max, col_min, col_max) in roi_bounds.items()
+        }
+
+    def __volumeArray(self, volume_node):
+        image_data = slicer.util.arrayFromVolume(volume_node)  # Get numpy array
+        return image_data.reshape(
+            (image_data.shape[-3], image_data.shape[-2], image_data.shape[-1])
+        )
+
+
+class DosimetryJobRunner(object):
+    """
+    Runner of queued dosimetry jobs, see src.job_queue. Every job gets its own
+    logic instance, so jobs running at the same time are cancelled separately.
+    """
 
-        return roi_regions
+    def __init__(self):
+        self.logics = {}
+
+    def run(self, jobId, arguments, cpus, progressUpdate):
+        logic = dosimetryLogic()
+        self.logics[jobId] = logic
+        try:
+            return logic.runDosimetryJob(jobId, arguments, cpus, progressUpdate)
+        finally:
+            self.logics.pop(jobId, None)
+
+    def cancel(self, jobId):
+        logic = self.logics.get(jobId)
+        if logic is not None:
+            logic.cancelDosimetry()
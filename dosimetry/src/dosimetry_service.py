@@ -0,0 +1,132 @@
+import sys
+import os
+import json
+import time
+import threading
+import traceback
+from multiprocessing.connection import Listener, Client
+from src.logic_subprocess import (
+    run_job,
+    open_channel,
+    JOB_CANCELLED,
+    JobCancelledError,
+    report,
+    install_termination_handler,
+    ensure_persistent_pool,
+    stop_persistent_pool,
+)
+from src.native_threads import pin_native_threads
+
+SERVICE_HOST = "127.0.0.1"
+WATCHDOG_INTERVAL = 1.0
+
+# sent by the driver over the job connection to cancel the job
+CANCEL_JOB = "cancel"
+
+
+class DosimetryService(object):
+    """
+    Long-lived dosimetry worker started once per Slicer session.
+    Jobs are parameter file paths sent over a local authenticated connection,
+    the message frames of logic_subprocess are sent back and an empty frame
+    ends a job. CANCEL_JOB sent over the same connection cancels the job,
+    the service and its pool keep running.
+    The process pool and the calibration models cached in its workers are
+    kept between jobs. The service shuts down after idle_timeout seconds
+    without a job or when Slicer exits.
+    """
+
+    def __init__(self, idle_timeout, authkey):
+        self.idle_timeout = idle_timeout
+        self.authkey = authkey
+        self.listener = Listener((SERVICE_HOST, 0), authkey=authkey)
+        self.parent_pid = os.getppid()
+        self.last_activity = time.time()
+        self.busy = False
+        self.stopping = False
+        self.jobs = 0
+
+    @property
+    def address(self):
+        return self.listener.address
+
+    def serve(self):
+        threading.Thread(target=self.__watchdog, daemon=True).start()
+        try:
+            while True:
+                connection = self.listener.accept()
+                if self.stopping:
+                    connection.close()
+                    break
+                with connection:
+                    self.busy = True
+                    self.__serveJob(connection)
+                    self.busy = False
+                    self.last_activity = time.time()
+        finally:
+            self.listener.close()
+            stop_persistent_pool()
+
+    def __serveJob(self, connection):
+        watcher = None
+        try:
+            parameters_path = connection.recv()
+            with open(parameters_path, "r") as f:
+                parameters = json.load(f)
+            self.jobs += 1
+            parameters["jobId"] = f"{os.getpid()}-{self.jobs}"
+            parameters["parametersPath"] = parameters_path
+            ensure_persistent_pool(parameters)
+
+            open_channel(
+                connection.send_bytes, parameters.get("progress_refresh_rate", 10.0)
+            )
+            JOB_CANCELLED.clear()
+            watcher = threading.Thread(
+                target=self.__watchCancel, args=(connection,), daemon=True
+            )
+            watcher.start()
+            run_job(parameters)
+        except (EOFError, ConnectionError):
+            return
+        except JobCancelledError:
+            pass
+        except Exception:
+            traceback.print_exc()
+            stop_persistent_pool()
+            report("error", traceback.format_exc().splitlines()[-1])
+        connection.send_bytes(b"")
+        if watcher is not None:
+            # the driver closes its end after the empty frame
+            watcher.join(WATCHDOG_INTERVAL)
+
+    def __watchCancel(self, connection):
+        try:
+            while True:
+                if connection.recv() == CANCEL_JOB:
+                    JOB_CANCELLED.set()
+        except (EOFError, OSError):
+            return
+
+    def __watchdog(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            idle = not self.busy and (
+                time.time() - self.last_activity > self.idle_timeout
+            )
+            if idle or os.getppid() != self.parent_pid:
+                # closing the listener does not interrupt accept, wake it up instead
+                self.stopping = True
+                Client(self.address, authkey=self.authkey).close()
+                return
+
+
+if __name__ == "__main__":
+    install_termination_handler()
+    pin_native_threads(os.environ)
+    idle_timeout = float(sys.argv[1])
+    authkey = bytes.fromhex(os.environ["DOSIMETRY_SERVICE_KEY"])
+    service = DosimetryService(idle_timeout, authkey)
+    host, port = service.address
+    print(f"address;{host}:{port}", flush=True)
+    service.serve()
@@ -0,0 +1,155 @@
+import os
+import json
+from src.workspace import user_cache_directory
+
+
+def choice_of(*options):
+    def parse(x):
+        x = x.strip()
+        if x not in options:
+            raise ValueError(f"{x} is not one of {options}")
+        return x
+
+    return parse
+
+
+DEFAULT_SETTINGS = {
+    "median_kernel_size": "0",
+    "tolerance": "0.01",
+    "max_iterations": "1000",
+    "normalization_factor": "65536",
+    "max_dose": "3000",
+    "number_of_processes": "auto",
+    "method": "triple",
+    "backend": "subprocess",
+    "tile_rows": "0",
+    "start_method": "default",
+    "engine": "vectorized",
+    "solver": "golden",
+    "deduplicate": "0",
+    "cache_size": "0",
+    "warm_start_margin": "100",
+    "pyramid_factor": "1",
+    "pyramid_margin": "100",
+    "inverse_bracket": "0",
+    "inverse_bracket_margin": "100",
+    "service_idle_timeout": "0",
+    "progress_refresh_rate": "10",
+    "scratch_root": "",
+    "scratch_leftover_cap": "64",
+    "tiled_output": "0",
+    "output_tile_size": "512",
+}
+
+SETTINGS_LABELS = {
+    "median_kernel_size": "Median kernel size (0 for no filter)",
+    "tolerance": "Tolerance",
+    "max_iterations": "Max number of iterations",
+    "normalization_factor": "Image normalization factor",
+    "max_dose": "Maximal possible dose [cGy]",
+    "number_of_processes": "Number of workers (auto to tune for this machine)",
+    "method": "Dosimetry method (triple | red | weighted)",
+    "backend": "Processing backend (subprocess | inprocess)",
+    "tile_rows": "Rows per worker task (0 for automatic)",
+    "start_method": "Worker start method (default | fork | forkserver | spawn)",
+    "engine": "Solver engine (scalar | vectorized | table | warm)",
+    "solver": "Minimization method (golden | brent | newton)",
+    "deduplicate": "Solve each RGB triplet once (0 or 1, ignored by the warm engine and with tiled output)",
+    "cache_size": "Dose cache size in triplets (0 to disable, ignored by the warm engine)",
+    "warm_start_margin": "Warm start search margin [cGy]",
+    "pyramid_factor": "Pyramid downsampling factor (1 to disable)",
+    "pyramid_margin": "Pyramid search margin [cGy]",
+    "inverse_bracket": "Bracket search with single-channel doses (0 or 1)",
+    "inverse_bracket_margin": "Single-channel bracket margin [cGy]",
+    "service_idle_timeout": "Worker service idle shutdown [s] (0 for a new process per run)",
+    "progress_refresh_rate": "Progress updates per second",
+    "scratch_root": "Scratch directory of run files (empty for tmpfs or system temp)",
+    "scratch_leftover_cap": "Size cap of files kept from failed runs [MB]",
+    "tiled_output": "Save queued and batch dose maps as compressed tiles (0 or 1)",
+    "output_tile_size": "Tile size of tiled dose maps [px]",
+}
+
+SETTINGS_PREPROCESSING = {
+    "median_kernel_size": lambda x: int(x),
+    "tolerance": lambda x: float(x),
+    "max_iterations": lambda x: int(x),
+    "normalization_factor": lambda x: int(x),
+    "max_dose": lambda x: float(x),
+    "number_of_processes": lambda x: x if x == "auto" else int(x),
+    "method": choice_of("triple", "red", "weighted"),
+    "backend": choice_of("subprocess", "inprocess"),
+    "tile_rows": lambda x: int(x),
+    "start_method": choice_of("default", "fork", "forkserver", "spawn"),
+    "engine": choice_of("scalar", "vectorized", "table", "warm"),
+    "solver": choice_of("golden", "brent", "newton"),
+    "deduplicate": lambda x: int(x),
+    "cache_size": lambda x: int(x),
+    "warm_start_margin": lambda x: float(x),
+    "pyramid_factor": lambda x: int(x),
+    "pyramid_margin": lambda x: float(x),
+    "inverse_bracket": lambda x: int(x),
+    "inverse_bracket_margin": lambda x: float(x),
+    "service_idle_timeout": lambda x: float(x),
+    "progress_refresh_rate": lambda x: float(x),
+    "scratch_root": lambda x: x.strip(),
+    "scratch_leftover_cap": lambda x: float(x),
+    "tiled_output": lambda x: int(x),
+    "output_tile_size": lambda x: int(x),
+}
+
+
+def parse_settings(values):
+    """Settings of DEFAULT_SETTINGS parsed from their text values, raises ValueError listing the invalid ones."""
+    settings = {}
+    errors = []
+    for label, text in values.items():
+        try:
+            settings[label] = SETTINGS_PREPROCESSING[label](text)
+        except:
+            errors.append(f"{SETTINGS_LABELS[label]} is invalid.")
+    if len(errors) > 0:
+        raise ValueError("\n".join(errors))
+    return settings
+
+
+def create_parameters(
+    calibrationFilePath,
+    outputDirectoryPath,
+    advancedSettings,
+    controlStripeDose,
+    recalibrationStripeDose,
+    roiRegions,
+    sampleRegion,
+    controlRegion,
+    recalibrationRegion,
+    tempDir,
+):
+    """Parameters of a dosimetry job as read by logic_subprocess."""
+    parameters = {
+        **advancedSettings,
+        "outputDirectoryPath": outputDirectoryPath,
+        "sampleRegion": sampleRegion,
+        "tempPath": tempDir,
+        "cachePath": os.path.join(user_cache_directory(), "dose_cache.sqlite"),
+    }
+
+    if controlStripeDose is not None and recalibrationStripeDose is not None:
+        control_rgb_mean = {
+            c: roiRegions["control"][:, :, i].mean()
+            for i, c in enumerate(["r", "g", "b"])
+        }
+        recalibration_rgb_mean = {
+            c: roiRegions["recalibration"][:, :, i].mean()
+            for i, c in enumerate(["r", "g", "b"])
+        }
+        parameters["control_stripe_dose"] = controlStripeDose
+        parameters["recalibration_stripe_dose"] = recalibrationStripeDose
+        parameters["control_rgb_mean"] = control_rgb_mean
+        parameters["recalibration_rgb_mean"] = recalibration_rgb_mean
+        parameters["controlRegion"] = controlRegion
+        parameters["recalibrationRegion"] = recalibrationRegion
+
+    with open(calibrationFilePath, "r") as f:
+        calibration_parameters = json.load(f)
+    parameters["calibration_parameters"] = calibration_parameters
+    return parameters
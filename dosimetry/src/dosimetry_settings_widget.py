@@ -2,33 +2,12 @@ import os
 import json
 import qt
 import slicer
-
-DEFAULT_SETTINGS = {
-    "median_kernel_size": "0",
-    "tolerance": "0.01",
-    "max_iterations": "1000",
-    "normalization_factor": "65536",
-    "max_dose": "3000",
-    "number_of_processes": "6",
-}
-
-SETTINGS_LABELS = {
-    "median_kernel_size": "Median kernel size (0 for no filter)",
-    "tolerance": "Tolerance",
-    "max_iterations": "Max number of iterations",
-    "normalization_factor": "Image normalization factor",
-    "max_dose": "Maximal possible dose [cGy]",
-    "number_of_processes": "Number of workers",
-}
-
-SETTINGS_PREPROCESSING = {
-    "median_kernel_size": lambda x: int(x),
-    "tolerance": lambda x: float(x),
-    "max_iterations": lambda x: int(x),
-    "normalization_factor": lambda x: int(x),
-    "max_dose": lambda x: float(x),
-    "number_of_processes": lambda x: int(x),
-}
+from src.dosimetry_settings import (
+    DEFAULT_SETTINGS,
+    SETTINGS_LABELS,
+    SETTINGS_PREPROCESSING,
+    parse_settings,
+)
 
 
 class DosimetrySettingsWidget(object):
@@ -132,13 +111,6 @@ class DosimetrySettingsWidget(object):
                 )
 
     def getData(self):
-        settings = {}
-        errors = []
-        for label, lineEdit in self.textInputs.items():
-            try:
-                settings[label] = self.settings_preprocessing[label](lineEdit.text)
-            except:
-                errors.append(f"{self.settings_labels[label]} is invalid.")
-        if len(errors) > 0:
-            raise ValueError("\n".join(errors))
-        return settings
+        return parse_settings(
+            {label: lineEdit.text for label, lineEdit in self.textInputs.items()}
+        )
@@ -1,5 +1,7 @@
 import logging
 import os
+import queue
+import threading
 from typing import Annotated, Optional
 
 import ctk
@@ -29,11 +31,12 @@ matplotlib.use("Agg")
 import qt
 from qt import QObject, Signal, Slot
 
-from src.dosimetry_logic import dosimetryLogic
+from src.dosimetry_logic import dosimetryLogic, DosimetryCancelledError
 from src.dosimetry_parameter_node import dosimetryParameterNode
 from src.dosimetry_settings_widget import DosimetrySettingsWidget
+from src.job_queue import job_queue
+from src.job_queue_widget import JobQueueWidget
 from src.utils import isFloat, point2dToRas
-import SimpleITK as sitk
 
 
 #
@@ -41,6 +44,7 @@ import SimpleITK as sitk
 #
 class Communicate(QObject):
     setProgressValue = Signal(int)
+    setProgressText = Signal(str)
 
 
 class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
@@ -58,6 +62,10 @@ class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.stripesDetected = False
         self.roi_nodes = {}
         self.settingsWidget = None
+        self.runThread = None
+        self.runState = {}
+        self.runUpdates = queue.Queue()
+        self.pendingSaves = []
 
     def setup(self) -> None:
         """Called when the user opens the module the first time and the widget is initialized."""
@@ -86,6 +94,8 @@ class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
         # Buttons
         self.ui.runButton.connect("clicked(bool)", self.onRunButton)
+        self.ui.cancelButton.connect("clicked(bool)", self.onCancelButton)
+        self.ui.queueButton.connect("clicked(bool)", self.onQueueButton)
         self.ui.detectStripesButton.connect("clicked(bool)", self.onDetectStripes)
 
         self.settingsCollapsibleButton = ctk.ctkCollapsibleButton()
@@ -101,12 +111,24 @@ class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             parentWidget=self.settingsCollapsibleButton
         )
         self.settingsFormLayout.addWidget(self.settingsWidget.widget)
+
+        self.jobQueueWidget = JobQueueWidget(parentWidget=uiWidget)
+        self.layout.addWidget(self.jobQueueWidget.widget)
         # Make sure parameter node is initialized (needed for module reload)
 
         self.monitor = Communicate()
         self.monitor.setProgressValue.connect(self.setProgressBar)
+        self.monitor.setProgressText.connect(self.setProgressBarText)
 
         self.ui.progressBar.visible = False
+        self.ui.cancelButton.visible = False
+
+        self.runTimer = qt.QTimer()
+        self.runTimer.setInterval(100)
+        self.runTimer.connect("timeout()", self.__onRunTimer)
+        self.saveTimer = qt.QTimer()
+        self.saveTimer.setInterval(200)
+        self.saveTimer.connect("timeout()", self.__onSaveTimer)
         self.ui.controlResult.visible = False
         self.ui.recalibrationResult.visible = False
 
@@ -148,9 +170,24 @@ class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         self.ui.progressBar.setValue(value)
         slicer.util.resetSliceViews()
 
+    def setProgressBarText(self, text) -> None:
+        self.ui.progressBar.setFormat(text)
+
+    def __progressText(self, stage, eta):
+        if eta < 0:
+            return f"{stage}: %p%"
+        return f"{stage}: %p% (about {eta:.0f} s left)"
+
     def cleanup(self) -> None:
         """Called when the application closes and the module widget is destroyed."""
         self.removeObservers()
+        self.jobQueueWidget.cleanup()
+        if self.isRunning():
+            self.logic.cancelDosimetry()
+        self.saveTimer.stop()
+        # let result files being written in the background be completed
+        for resultVolume, save in self.pendingSaves:
+            save["done"].wait()
 
     def enter(self) -> None:
         """Called each time the user opens this module."""
@@ -219,14 +256,17 @@ class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             self._parameterNode
             and self._parameterNode.inputImage is not None
             and self.stripesDetected
+            and not self.isRunning()
         ):
             self.ui.runButton.toolTip = _("Run measurement")
             self.ui.runButton.enabled = True
+            self.ui.queueButton.enabled = True
         else:
             self.ui.runButton.toolTip = _(
                 "Select input volume, detect stripes and calibration file path"
             )
             self.ui.runButton.enabled = False
+            self.ui.queueButton.enabled = False
 
         if self._parameterNode and self._parameterNode.inputImage is not None:
             self.ui.detectStripesButton.toolTip = _("Detect stripes")
@@ -272,35 +312,72 @@ class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             slicer.util.errorDisplay("\n".join(errors))
             return
 
+        self.ui.controlResult.visible = False
+        self.ui.recalibrationResult.visible = False
+        self.ui.progressBar.setValue(0)
+        self.ui.progressBar.visible = True
+        self.ui.progressBar.setFormat("%p%")
+        input_volume_node = self.ui.inputImageSelector.currentNode()
+
+        roiRegions = None
         with slicer.util.tryWithErrorDisplay(
             _("Failed to compute results."), waitCursor=True
         ):
-            self.ui.controlResult.visible = False
-            self.ui.recalibrationResult.visible = False
-            self.ui.progressBar.setValue(0)
-            self.ui.progressBar.visible = True
-            progressUpdateCallback = lambda x: self.monitor.setProgressValue.emit(
-                int(x * 100)
-            )
-            input_volume_node = self.ui.inputImageSelector.currentNode()
-            outputPath = (
-                self.ui.outputSelector.currentPath
-                if self.ui.overrideOutputDirectoryCheckbox.checked
-                else os.path.dirname(input_volume_node.GetStorageNode().GetFileName())
-            )
+            outputPath, control_dose, recalibration_dose = self.__runInputs()
+            sampleBounds = self.logic.roiBounds(
+                input_volume_node, {"sample": self.roi_nodes["sample"]}
+            )["sample"]
+            roiRegions = self.logic.extractRoiRegions(input_volume_node, self.roi_nodes)
+        if roiRegions is None:
+            return
+
+        # the run thread only queues updates, the timer applies them on the main thread
+        progressUpdateCallback = lambda x: self.runUpdates.put(("progress", x))
+        statusUpdateCallback = lambda stage, eta: self.runUpdates.put(
+            ("status", self.__progressText(stage, eta))
+        )
+        self.runState = {
+            "inputVolume": input_volume_node,
+            "sampleBounds": sampleBounds,
+            "outputPath": outputPath,
+            "result": None,
+            "error": None,
+        }
+        self.runThread = threading.Thread(
+            target=self.__runInBackground,
+            args=(
+                roiRegions,
+                self.ui.calibrationFileSelector.currentPath,
+                outputPath,
+                advancedSettings,
+                control_dose,
+                recalibration_dose,
+                progressUpdateCallback,
+                statusUpdateCallback,
+            ),
+            daemon=True,
+        )
+        self.runThread.start()
+        self.ui.cancelButton.enabled = True
+        self.ui.cancelButton.visible = True
+        self._checkCanRun()
+        self.runTimer.start()
+
+    def onQueueButton(self) -> None:
+        errors = self.__onRunButtonCheck()
+
+        try:
+            advancedSettings = self.settingsWidget.getData()
+        except ValueError as e:
+            errors.append(e.args[0])
+        if len(errors) > 0:
+            slicer.util.errorDisplay("\n".join(errors))
+            return
 
-            control_dose, recalibration_dose = None, None
-            if "recalibration" in self.roi_nodes and "control" in self.roi_nodes:
-                control_dose = float(self.ui.controlStripeDose.text)
-                recalibration_dose = float(self.ui.recalibrationStripeDose.text)
-
-            (
-                calibrated_image,
-                control_mean,
-                control_std,
-                recalibration_mean,
-                recalibration_std,
-            ) = self.logic.runDosimetry(
+        with slicer.util.tryWithErrorDisplay(_("Failed to queue the job.")):
+            input_volume_node = self.ui.inputImageSelector.currentNode()
+            outputPath, control_dose, recalibration_dose = self.__runInputs()
+            arguments = self.logic.createDosimetryJob(
                 input_volume_node,
                 self.ui.calibrationFileSelector.currentPath,
                 outputPath,
@@ -308,34 +385,140 @@ class dosimetryWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
                 advancedSettings,
                 control_dose,
                 recalibration_dose,
-                progressUpdate=progressUpdateCallback,
             )
+            cpus = advancedSettings["number_of_processes"]
+            job_queue().submit(
+                "dosimetry",
+                input_volume_node.GetName(),
+                arguments,
+                os.cpu_count() if cpus == "auto" else cpus,
+            )
+            self.jobQueueWidget.widget.collapsed = False
+            self.jobQueueWidget.refresh()
 
-            for node in self.roi_nodes.values():
-                slicer.mrmlScene.RemoveNode(node)
-            self.roi_nodes = {}
-            self.stripesDetected = False
-            self._checkCanRun()
+    def __runInputs(self):
+        """(outputPath, control_dose, recalibration_dose) chosen in the GUI."""
+        input_volume_node = self.ui.inputImageSelector.currentNode()
+        outputPath = (
+            self.ui.outputSelector.currentPath
+            if self.ui.overrideOutputDirectoryCheckbox.checked
+            else os.path.dirname(input_volume_node.GetStorageNode().GetFileName())
+        )
 
-            saveFileName = os.path.join(outputPath, "dosimetry_result.nrrd")
-            saveImg = sitk.GetImageFromArray(calibrated_image)
-            saveImg.SetOrigin(input_volume_node.GetOrigin())
-            saveImg.SetSpacing(input_volume_node.GetSpacing())
-            sitk.WriteImage(saveImg, saveFileName)
-            if (
-                control_mean is not None
-                and control_std is not None
-                and recalibration_mean is not None
-                and recalibration_std is not None
-            ):
-                self.ui.controlResult.text = (
-                    f"Control stripe mean: {control_mean:.2f}, std:{control_std:.2f}"
-                )
-                self.ui.recalibrationResult.text = f"Recalibration stripe mean: {recalibration_mean:.2f}, std:{recalibration_std:.2f}"
-                self.ui.controlResult.visible = True
-                self.ui.recalibrationResult.visible = True
+        control_dose, recalibration_dose = None, None
+        if "recalibration" in self.roi_nodes and "control" in self.roi_nodes:
+            control_dose = float(self.ui.controlStripeDose.text)
+            recalibration_dose = float(self.ui.recalibrationStripeDose.text)
+        return outputPath, control_dose, recalibration_dose
+
+    def onCancelButton(self) -> None:
+        self.ui.cancelButton.enabled = False
+        self.ui.progressBar.setFormat(_("Cancelling..."))
+        self.logic.cancelDosimetry()
+
+    def isRunning(self):
+        return self.runThread is not None and self.runThread.is_alive()
+
+    def __runInBackground(self, *args):
+        try:
+            self.runState["result"] = self.logic.runDosimetryOnRegions(*args)
+        except Exception as e:
+            self.runState["error"] = e
+
+    def __onRunTimer(self):
+        while not self.runUpdates.empty():
+            kind, value = self.runUpdates.get()
+            if kind == "progress":
+                self.monitor.setProgressValue.emit(int(value * 100))
+            elif self.ui.cancelButton.enabled:
+                self.monitor.setProgressText.emit(value)
+        if self.isRunning():
+            return
 
-            slicer.util.loadVolume(saveFileName, properties={"show": True})
+        self.runTimer.stop()
+        self.runThread = None
+        self.ui.cancelButton.visible = False
+        self._checkCanRun()
+
+        error = self.runState["error"]
+        if isinstance(error, DosimetryCancelledError):
+            self.ui.progressBar.setFormat(_("Cancelled"))
+            return
+        if error is not None:
+            logging.error(f"Dosimetry failed: {error}")
+            slicer.util.errorDisplay(
+                _("Failed to compute results."), detailedText=str(error)
+            )
+            return
+
+        with slicer.util.tryWithErrorDisplay(
+            _("Failed to compute results."), waitCursor=True
+        ):
+            self.__showDosimetryResult(
+                self.runState["result"],
+                self.runState["inputVolume"],
+                self.runState["sampleBounds"],
+                self.runState["outputPath"],
+            )
+
+    def __showDosimetryResult(
+        self, result, input_volume_node, sampleBounds, outputPath
+    ):
+        (
+            calibrated_image,
+            control_mean,
+            control_std,
+            recalibration_mean,
+            recalibration_std,
+        ) = result
+
+        for node in self.roi_nodes.values():
+            slicer.mrmlScene.RemoveNode(node)
+        self.roi_nodes = {}
+        self.stripesDetected = False
+        self._checkCanRun()
+
+        # the dose is shown right away, the file is written in the background
+        resultVolume = self.logic.createResultVolume(
+            input_volume_node, sampleBounds, calibrated_image
+        )
+        slicer.util.setSliceViewerLayers(background=resultVolume, fit=True)
+        save = self.logic.saveVolumeInBackground(
+            resultVolume, os.path.join(outputPath, "dosimetry_result.nrrd")
+        )
+        self.pendingSaves.append((resultVolume, save))
+        self.saveTimer.start()
+
+        if (
+            control_mean is not None
+            and control_std is not None
+            and recalibration_mean is not None
+            and recalibration_std is not None
+        ):
+            self.ui.controlResult.text = (
+                f"Control stripe mean: {control_mean:.2f}, std:{control_std:.2f}"
+            )
+            self.ui.recalibrationResult.text = f"Recalibration stripe mean: {recalibration_mean:.2f}, std:{recalibration_std:.2f}"
+            self.ui.controlResult.visible = True
+            self.ui.recalibrationResult.visible = True
+
+    def __onSaveTimer(self):
+        """Links saved result volumes to their files, e.g. for gamma analysis."""
+        for resultVolume, save in list(self.pendingSaves):
+            if not save["done"].is_set():
+                continue
+            self.pendingSaves.remove((resultVolume, save))
+            if save["error"] is not None:
+                logging.error(f"Failed to save {save['fileName']}: {save['error']}")
+                slicer.util.errorDisplay(
+                    _("Failed to save the dosimetry result."),
+                    detailedText=str(save["error"]),
+                )
+            elif slicer.mrmlScene.IsNodePresent(resultVolume):
+                resultVolume.AddDefaultStorageNode(save["fileName"])
+                logging.info(f"Saved {save['fileName']}")
+        if len(self.pendingSaves) == 0:
+            self.saveTimer.stop()
 
     def onDetectStripes(self) -> None:
         with slicer.util.tryWithErrorDisplay(
@@ -0,0 +1,75 @@
+import ctk
+import qt
+from src.job_queue import job_queue, RUNNING
+
+JOB_QUEUE_COLUMNS = ["Job", "Type", "Status", "Progress", "Message"]
+REFRESH_INTERVAL_MS = 500
+
+
+class JobQueueWidget:
+    """
+    Collapsible table with the status of every job of the shared job queue.
+    Also drives the queue's main thread jobs from its refresh timer.
+    """
+
+    def __init__(self, parentWidget=None):
+        self.widget = ctk.ctkCollapsibleButton(parentWidget)
+        self.widget.text = "Job Queue"
+        self.widget.collapsed = True
+        layout = qt.QVBoxLayout(self.widget)
+
+        self.table = qt.QTableWidget()
+        self.table.setColumnCount(len(JOB_QUEUE_COLUMNS))
+        self.table.setHorizontalHeaderLabels(JOB_QUEUE_COLUMNS)
+        self.table.setSelectionBehavior(qt.QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        buttonsLayout = qt.QHBoxLayout()
+        self.cancelButton = qt.QPushButton("Cancel Selected Job")
+        self.cancelButton.connect("clicked(bool)", self.onCancelButton)
+        buttonsLayout.addWidget(self.cancelButton)
+        self.removeFinishedButton = qt.QPushButton("Remove Finished Jobs")
+        self.removeFinishedButton.connect("clicked(bool)", self.onRemoveFinishedButton)
+        buttonsLayout.addWidget(self.removeFinishedButton)
+        layout.addLayout(buttonsLayout)
+
+        self.jobIds = []
+        self.timer = qt.QTimer()
+        self.timer.setInterval(REFRESH_INTERVAL_MS)
+        self.timer.connect("timeout()", self.refresh)
+        self.timer.start()
+
+    def cleanup(self):
+        self.timer.stop()
+
+    def refresh(self):
+        queue = job_queue()
+        queue.run_main_thread_jobs()
+        jobs = queue.snapshot()
+        self.jobIds = [job["id"] for job in jobs]
+        self.table.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            progress = (
+                f"{job['progress'] * 100:.0f}%" if job["status"] == RUNNING else ""
+            )
+            values = [
+                job["title"],
+                job["kind"],
+                job["status"],
+                progress,
+                job["message"],
+            ]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, qt.QTableWidgetItem(value))
+
+    def onCancelButton(self):
+        row = self.table.currentRow()
+        if 0 <= row < len(self.jobIds):
+            job_queue().cancel(self.jobIds[row])
+            self.refresh()
+
+    def onRemoveFinishedButton(self):
+        job_queue().remove_finished()
+        self.refresh()
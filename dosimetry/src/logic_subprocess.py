@@ -1,108 +1,570 @@
 import sys
 import os
+import signal
+import threading
 import concurrent.futures
 import concurrent
-from src.optimize import optimize
-from src.utils import parrarelize_processes
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from src.optimize import (
+    optimize,
+    optimize_seeded,
+    deduplicate_pixels,
+    solves_triplets_independently,
+    calibration_model_key,
+    SOLVER_STATISTICS,
+)
+from src.dose_cache import DoseCache
+from src.worker_tuning import resolve_worker_count
+from src.native_threads import pin_native_threads
+from src.messages import MessageChannel
+from src.shared_arrays import (
+    SharedArray,
+    attached_array,
+    release_attached,
+    share_resource_tracker,
+)
+from src.tile_store import TileStore, TileRowWriter
+from src.utils import (
+    parrarelize_processes,
+    process_context,
+    split_into_tiles,
+    initialize_worker,
+    worker_parameters,
+    WORKER_STATE,
+)
 import json
-import SimpleITK as sitk
 import numpy as np
 
+DEDUPLICATION_CHUNK_SIZE = 4096
+PYRAMID_MIN_SIZE = 8
+
+# modules imported once by the forkserver instead of by every worker
+FORKSERVER_PRELOAD = ["numpy", "src.optimize"]
+
+# pool kept alive between jobs by the dosimetry worker service
+PERSISTENT_POOL = {}
+
+# MessageChannel the driver reports to, see open_channel
+OUTPUT = {}
+
+# set by the dosimetry worker service when the driver cancels the running job
+JOB_CANCELLED = threading.Event()
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+def open_channel(send, refresh_rate=10.0):
+    OUTPUT["channel"] = MessageChannel(send, refresh_rate)
+
+
+def output_channel():
+    if "channel" not in OUTPUT:
+        open_channel(write_stdout)
+    return OUTPUT["channel"]
+
+
+def write_stdout(frame):
+    sys.stdout.buffer.write(frame)
+    sys.stdout.buffer.flush()
+
+
+def report(tag, value):
+    output_channel().message(tag, value)
+
+
+def report_stage(name):
+    output_channel().stage(name)
+
+
+def report_progress(progress):
+    output_channel().progress(progress)
+
+
+def shared_array(descriptor):
+    """Shared block attached once per pool worker and kept open until the worker exits."""
+    return attached_array(descriptor, WORKER_STATE.setdefault("attached", {}))
+
+
+def optimize_task(source, target, start, stop):
+    """
+    Solves rows start:stop of the shared source array and writes the doses
+    into the shared target array, returns the solver counters of this task.
+    """
+    SOLVER_STATISTICS.clear()
+    shared_array(target)[start:stop] = optimize(
+        shared_array(source)[start:stop], worker_parameters()
+    )
+    return dict(SOLVER_STATISTICS)
+
+
+def optimize_seeded_task(source, seeds, target, start, stop):
+    SOLVER_STATISTICS.clear()
+    shared_array(target)[start:stop] = optimize_seeded(
+        shared_array(source)[start:stop],
+        shared_array(seeds)[start:stop],
+        worker_parameters(),
+    )
+    return dict(SOLVER_STATISTICS)
 
-def run_dosimetry(parameters):
-    sampleImgSITK = sitk.ReadImage(parameters["sampleRegionFilePath"])
-    sampleImg = sitk.GetArrayFromImage(sampleImgSITK)
-    args_list = [(sampleImg[y], parameters) for y in range(sampleImg.shape[0])]
-    results_sample = {}
 
+def job_task(job, parameters_path, task, *args):
+    """
+    Runs task in a worker of the persistent pool. The worker serves many jobs,
+    so parameters are loaded from the job's parameters file once per job
+    instead of by the pool initializer. Blocks attached for the previous job
+    are closed when the job changes, its driver has unlinked them already and
+    their memory is only freed once no worker keeps them mapped.
+    """
+    if WORKER_STATE.get("job") != job:
+        release_attached(WORKER_STATE.setdefault("attached", {}))
+        with open(parameters_path, "r") as f:
+            initialize_worker(json.load(f))
+        WORKER_STATE["job"] = job
+    return task(*args)
+
+
+def run_tasks(args_list, parameters, task=optimize_task, stage="solve", task_done=None):
+    """
+    Runs task for every argument tuple, prints progress after each task and
+    the summed solver statistics at the end. parameters are sent to each
+    worker once by the pool initializer instead of with every task, tasks
+    exchange pixels and doses through shared memory blocks.
+    task_done(id) is called with the index of every finished task.
+    Once JOB_CANCELLED is set the tasks not started yet are cancelled and
+    JobCancelledError is raised, the pool itself keeps running.
+    """
+    statistics = Counter()
     to_do = len(args_list)
     done = 0
-    for id, result in parrarelize_processes(
-        optimize, args_list, n_executors=parameters["number_of_processes"]
-    ):
+    report_stage(stage)
+    if "executor" in PERSISTENT_POOL:
+        tasks = parrarelize_processes(
+            job_task,
+            [
+                (parameters["jobId"], parameters["parametersPath"], task, *args)
+                for args in args_list
+            ],
+            executor=PERSISTENT_POOL["executor"],
+        )
+    else:
+        tasks = parrarelize_processes(
+            task,
+            args_list,
+            n_executors=parameters["number_of_processes"],
+            initializer=initialize_worker,
+            initargs=(parameters,),
+            mp_context=worker_context(parameters),
+        )
+    for id, task_statistics in tasks:
+        if JOB_CANCELLED.is_set():
+            tasks.close()
+            raise JobCancelledError()
         done += 1
-        results_sample[id] = result
+        statistics.update(task_statistics)
+        if task_done is not None:
+            task_done(id)
 
-        print(f"progress;{done/to_do}", flush=True)
+        report_progress(done / to_do)
 
-    sample_result_image = np.stack(
-        [results_sample[i] for i in sorted(results_sample.keys())], axis=0
-    )
-    sample_result_SITK = sitk.GetImageFromArray(sample_result_image)
-    sample_filename = os.path.join(parameters["tempPath"], "dosimetry_result.nii")
-    sitk.WriteImage(sample_result_SITK, sample_filename)
+    for line in statistic_lines(statistics):
+        report("statistic", line)
 
-    print(f"sample;{sample_filename}", flush=True)
 
+def statistic_lines(statistics):
+    """name=value lines of summed solver statistics, with the inverse bracket hit rate."""
+    lines = [f"{name}={value}" for name, value in sorted(statistics.items())]
+    if statistics["inverse_bracket_pixels"] > 0:
+        hit_rate = (
+            1
+            - statistics["inverse_bracket_misses"]
+            / statistics["inverse_bracket_pixels"]
+        )
+        lines.append(f"inverse_bracket_hit_rate={hit_rate:.4f}")
+    return lines
 
-def run_dosimetry_with_recalibration(parameters):
-    sampleImgSITK = sitk.ReadImage(parameters["sampleRegionFilePath"])
-    sampleImg = sitk.GetArrayFromImage(sampleImgSITK)
-    args_list = [(sampleImg[y], parameters) for y in range(sampleImg.shape[0])]
-
-    control_start_id = len(args_list)
-    controlImgSITK = sitk.ReadImage(parameters["controlRegionFilePath"])
-    controlImg = sitk.GetArrayFromImage(controlImgSITK)
-    args_list.extend([(controlImg[y], parameters) for y in range(controlImg.shape[0])])
-
-    recalibration_start_id = len(args_list)
-    recalibrationImgSITK = sitk.ReadImage(parameters["recalibrationRegionFilePath"])
-    recalibrationImg = sitk.GetArrayFromImage(recalibrationImgSITK)
-    args_list.extend(
-        [(recalibrationImg[y], parameters) for y in range(recalibrationImg.shape[0])]
+
+def worker_context(parameters):
+    return process_context(
+        parameters.get("start_method", "default"), preload=FORKSERVER_PRELOAD
     )
 
-    results_sample = {}
-    results_control = {}
-    results_recalibration = {}
 
-    to_do = len(args_list)
-    done = 0
-    for id, result in parrarelize_processes(
-        optimize, args_list, n_executors=parameters["number_of_processes"]
+def ensure_persistent_pool(parameters):
+    """
+    Starts the pool that run_tasks shares between jobs, it is restarted only
+    when the number of processes or the start method changed.
+    Jobs sent to it need the jobId and parametersPath parameters, see job_task.
+    """
+    configuration = (
+        parameters["number_of_processes"],
+        parameters.get("start_method", "default"),
+    )
+    if PERSISTENT_POOL.get("configuration") == configuration:
+        return
+    stop_persistent_pool()
+    share_resource_tracker()
+    PERSISTENT_POOL["executor"] = concurrent.futures.ProcessPoolExecutor(
+        max_workers=resolve_worker_count(
+            parameters, None, mp_context=worker_context(parameters)
+        ),
+        mp_context=worker_context(parameters),
+    )
+    # forked workers start on the first submit, started by a job they would
+    # inherit the shared memory blocks the driver has mapped at that moment
+    PERSISTENT_POOL["executor"].submit(int).result()
+    PERSISTENT_POOL["configuration"] = configuration
+
+
+def stop_persistent_pool():
+    if "executor" in PERSISTENT_POOL:
+        PERSISTENT_POOL.pop("executor").shutdown(cancel_futures=True)
+        PERSISTENT_POOL.pop("configuration")
+
+
+def solve_regions(images, parameters, stores=None, targets=None):
+    """
+    Converts every image in images to dose, results are returned in the same
+    order. stores holds a TileStore or None per image, the doses of an image
+    are saved to its store tile row by tile row as they are solved.
+    Images may be SharedArrays, the workers then read them in place, and
+    targets holds a uint16 SharedArray or None per image the doses are
+    written to instead of a new block.
+    """
+    stores = stores or [None] * len(images)
+    targets = targets or [None] * len(images)
+    n_processes = resolve_worker_count(
+        parameters,
+        sum(img.shape[0] * img.shape[1] for img in images),
+        mp_context=worker_context(parameters),
+    )
+    report("statistic", f"number_of_processes={n_processes}")
+    parameters = {**parameters, "number_of_processes": n_processes}
+
+    if (
+        parameters.get("cache_size", 0) <= 0
+        or "cachePath" not in parameters
+        or not solves_triplets_independently(parameters)
     ):
-        done += 1
-        if id < control_start_id:
-            results_sample[id] = result
-        elif id >= control_start_id and id < recalibration_start_id:
-            results_control[id] = result
-        else:
-            results_recalibration[id] = result
+        return solve_regions_uncached(images, parameters, stores, targets)
 
-        print(f"progress;{done/to_do}", flush=True)
+    with open_dose_cache(parameters) as cache:
+        before = cache.statistics()
+    result_images = solve_regions_uncached(images, parameters, stores, targets)
+    with open_dose_cache(parameters) as cache:
+        after = cache.statistics()
 
-    sample_result_image = np.stack(
-        [results_sample[i] for i in sorted(results_sample.keys())], axis=0
+    report("cache_hits", after["hits"] - before["hits"])
+    report("cache_misses", after["misses"] - before["misses"])
+    report("cache_entries", after["entries"])
+    return result_images
+
+
+def open_dose_cache(parameters):
+    return DoseCache(
+        parameters["cachePath"],
+        calibration_model_key(parameters),
+        parameters["cache_size"],
     )
-    sample_result_SITK = sitk.GetImageFromArray(sample_result_image)
-    sample_filename = os.path.join(parameters["tempPath"], "dosimetry_result.nii")
-    sitk.WriteImage(sample_result_SITK, sample_filename)
 
-    print(f"sample;{sample_filename}", flush=True)
 
-    control_result_image = np.stack(
-        [results_control[i] for i in sorted(results_control.keys())], axis=0
+def solve_regions_uncached(images, parameters, stores, targets):
+    factor = parameters.get("pyramid_factor", 1)
+    if factor > 1:
+        return [
+            (
+                solve_region_pyramid(img, parameters, store, target)
+                if min(img.shape[:2]) >= PYRAMID_MIN_SIZE * factor
+                else solve_regions_flat(
+                    [img], parameters, stores=[store], targets=[target]
+                )[0]
+            )
+            for img, store, target in zip(images, stores, targets)
+        ]
+    return solve_regions_flat(images, parameters, stores=stores, targets=targets)
+
+
+def region_array(img):
+    """Array of an image given as an array or as a SharedArray."""
+    return img.array if isinstance(img, SharedArray) else img
+
+
+def shared_region(blocks, img):
+    """SharedArray of img, images already shared are used in place instead of copied."""
+    if isinstance(img, SharedArray):
+        return img
+    return blocks.enter_context(SharedArray.copy_of(img))
+
+
+def result_block(blocks, target, shape):
+    """The target block of an image's doses, or a new one owned by blocks."""
+    if target is not None:
+        return target
+    return blocks.enter_context(SharedArray.create(shape, np.uint16))
+
+
+def result_array(block, target):
+    """Doses of block, copied out unless they were written to the caller's target."""
+    return block.array if block is target else block.array.copy()
+
+
+def solve_regions_flat(images, parameters, stage="solve", stores=None, targets=None):
+    stores = stores or [None] * len(images)
+    targets = targets or [None] * len(images)
+    if deduplicates(parameters, stores):
+        result_images = solve_regions_deduplicated(
+            [region_array(img) for img in images], parameters, stage
+        )
+        for i, target in enumerate(targets):
+            if target is not None:
+                target.array[...] = result_images[i]
+                result_images[i] = target.array
+        return result_images
+
+    with ExitStack() as blocks:
+        sources = [shared_region(blocks, img) for img in images]
+        results = [
+            result_block(blocks, target, img.shape[:2])
+            for img, target in zip(images, targets)
+        ]
+        writers = [
+            TileRowWriter(store, result.array) if store is not None else None
+            for store, result in zip(stores, results)
+        ]
+        args_list = []
+        task_writers = []
+        for img, source, result, writer in zip(images, sources, results, writers):
+            for start, stop in image_tiles(img, parameters):
+                args_list.append((source.descriptor, result.descriptor, start, stop))
+                task_writers.append(writer)
+
+        def task_done(id):
+            if task_writers[id] is not None:
+                task_writers[id].rows_solved(*args_list[id][-2:])
+
+        run_tasks(args_list, parameters, stage=stage, task_done=task_done)
+        return [
+            result_array(result, target) for result, target in zip(results, targets)
+        ]
+
+
+def deduplicates(parameters, stores):
+    """
+    Whether unique triplets are solved instead of image tiles. Deduplicated
+    doses are scattered back only once all triplets are solved, so images
+    saved to a TileStore tile row by tile row are never deduplicated.
+    """
+    return (
+        parameters.get("deduplicate", 0)
+        and solves_triplets_independently(parameters)
+        and all(store is None for store in stores)
     )
-    recalibration_result_image = np.stack(
-        [results_recalibration[i] for i in sorted(results_recalibration.keys())], axis=0
+
+
+def image_tiles(img, parameters):
+    return split_into_tiles(
+        img.shape[0],
+        img.shape[1],
+        parameters["number_of_processes"],
+        parameters.get("tile_rows", 0),
     )
 
-    print(f"control_mean;{control_result_image.mean()}", flush=True)
-    print(f"control_std;{control_result_image.std()}", flush=True)
-    print(f"recalibration_mean;{recalibration_result_image.mean()}", flush=True)
-    print(f"recalibration_std;{recalibration_result_image.std()}", flush=True)
 
+def solve_regions_deduplicated(images, parameters, stage="solve"):
+    """Solves each unique RGB triplet of all images only once and scatters the doses back."""
+    pixels = np.concatenate([img.reshape(-1, 3) for img in images], axis=0)
+    unique_pixels, inverse = deduplicate_pixels(pixels)
+    report("dedupe_ratio", unique_pixels.shape[0] / pixels.shape[0])
 
-if __name__ == "__main__":
-    parameters_path = sys.argv[1]
-    with open(parameters_path, "r") as f:
-        parameters = json.load(f)
+    n_unique = unique_pixels.shape[0]
+    with SharedArray.copy_of(unique_pixels) as source, SharedArray.create(
+        (n_unique,), np.uint16
+    ) as target:
+        args_list = [
+            (source.descriptor, target.descriptor, start, stop)
+            for start, stop in split_into_tiles(
+                n_unique, 1, 1, tile_rows=DEDUPLICATION_CHUNK_SIZE
+            )
+        ]
+        run_tasks(args_list, parameters, stage=f"{stage} (unique triplets)")
+        doses = target.array[inverse]
+
+    result_images = []
+    first_pixel = 0
+    for img in images:
+        n_pixels = img.shape[0] * img.shape[1]
+        result_images.append(
+            doses[first_pixel : first_pixel + n_pixels].reshape(img.shape[:2])
+        )
+        first_pixel += n_pixels
+    return result_images
+
+
+def downsample_image(img, factor):
+    """Block mean of factor x factor pixels, edges are padded by repetition."""
+    height, width = img.shape[:2]
+    padded = np.pad(
+        img,
+        ((0, -height % factor), (0, -width % factor), (0, 0)),
+        mode="edge",
+    )
+    blocks = padded.reshape(
+        padded.shape[0] // factor, factor, padded.shape[1] // factor, factor, 3
+    )
+    return np.round(blocks.mean(axis=(1, 3))).astype(img.dtype)
+
+
+def upsample_image(img, shape, factor):
+    return np.repeat(np.repeat(img, factor, axis=0), factor, axis=1)[
+        : shape[0], : shape[1]
+    ]
+
+
+def solve_region_pyramid(img, parameters, store=None, target=None):
+    """
+    Solves a pyramid_factor times downsampled copy of img first and uses the
+    upsampled low-resolution dose as the centre of each pixel's search bracket
+    in the full-resolution solve.
+    """
+    factor = parameters["pyramid_factor"]
+    (low_resolution_dose,) = solve_regions_flat(
+        [downsample_image(region_array(img), factor)],
+        parameters,
+        stage="pyramid coarse solve",
+    )
+    with ExitStack() as blocks:
+        source = shared_region(blocks, img)
+        seeds = blocks.enter_context(
+            SharedArray.copy_of(upsample_image(low_resolution_dose, img.shape, factor))
+        )
+        result = result_block(blocks, target, img.shape[:2])
+        args_list = [
+            (source.descriptor, seeds.descriptor, result.descriptor, start, stop)
+            for start, stop in image_tiles(img, parameters)
+        ]
+        writer = TileRowWriter(store, result.array) if store is not None else None
+
+        def task_done(id):
+            if writer is not None:
+                writer.rows_solved(*args_list[id][-2:])
+
+        run_tasks(
+            args_list,
+            parameters,
+            task=optimize_seeded_task,
+            stage="pyramid refinement",
+            task_done=task_done,
+        )
+        return result_array(result, target)
+
+
+@contextmanager
+def driver_block(descriptor):
+    """
+    Block created by the driver, used in place by this process and the pool
+    workers. The workers register the blocks they attach with the resource
+    tracker they share with this process, so the block stays registered until
+    the job ends and is then unregistered once, for the tracker not to unlink
+    it when this process exits.
+    """
+    block = SharedArray.attach(descriptor)
+    try:
+        yield block
+    finally:
+        block.close()
+        block.untrack()
+
+
+def sample_store(parameters):
+    """TileStore the sample doses are saved to, created by the driver, or None."""
+    if parameters.get("sampleStore"):
+        return TileStore(parameters["sampleStore"])
+    return None
+
+
+def run_dosimetry(parameters):
+    store = sample_store(parameters)
+    with driver_block(parameters["sampleRegion"]) as sampleImg, driver_block(
+        parameters["sampleResult"]
+    ) as sampleResult:
+        solve_regions([sampleImg], parameters, [store], [sampleResult])
+    if store is not None:
+        store.finish()
+
+    report("sample", parameters["sampleResult"][0])
+
+
+def run_dosimetry_with_recalibration(parameters):
+    store = sample_store(parameters)
+    with ExitStack() as blocks:
+        sampleImg, controlImg, recalibrationImg, sampleResult = [
+            blocks.enter_context(driver_block(parameters[name]))
+            for name in [
+                "sampleRegion",
+                "controlRegion",
+                "recalibrationRegion",
+                "sampleResult",
+            ]
+        ]
+        # the sample doses are in sampleResult, no view of it may outlive the block
+        control_result_image, recalibration_result_image = solve_regions(
+            [sampleImg, controlImg, recalibrationImg],
+            parameters,
+            [store, None, None],
+            [sampleResult, None, None],
+        )[1:]
+    if store is not None:
+        store.finish()
+
+    report("sample", parameters["sampleResult"][0])
+
+    report("control_mean", control_result_image.mean())
+    report("control_std", control_result_image.std())
+    report("recalibration_mean", recalibration_result_image.mean())
+    report("recalibration_std", recalibration_result_image.std())
+
+
+def terminate(signum, frame):
+    raise SystemExit(1)
+
+
+def install_termination_handler():
+    """
+    Turns SIGTERM (SIGBREAK on Windows) sent by a cancelled run into SystemExit,
+    so that pending tasks are cancelled and shared memory blocks are released.
+    """
+    for name in ["SIGTERM", "SIGBREAK"]:
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), terminate)
+
+
+def run_job(parameters):
     with_recalibration = (
-        "controlRegionFilePath" in parameters
-        and "recalibrationRegionFilePath" in parameters
+        parameters.get("controlRegion") is not None
+        and parameters.get("recalibrationRegion") is not None
     )
 
     if with_recalibration:
         run_dosimetry_with_recalibration(parameters)
     else:
         run_dosimetry(parameters)
+
+
+if __name__ == "__main__":
+    install_termination_handler()
+    pin_native_threads(os.environ)
+    parameters_path = sys.argv[1]
+    with open(parameters_path, "r") as f:
+        parameters = json.load(f)
+    # frames go to the original stdout, stray prints must not corrupt them
+    stdout = sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+    def send(frame):
+        stdout.write(frame)
+        stdout.flush()
+
+    open_channel(send, parameters.get("progress_refresh_rate", 10.0))
+    run_job(parameters)
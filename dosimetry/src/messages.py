@@ -0,0 +1,70 @@
+import struct
+import time
+
+# frame: uint32 payload length, uint8 kind, payload
+FRAME_HEADER = struct.Struct("<IB")
+PROGRESS_BODY = struct.Struct("<dd")
+
+MESSAGE = 0
+PROGRESS = 1
+
+
+def encode_frame(kind, body):
+    return FRAME_HEADER.pack(len(body), kind) + body
+
+
+def decode_frame(frame):
+    """(kind, value) of a frame, value is a (tag, value) pair or a progress dict."""
+    length, kind = FRAME_HEADER.unpack_from(frame)
+    body = frame[FRAME_HEADER.size : FRAME_HEADER.size + length]
+    if kind == PROGRESS:
+        progress, eta = PROGRESS_BODY.unpack_from(body)
+        stage = body[PROGRESS_BODY.size :].decode("utf-8")
+        return kind, {"progress": progress, "eta": eta, "stage": stage}
+    tag, value = body.decode("utf-8").split(";", 1)
+    return kind, (tag, value)
+
+
+def read_frames(stream):
+    """Yields decoded frames from a binary stream until it is closed."""
+    while True:
+        header = stream.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        length, _ = FRAME_HEADER.unpack(header)
+        yield decode_frame(header + stream.read(length))
+
+
+class MessageChannel(object):
+    """
+    Sender side of the dosimetry message protocol. send is called with every
+    encoded frame. Progress frames carry the stage name and an ETA estimated
+    from the time spent in the stage so far, they are dropped when they come
+    sooner than 1 / refresh_rate seconds after the previous one, except for
+    the end of a stage.
+    """
+
+    def __init__(self, send, refresh_rate=10.0):
+        self.send = send
+        self.min_interval = 1.0 / refresh_rate if refresh_rate > 0 else 0.0
+        self.stage_name = ""
+        self.stage_start = time.time()
+        self.last_progress = 0.0
+
+    def message(self, tag, value):
+        self.send(encode_frame(MESSAGE, f"{tag};{value}".encode("utf-8")))
+
+    def stage(self, name):
+        self.stage_name = name
+        self.stage_start = time.time()
+        self.last_progress = 0.0
+
+    def progress(self, progress):
+        now = time.time()
+        if progress < 1 and now - self.last_progress < self.min_interval:
+            return
+        self.last_progress = now
+        elapsed = now - self.stage_start
+        eta = elapsed * (1 - progress) / progress if progress > 0 else -1.0
+        body = PROGRESS_BODY.pack(progress, eta) + self.stage_name.encode("utf-8")
+        self.send(encode_frame(PROGRESS, body))
@@ -0,0 +1,22 @@
+"""
+Limits of the BLAS/OpenMP thread pools. Kept free of numpy imports, the
+pools are sized when numpy is loaded, so scripts pin them before any import.
+"""
+
+NATIVE_THREAD_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+def pin_native_threads(environment, n_threads=1):
+    """
+    Limits the BLAS/OpenMP thread pools of processes started with environment,
+    so that workers do not oversubscribe the CPU. Values set by the user win.
+    """
+    for name in NATIVE_THREAD_VARIABLES:
+        environment.setdefault(name, str(n_threads))
+    return environment
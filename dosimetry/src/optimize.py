@@ -1,6 +1,50 @@
 import numpy as np
 import json
 import math
+import hashlib
+import threading
+from collections import Counter
+from src.dose_cache import DoseCache
+from src.calibration_model import (
+    CalibrationModel,
+    get_calibration_coefficients,
+    get_normalizations,
+)
+
+DOSE_QUANTUM = 1
+DERIVATIVE_BRACKET_FRACTION = 0.05
+TABLE_GRID_STEP = 5.0
+TABLE_CHUNK_ELEMENTS = 2**22
+WARM_START_STRIDE = 8
+# the warm engine seeds a pixel from its left neighbour
+POSITION_DEPENDENT_ENGINES = ["warm"]
+
+
+class ThreadCounter(threading.local):
+    """
+    Counter of the calling thread, so that solver threads of the in-process
+    backend count separately like pool workers do.
+    """
+
+    def __init__(self):
+        self.counter = Counter()
+
+    def __getitem__(self, name):
+        return self.counter[name]
+
+    def __setitem__(self, name, value):
+        self.counter[name] = value
+
+    def keys(self):
+        return self.counter.keys()
+
+    def clear(self):
+        self.counter.clear()
+
+
+CALIBRATION_MODELS = {}
+# counters of the current thread, collected per task by logic_subprocess and threaded_backend
+SOLVER_STATISTICS = ThreadCounter()
 
 
 def read_json(fname):
@@ -86,9 +130,531 @@ def omega_with_normalizations(densities, coefs, norms):
     return f
 
 
+def golden_section_search(objective, densities, a, b, tol, max_iter):
+    """
+    Vectorized version of the golden-section loop used by optimize_scalar.
+    densities has shape (3, N), a and b are the per-pixel brackets of shape (N,).
+    objective(densities, doses) must be elementwise over pixels.
+    Every pixel follows exactly the same sequence of steps as the scalar loop,
+    pixels whose bracket is already narrower than tol, a scalar or one value
+    per pixel, are masked out.
+    Returns the final (a, b) brackets.
+    """
+    a = np.array(np.broadcast_to(a, densities.shape[1:]), dtype=np.float64)
+    b = np.array(np.broadcast_to(b, densities.shape[1:]), dtype=np.float64)
+    tol = np.broadcast_to(tol, densities.shape[1:])
+    k = (math.sqrt(5) - 1) / 2
+    xL = b - k * (b - a)
+    xR = a + k * (b - a)
+
+    index = np.nonzero((b - a) > tol)[0]
+    numIter = 0
+    while index.size > 0:
+        aI, bI, xLI, xRI = a[index], b[index], xL[index], xR[index]
+
+        left = objective(densities[:, index], xLI) < objective(densities[:, index], xRI)
+        right = ~left
+
+        bI[left] = xRI[left]
+        xRI[left] = xLI[left]
+        xLI[left] = bI[left] - k * (bI[left] - aI[left])
+
+        aI[right] = xLI[right]
+        xLI[right] = xRI[right]
+        xRI[right] = aI[right] + k * (bI[right] - aI[right])
+
+        a[index], b[index], xL[index], xR[index] = aI, bI, xLI, xRI
+
+        numIter += 1
+        if numIter > max_iter:
+            break
+        index = index[(bI - aI) > tol[index]]
+
+    return a, b
+
+
+def bracket_endpoints(derivatives, densities, a, b):
+    """
+    Evaluates the derivative at both ends of the brackets. Pixels whose objective
+    does not change direction inside [a, b] are resolved to the matching end.
+    Returns (doses, index of pixels still to be searched, gradient at a, gradient at b).
+    """
+    a = np.array(np.broadcast_to(a, densities.shape[1:]), dtype=np.float64)
+    b = np.array(np.broadcast_to(b, densities.shape[1:]), dtype=np.float64)
+    gradient_a, _ = derivatives(densities, a)
+    gradient_b, _ = derivatives(densities, b)
+
+    doses = np.empty_like(a)
+    minimum_at_a = ~(gradient_a < 0)
+    minimum_at_b = ~minimum_at_a & ~(gradient_b > 0)
+    doses[minimum_at_a] = a[minimum_at_a]
+    doses[minimum_at_b] = b[minimum_at_b]
+    index = np.nonzero(~minimum_at_a & ~minimum_at_b)[0]
+    return doses, index, a, b, gradient_a, gradient_b
+
+
+def newton_search(derivatives, densities, a, b, tol, max_iter):
+    """
+    Safeguarded Newton iteration on the root of the analytic derivative.
+    The bracket is shrunk on every step and a bisection step is taken whenever
+    the Newton step leaves it. Stops when the step or the bracket is below tol.
+    Returns the dose estimates.
+    """
+    doses, index, a, b, _, _ = bracket_endpoints(derivatives, densities, a, b)
+    doses[index] = (a[index] + b[index]) / 2
+
+    numIter = 0
+    while index.size > 0 and numIter <= max_iter:
+        x, aI, bI = doses[index], a[index], b[index]
+        gradient, hessian = derivatives(densities[:, index], x)
+
+        positive = gradient > 0
+        bI[positive] = x[positive]
+        aI[~positive] = x[~positive]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_new = x - gradient / hessian
+        bisect = ~(hessian > 0) | ~(x_new > aI) | ~(x_new < bI)
+        x_new[bisect] = (aI[bisect] + bI[bisect]) / 2
+        x_new[gradient == 0] = x[gradient == 0]
+
+        converged = (np.abs(x_new - x) <= tol / 2) | ((bI - aI) <= tol)
+        doses[index], a[index], b[index] = x_new, aI, bI
+
+        numIter += 1
+        index = index[~converged]
+
+    return doses
+
+
+def brent_search(derivatives, densities, a, b, tol, max_iter):
+    """
+    Brent-Dekker root finder (inverse quadratic interpolation, secant and
+    bisection steps) applied to the analytic derivative, vectorized over pixels.
+    The sign-change bracket always keeps the descending side on the left, so
+    the iteration converges to a minimum. Stops when the bracket is below tol.
+    Returns the dose estimates.
+    """
+    doses, index, a, b, gradient_a, gradient_b = bracket_endpoints(
+        derivatives, densities, a, b
+    )
+    xpre, xcur = a[index], b[index]
+    fpre, fcur = gradient_a[index], gradient_b[index]
+    xblk = np.zeros_like(xcur)
+    fblk = np.zeros_like(xcur)
+    spre = np.zeros_like(xcur)
+    scur = np.zeros_like(xcur)
+
+    numIter = 0
+    while index.size > 0 and numIter <= max_iter:
+        change = (fpre != 0) & (fcur != 0) & (np.signbit(fpre) != np.signbit(fcur))
+        xblk[change] = xpre[change]
+        fblk[change] = fpre[change]
+        spre[change] = scur[change] = xcur[change] - xpre[change]
+
+        swap = np.abs(fblk) < np.abs(fcur)
+        xpre[swap], xcur[swap], xblk[swap] = xcur[swap], xblk[swap], xcur[swap]
+        fpre[swap], fcur[swap], fblk[swap] = fcur[swap], fblk[swap], fcur[swap]
+
+        delta = tol / 2
+        sbis = (xblk - xcur) / 2
+        converged = (fcur == 0) | (np.abs(sbis) < delta)
+        doses[index[converged]] = xcur[converged]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            interpolate = (np.abs(spre) > delta) & (np.abs(fcur) < np.abs(fpre))
+            secant = -fcur * (xcur - xpre) / (fcur - fpre)
+            dpre = (fpre - fcur) / (xpre - xcur)
+            dblk = (fblk - fcur) / (xblk - xcur)
+            quadratic = (
+                -fcur * (fblk * dblk - fpre * dpre) / (dblk * dpre * (fblk - fpre))
+            )
+            stry = np.where(xpre == xblk, secant, quadratic)
+            accept = interpolate & (
+                2 * np.abs(stry) < np.minimum(np.abs(spre), 3 * np.abs(sbis) - delta)
+            )
+        spre = np.where(accept, scur, sbis)
+        scur = np.where(accept, stry, sbis)
+
+        xpre, fpre = xcur, fcur
+        xcur = np.where(
+            np.abs(scur) > delta, xcur + scur, xcur + np.where(sbis > 0, delta, -delta)
+        )
+
+        keep = ~converged
+        index = index[keep]
+        xpre, xcur, xblk = xpre[keep], xcur[keep], xblk[keep]
+        fpre, fblk = fpre[keep], fblk[keep]
+        spre, scur = spre[keep], scur[keep]
+        if index.size > 0:
+            fcur, _ = derivatives(densities[:, index], xcur)
+        numIter += 1
+
+    doses[index] = xcur
+    return doses
+
+
+def calibration_model_key(parameters):
+    """Hash of everything that influences the dose solved for a given RGB triplet."""
+    model = {
+        "calibration_coefficients": get_calibration_coefficients(parameters),
+        "normalizations": get_normalizations(parameters),
+        "normalization_factor": parameters["normalization_factor"],
+        "tolerance": parameters["tolerance"],
+        "max_iterations": parameters["max_iterations"],
+        "max_dose": parameters["max_dose"],
+        "solver": parameters.get("solver", "golden"),
+        "engine": parameters.get("engine", "scalar"),
+        "warm_start_margin": parameters.get("warm_start_margin", 0),
+        "inverse_bracket": parameters.get("inverse_bracket", 0),
+        "inverse_bracket_margin": parameters.get("inverse_bracket_margin", 0),
+    }
+    return hashlib.sha256(json.dumps(model, sort_keys=True).encode()).hexdigest()
+
+
+def calibration_model(parameters):
+    """CalibrationModel for parameters, built once per process and calibration."""
+    key = calibration_model_key(parameters)
+    if key not in CALIBRATION_MODELS:
+        CALIBRATION_MODELS[key] = CalibrationModel.from_parameters(parameters)
+    return CALIBRATION_MODELS[key]
+
+
+def deduplicate_pixels(img):
+    """
+    Collapses an array of RGB pixels with shape (..., 3) to its unique triplets.
+    Returns (unique_pixels, inverse) where unique_pixels[inverse] restores the
+    flattened pixels, so solved doses can be scattered back with doses[inverse].
+    """
+    pixels = img.reshape(-1, 3)
+    unique_pixels, inverse = np.unique(pixels, axis=0, return_inverse=True)
+    return unique_pixels, inverse.reshape(-1)
+
+
+def solves_triplets_independently(parameters):
+    """
+    False for engines whose dose of a pixel depends on its neighbours in the
+    image, pixels of those are never deduplicated or cached.
+    """
+    return parameters.get("engine", "scalar") not in POSITION_DEPENDENT_ENGINES
+
+
 def optimize(img, parameters):
-    MINIMIZE_SEARCH_SPACE = False
+    """
+    Converts an array of uint16 RGB pixels with shape (..., 3) to dose in cGy.
+    When a cache is configured already solved triplets are read from it and
+    only the remaining ones are passed to solve_pixels.
+    """
+    if (
+        parameters.get("cache_size", 0) > 0
+        and "cachePath" in parameters
+        and solves_triplets_independently(parameters)
+    ):
+        return optimize_cached(img, parameters)
+    return solve_pixels(img, parameters)
+
+
+def optimize_cached(img, parameters):
+    unique_pixels, inverse = deduplicate_pixels(img)
+    with DoseCache(
+        parameters["cachePath"],
+        calibration_model_key(parameters),
+        parameters["cache_size"],
+    ) as cache:
+        doses, found = cache.lookup(unique_pixels)
+        if not found.all():
+            missing = ~found
+            doses[missing] = solve_pixels(unique_pixels[missing], parameters)
+            cache.store(unique_pixels[missing], doses[missing])
+    return doses[inverse].reshape(img.shape[:-1])
+
+
+def solve_pixels(img, parameters):
+    """
+    parameters["engine"] selects the implementation, "scalar" is the reference
+    per-pixel loop, "vectorized" solves all pixels at once with NumPy,
+    "table" starts from a scan over a precomputed dose grid and "warm" seeds
+    pixel brackets from already solved neighbours in the same row.
+    parameters["solver"] selects the vectorized search, "golden" reproduces the
+    scalar loop, "brent" and "newton" use the analytic derivative of omega.
+    """
+    engine = parameters.get("engine", "scalar")
+    solver = parameters.get("solver", "golden")
+    if engine == "scalar":
+        if solver != "golden":
+            raise ValueError("Scalar engine supports only the golden solver")
+        return optimize_scalar(img.reshape(-1, 3), parameters).reshape(img.shape[:-1])
+    elif engine == "vectorized":
+        return optimize_vectorized(img, parameters)
+    elif engine == "table":
+        return optimize_table(img, parameters)
+    elif engine == "warm":
+        return optimize_warm_started(img, parameters)
+    raise ValueError(f"Unknown engine: {engine}")
+
+
+def bracketed_search(densities, a, b, parameters):
+    """Minimizes omega inside [a, b] for every pixel with the method given by parameters["solver"]."""
+    TOL = parameters["tolerance"]
+    MAX_ITER = parameters["max_iterations"]
+    SOLVER = parameters.get("solver", "golden")
+    # doses are rounded to whole cGy, derivative solvers stop once the
+    # bracket is a tenth of that
+    DERIVATIVE_TOL = max(TOL, 0.1 * DOSE_QUANTUM)
+
+    if densities.shape[1] == 0:
+        # e.g. a tile of unexposed film, no pixel is solved
+        return np.zeros(0)
+
+    model = calibration_model(parameters)
+
+    if SOLVER == "golden":
+        a, b = golden_section_search(model.objective, densities, a, b, TOL, MAX_ITER)
+        return (a + b) / 2
+    # omega is not unimodal over the whole range, a few golden-section
+    # steps first select the same basin the reference search ends up in
+    a, b = golden_section_search(
+        model.objective,
+        densities,
+        a,
+        b,
+        (np.asarray(b) - np.asarray(a)) * DERIVATIVE_BRACKET_FRACTION,
+        MAX_ITER,
+    )
+    if SOLVER == "brent":
+        return brent_search(
+            model.derivatives, densities, a, b, DERIVATIVE_TOL, MAX_ITER
+        )
+    elif SOLVER == "newton":
+        return newton_search(
+            model.derivatives, densities, a, b, DERIVATIVE_TOL, MAX_ITER
+        )
+    raise ValueError(f"Unknown solver: {SOLVER}")
+
+
+def pixel_densities(img, parameters):
+    """
+    Returns (pixels, to_solve, densities) where pixels are the flattened RGB
+    values, to_solve indexes the pixels darker than the zero dose threshold
+    and densities are their optical densities with shape (3, len(to_solve)).
+    """
+    NORM_FACTOR = parameters["normalization_factor"]
+    ZERO_DOSE_THRESHOLD = 62000
+
+    pixels = img.reshape(-1, 3)
+    to_solve = np.nonzero(np.min(pixels, axis=1) < ZERO_DOSE_THRESHOLD)[0]
+    values = pixels[to_solve] / NORM_FACTOR
+    return pixels, to_solve, -np.log(values).T
+
+
+def solve_full_range(densities, parameters):
+    """Searches [0, max_dose] for every pixel and returns doses rounded to whole cGy."""
+    DOSE_MAX = parameters["max_dose"]
+
+    doses = np.maximum(
+        0, np.round(bracketed_search(densities, 0, DOSE_MAX, parameters))
+    )
+
+    # same low-dose retry as the scalar loop for pixels stuck at the upper bound
+    retry = np.nonzero(doses >= DOSE_MAX - 1)[0]
+    if retry.size > 0:
+        doses[retry] = np.maximum(
+            0,
+            np.round(
+                bracketed_search(densities[:, retry], 0, 0.05 * DOSE_MAX, parameters)
+            ),
+        )
+    return doses
+
+
+def optimize_vectorized(img, parameters):
+    pixels, to_solve, opt_densities = pixel_densities(img, parameters)
+    calibrated_image = np.zeros(pixels.shape[0], dtype=np.float32)
+
+    if parameters.get("inverse_bracket", 0):
+        a, b = inverse_brackets(pixels[to_solve], parameters)
+        doses, fallback = solve_within_brackets(opt_densities, a, b, parameters)
+        calibrated_image[to_solve] = doses
+
+        SOLVER_STATISTICS["inverse_bracket_pixels"] += int(to_solve.size)
+        SOLVER_STATISTICS["inverse_bracket_misses"] += int(fallback.sum())
+    else:
+        calibrated_image[to_solve] = solve_full_range(opt_densities, parameters)
+    calibrated_image = np.asarray(calibrated_image, dtype=np.uint16)
+
+    return calibrated_image.reshape(img.shape[:-1])
+
+
+def margin_brackets(seeds, margin, parameters):
+    DOSE_MAX = parameters["max_dose"]
+    return np.maximum(0, seeds - margin), np.minimum(DOSE_MAX, seeds + margin)
+
 
+def inverse_brackets(pixels, parameters):
+    """
+    Closed-form single-channel dose estimates of every pixel, the bracket is
+    spanned by the lowest and highest channel estimate plus inverse_bracket_margin.
+    Pixels without any valid estimate get the full [0, max_dose] range.
+    """
+    NORM_FACTOR = parameters["normalization_factor"]
+    DOSE_MAX = parameters["max_dose"]
+    MARGIN = parameters["inverse_bracket_margin"]
+
+    estimates = calibration_model(parameters).inverse(pixels.T / NORM_FACTOR)
+    estimates[~np.isfinite(estimates)] = np.nan
+    estimates = np.clip(estimates, 0, DOSE_MAX)
+    valid = np.any(~np.isnan(estimates), axis=0)
+
+    a = np.zeros(pixels.shape[0])
+    b = np.full(pixels.shape[0], float(DOSE_MAX))
+    a[valid] = np.maximum(0, np.nanmin(estimates[:, valid], axis=0) - MARGIN)
+    b[valid] = np.minimum(DOSE_MAX, np.nanmax(estimates[:, valid], axis=0) + MARGIN)
+    return a, b
+
+
+def solve_within_brackets(densities, a, b, parameters):
+    """
+    Searches [a, b] for every pixel. Pixels whose result lands on an inner
+    edge of their bracket (the minimum is outside of it) or close to max_dose
+    are solved again with solve_full_range.
+    Returns (doses rounded to whole cGy, mask of pixels that needed the fallback).
+    """
+    TOL = parameters["tolerance"]
+    DOSE_MAX = parameters["max_dose"]
+
+    doses = bracketed_search(densities, a, b, parameters)
+
+    fallback = (
+        ((doses - a <= TOL) & (a > 0))
+        | ((b - doses <= TOL) & (b < DOSE_MAX))
+        | (np.round(doses) >= DOSE_MAX - 1)
+    )
+    doses = np.maximum(0, np.round(doses))
+    doses[fallback] = solve_full_range(densities[:, fallback], parameters)
+    return doses, fallback
+
+
+def optimize_warm_started(img, parameters):
+    """
+    Solves every WARM_START_STRIDE-th pixel of each row over the full range and
+    searches the pixels in between only within warm_start_margin of the dose
+    of the last solved pixel to their left. A pixel only depends on its own
+    row, so the result does not depend on how rows are split into tasks.
+    """
+    pixels, to_solve, opt_densities = pixel_densities(img, parameters)
+    calibrated_image = np.zeros(pixels.shape[0], dtype=np.float32)
+
+    row_length = img.shape[-2] if img.ndim > 1 else 1
+    columns = to_solve % row_length
+    anchor = columns % WARM_START_STRIDE == 0
+
+    calibrated_image[to_solve[anchor]] = solve_full_range(
+        opt_densities[:, anchor], parameters
+    )
+
+    local = ~anchor
+    seeds = calibrated_image[to_solve[local] - columns[local] % WARM_START_STRIDE]
+    a, b = margin_brackets(seeds, parameters["warm_start_margin"], parameters)
+    doses, fallback = solve_within_brackets(opt_densities[:, local], a, b, parameters)
+    calibrated_image[to_solve[local]] = doses
+
+    SOLVER_STATISTICS["warm_start_pixels"] += int(local.sum())
+    SOLVER_STATISTICS["warm_start_fallbacks"] += int(fallback.sum())
+
+    calibrated_image = np.asarray(calibrated_image, dtype=np.uint16)
+
+    return calibrated_image.reshape(img.shape[:-1])
+
+
+def optimize_seeded(img, seeds, parameters):
+    """
+    Converts img to dose searching only within pyramid_margin of seeds, an
+    array of dose estimates with shape img.shape[:-1], e.g. an upsampled
+    low-resolution solve. Runs in pool workers like optimize.
+    """
+    pixels, to_solve, opt_densities = pixel_densities(img, parameters)
+    calibrated_image = np.zeros(pixels.shape[0], dtype=np.float32)
+
+    seeds = seeds.reshape(-1)[to_solve].astype(np.float64)
+    a, b = margin_brackets(seeds, parameters["pyramid_margin"], parameters)
+    doses, fallback = solve_within_brackets(opt_densities, a, b, parameters)
+    calibrated_image[to_solve] = doses
+
+    SOLVER_STATISTICS["pyramid_pixels"] += int(to_solve.size)
+    SOLVER_STATISTICS["pyramid_fallbacks"] += int(fallback.sum())
+
+    calibrated_image = np.asarray(calibrated_image, dtype=np.uint16)
+
+    return calibrated_image.reshape(img.shape[:-1])
+
+
+def optimize_table(img, parameters):
+    """
+    Scans omega of every pixel over the whole precomputed dose grid, takes the
+    grid minimum and refines it with bracketed_search between the neighbouring
+    grid doses. The global scan finds the true minimum directly, so no
+    low-dose retry is needed for pixels close to max_dose.
+    """
+    DOSE_MAX = parameters["max_dose"]
+
+    pixels, to_solve, opt_densities = pixel_densities(img, parameters)
+    calibrated_image = np.zeros(pixels.shape[0], dtype=np.float32)
+
+    model = calibration_model(parameters)
+    grid, grid_features, valid = model.table(DOSE_MAX, TABLE_GRID_STEP)
+    chunk_size = max(1, TABLE_CHUNK_ELEMENTS // grid.shape[0])
+    grid_minimum = np.zeros(to_solve.shape[0], dtype=np.int64)
+    for start in range(0, to_solve.shape[0], chunk_size):
+        features = model.table_features(opt_densities[:, start : start + chunk_size])
+        values = features @ grid_features
+        values[:, ~valid] = np.inf
+        grid_minimum[start : start + chunk_size] = np.argmin(values, axis=1)
+
+    a = grid[np.maximum(grid_minimum - 1, 0)]
+    b = grid[np.minimum(grid_minimum + 1, grid.shape[0] - 1)]
+    doses = np.maximum(0, np.round(bracketed_search(opt_densities, a, b, parameters)))
+
+    calibrated_image[to_solve] = np.minimum(doses, DOSE_MAX)
+    calibrated_image = np.asarray(calibrated_image, dtype=np.uint16)
+
+    return calibrated_image.reshape(img.shape[:-1])
+
+
+def optimize_single_channel(img, parameters):
+    """
+    Closed-form dose without the triple-channel optimisation.
+    parameters["method"] "red" inverts the red channel calibration only,
+    "weighted" averages the doses of all channels weighted by the squared
+    channel sensitivity at the estimated dose, so flat channels count less.
+    """
+    NORM_FACTOR = parameters["normalization_factor"]
+    DOSE_MAX = parameters["max_dose"]
+    METHOD = parameters["method"]
+
+    ZERO_DOSE_THRESHOLD = 62000
+
+    model = calibration_model(parameters)
+    pixels = img.reshape(-1, 3)
+    estimates = model.inverse(pixels.T / NORM_FACTOR)
+    estimates[~np.isfinite(estimates)] = np.nan
+    estimates = np.clip(estimates, 0, DOSE_MAX)
+
+    if METHOD == "red":
+        doses = estimates[0]
+    elif METHOD == "weighted":
+        sensitivity, _ = model.value_derivatives(estimates)
+        weights = np.where(np.isnan(estimates), 0, sensitivity**2)
+        with np.errstate(invalid="ignore"):
+            doses = np.nansum(weights * estimates, axis=0) / weights.sum(axis=0)
+    else:
+        raise ValueError(f"Unknown method: {METHOD}")
+
+    doses = np.round(np.nan_to_num(doses, nan=0.0))
+    doses[np.min(pixels, axis=1) >= ZERO_DOSE_THRESHOLD] = 0
+    return np.asarray(doses, dtype=np.uint16).reshape(img.shape[:-1])
+
+
+def optimize_scalar(img, parameters):
     TOL = parameters["tolerance"]
     MAX_ITER = parameters["max_iterations"]
     NORM_FACTOR = parameters["normalization_factor"]
@@ -96,35 +662,9 @@ def optimize(img, parameters):
 
     ZERO_DOSE_THRESHOLD = 62000
 
-    red_parameters = parameters["calibration_parameters"]["r"]
-    green_parameters = parameters["calibration_parameters"]["g"]
-    blue_parameters = parameters["calibration_parameters"]["b"]
-    calibrationCoefficients = [
-        [red_parameters["a"], red_parameters["b"], red_parameters["c"]],
-        [green_parameters["a"], green_parameters["b"], green_parameters["c"]],
-        [blue_parameters["a"], blue_parameters["b"], blue_parameters["c"]],
-    ]
-
-    flag_normalization = 0 if "control_stripe_dose" not in parameters else 1
-    if flag_normalization:
-        normalizations = [
-            {
-                "dose": parameters["control_stripe_dose"],
-                "means": [
-                    parameters["control_rgb_mean"]["r"] / NORM_FACTOR,
-                    parameters["control_rgb_mean"]["g"] / NORM_FACTOR,
-                    parameters["control_rgb_mean"]["b"] / NORM_FACTOR,
-                ],
-            },
-            {
-                "dose": parameters["recalibration_stripe_dose"],
-                "means": [
-                    parameters["recalibration_rgb_mean"]["r"] / NORM_FACTOR,
-                    parameters["recalibration_rgb_mean"]["g"] / NORM_FACTOR,
-                    parameters["recalibration_rgb_mean"]["b"] / NORM_FACTOR,
-                ],
-            },
-        ]
+    calibrationCoefficients = get_calibration_coefficients(parameters)
+    normalizations = get_normalizations(parameters)
+    flag_normalization = 0 if normalizations is None else 1
 
     calibrated_image = np.zeros(img.shape[0:1], dtype=np.float32)
     for column in range(calibrated_image.shape[0]):
@@ -141,15 +681,8 @@ def optimize(img, parameters):
                 function_to_minimize = omega_with_normalizations(
                     opt_densities, calibrationCoefficients, normalizations
                 )
-            a, b, c = calibrationCoefficients[0]
-
-            if MINIMIZE_SEARCH_SPACE:
-                doses = inverse_rational_func(values, a, b, c)
-                a = doses.min()
-                b = doses.max()
-            else:
-                a = 0
-                b = DOSE_MAX
+            a = 0
+            b = DOSE_MAX
             k = (math.sqrt(5) - 1) / 2
             xL = b - k * (b - a)
             xR = a + k * (b - a)
@@ -0,0 +1,164 @@
+"""
+Reading parts of large film scans without loading the whole image.
+A 48-bit 1200 dpi flatbed scan takes more than 1 GB in memory, while the
+dosimetry only needs its ROIs and the stripe detection works as well on a
+downsampled overview. TIFF scans are stored in strips or tiles, so a window
+of the scan is read by decoding only the strips or tiles it overlaps. Other
+formats are read whole with SimpleITK.
+"""
+
+import numpy as np
+import SimpleITK as sitk
+import tifffile
+
+TIFF_EXTENSIONS = (".tif", ".tiff")
+# longest side [px] of the overview used for stripe detection, scans of up to ~300 dpi are detected at full resolution
+OVERVIEW_MAX_SIZE = 4096
+# rows of the scan read at once while its overview is computed
+OVERVIEW_BAND_ROWS = 512
+
+
+def is_tiff(path):
+    return path.lower().endswith(TIFF_EXTENSIONS)
+
+
+def scan_information(path):
+    """(shape, spacing, origin) of a scan without reading its pixels, shape is (rows, columns)."""
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(path)
+    reader.ReadImageInformation()
+    size = reader.GetSize()
+    return (size[1], size[0]), reader.GetSpacing()[:2], reader.GetOrigin()[:2]
+
+
+def region_origin(origin, spacing, bounds):
+    """
+    Origin of the region with IJK bounds (row_min, row_max, col_min, col_max)
+    of a scan with origin and spacing as returned by scan_information, so that
+    the region is placed over the same part of the scan.
+    """
+    row_min, row_max, col_min, col_max = bounds
+    return (origin[0] + col_min * spacing[0], origin[1] + row_min * spacing[1])
+
+
+def read_scan_regions(path, roi_bounds):
+    """
+    Pixels of a scan inside roi_bounds, a dict of IJK bounds
+    (row_min, row_max, col_min, col_max) with limits included as returned by
+    dosimetryLogic.roiBounds. Memory used scales with the ROIs, not the scan.
+    """
+    if not is_tiff(path):
+        image = read_whole_scan(path)
+        return {
+            key: image[row_min : row_max + 1, col_min : col_max + 1].copy()
+            for key, (row_min, row_max, col_min, col_max) in roi_bounds.items()
+        }
+    with tifffile.TiffFile(path) as tif:
+        return {
+            key: read_tiff_window(
+                tif.pages[0], row_min, row_max + 1, col_min, col_max + 1
+            )
+            for key, (row_min, row_max, col_min, col_max) in roi_bounds.items()
+        }
+
+
+def read_whole_scan(path):
+    image = sitk.GetArrayFromImage(sitk.ReadImage(path))
+    return image.reshape(image.shape[-3:])
+
+
+def read_tiff_window(page, row_start, row_stop, col_start, col_stop):
+    """Rows [row_start, row_stop) and columns [col_start, col_stop) of a TIFF page."""
+    if page.planarconfig != tifffile.PLANARCONFIG.CONTIG:
+        # rare for scans, read whole
+        return np.moveaxis(page.asarray(), 0, -1)[
+            row_start:row_stop, col_start:col_stop
+        ]
+
+    if page.is_tiled:
+        segment_rows, segment_cols = page.tilelength, page.tilewidth
+    else:
+        segment_rows, segment_cols = page.rowsperstrip, page.imagewidth
+    segments_across = -(-page.imagewidth // segment_cols)
+
+    window = np.empty(
+        (row_stop - row_start, col_stop - col_start, page.samplesperpixel), page.dtype
+    )
+    filehandle = page.parent.filehandle
+    for y in range(row_start // segment_rows, (row_stop - 1) // segment_rows + 1):
+        for x in range(col_start // segment_cols, (col_stop - 1) // segment_cols + 1):
+            index = y * segments_across + x
+            filehandle.seek(page.dataoffsets[index])
+            data = filehandle.read(page.databytecounts[index])
+            segment, indices, shape = page.decode(data, index)
+            # tiles on the image border are padded
+            segment = segment.reshape(shape[-3:])
+            row, col = indices[-3], indices[-2]
+            rows = slice(max(row_start, row), min(row_stop, row + segment.shape[0]))
+            cols = slice(max(col_start, col), min(col_stop, col + segment.shape[1]))
+            window[
+                rows.start - row_start : rows.stop - row_start,
+                cols.start - col_start : cols.stop - col_start,
+            ] = segment[
+                rows.start - row : rows.stop - row, cols.start - col : cols.stop - col
+            ]
+    return window if len(page.shape) == 3 else window[:, :, 0]
+
+
+def overview_factor(shape, max_size=OVERVIEW_MAX_SIZE):
+    """Smallest integer downsampling factor that fits the longest side of shape into max_size."""
+    return max(1, -(-max(shape[:2]) // max_size))
+
+
+def downsample(image, factor):
+    """Mean of every factor x factor block of image, incomplete blocks at the edges are dropped."""
+    rows = image.shape[0] // factor * factor
+    cols = image.shape[1] // factor * factor
+    blocks = image[:rows, :cols].reshape(
+        (rows // factor, factor, cols // factor, factor) + image.shape[2:]
+    )
+    return blocks.mean(axis=(1, 3)).astype(image.dtype)
+
+
+def band_overview(read_rows, rows, factor):
+    """Overview of an image of rows rows, downsampled one band of rows read by read_rows(start, stop) at a time."""
+    band = factor * max(1, OVERVIEW_BAND_ROWS // factor)
+    last = rows // factor * factor
+    return np.concatenate(
+        [
+            downsample(read_rows(start, min(start + band, last)), factor)
+            for start in range(0, last, band)
+        ]
+    )
+
+
+def image_overview(image, max_size=OVERVIEW_MAX_SIZE):
+    """
+    (overview, factor) of an image already in memory, e.g. a volume of the
+    scene. Computed band by band, so no full resolution copy is made.
+    """
+    factor = overview_factor(image.shape, max_size)
+    if factor == 1:
+        return image, factor
+    return (
+        band_overview(lambda start, stop: image[start:stop], image.shape[0], factor),
+        factor,
+    )
+
+
+def read_scan_overview(path, max_size=OVERVIEW_MAX_SIZE):
+    """(overview, factor) of a scan file, only OVERVIEW_BAND_ROWS rows of a TIFF scan are in memory at once."""
+    if not is_tiff(path):
+        return image_overview(read_whole_scan(path), max_size)
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages[0]
+        rows, cols = page.imagelength, page.imagewidth
+        factor = overview_factor((rows, cols), max_size)
+        return (
+            band_overview(
+                lambda start, stop: read_tiff_window(page, start, stop, 0, cols),
+                rows,
+                factor,
+            ),
+            factor,
+        )
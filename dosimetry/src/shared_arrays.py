@@ -0,0 +1,98 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+
+class SharedArray(object):
+    """
+    numpy array placed in a multiprocessing.shared_memory block.
+    The driver creates it, pool workers attach to it through the picklable
+    descriptor (name, shape, dtype), so only the descriptor crosses the
+    process boundary. The creator is responsible for unlink().
+    """
+
+    def __init__(self, block, shape, dtype):
+        self.block = block
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)
+
+    @classmethod
+    def create(cls, shape, dtype):
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        return cls(shared_memory.SharedMemory(create=True, size=size), shape, dtype)
+
+    @classmethod
+    def copy_of(cls, array):
+        shared = cls.create(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, descriptor, track=True):
+        """
+        Block created by another process. Blocks created by another program,
+        such as Slicer for the dosimetry subprocess, are attached with
+        track=False, so that the resource tracker of this program does not
+        unlink them when it exits.
+        """
+        name, shape, dtype = descriptor
+        shared = cls(shared_memory.SharedMemory(name=name), shape, dtype)
+        if not track:
+            shared.untrack()
+        return shared
+
+    def untrack(self):
+        """
+        Unregisters the block from the resource tracker of this program, which
+        unlinks the blocks still registered when the program exits.
+        """
+        if os.name == "posix":
+            resource_tracker.unregister(self.block._name, "shared_memory")
+
+    @property
+    def descriptor(self):
+        return (self.block.name, self.shape, self.dtype.str)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        self.unlink()
+
+    def close(self):
+        # the view has to be released before the block can be closed
+        self.array = None
+        self.block.close()
+
+    def unlink(self):
+        self.block.unlink()
+
+
+def attached_array(descriptor, attached):
+    """
+    Array of a block described by descriptor, attaching on first use.
+    attached is a dict owned by the caller (one per worker process) that keeps
+    the blocks open for the lifetime of the worker.
+    """
+    if descriptor[0] not in attached:
+        attached[descriptor[0]] = SharedArray.attach(descriptor)
+    return attached[descriptor[0]].array
+
+
+def share_resource_tracker():
+    """
+    Starts the resource tracker of this process, so that pool workers forked
+    afterwards report the blocks they attach to it. Workers forked before it
+    runs start trackers of their own, which unlink those blocks again on exit.
+    """
+    if os.name == "posix":
+        resource_tracker.ensure_running()
+
+
+def release_attached(attached):
+    """Closes every block of attached, without unlinking it, and empties the dict."""
+    for shared in attached.values():
+        shared.close()
+    attached.clear()
@@ -0,0 +1,170 @@
+import logging
+import concurrent.futures
+from collections import Counter
+import numpy as np
+from src.optimize import (
+    optimize,
+    optimize_seeded,
+    deduplicate_pixels,
+    SOLVER_STATISTICS,
+)
+from src.utils import split_into_tiles
+from src.tile_store import TileRowWriter
+from src.worker_tuning import resolve_worker_count
+from src.logic_subprocess import (
+    image_tiles,
+    deduplicates,
+    statistic_lines,
+    downsample_image,
+    upsample_image,
+    DEDUPLICATION_CHUNK_SIZE,
+    PYRAMID_MIN_SIZE,
+)
+
+
+def counted_task(function, *args):
+    """function(*args) and the solver statistics counted by the calling thread meanwhile."""
+    SOLVER_STATISTICS.clear()
+    return function(*args), dict(SOLVER_STATISTICS)
+
+
+def run_threaded_tasks(jobs, parameters, progressUpdate=None, task_done=None):
+    """
+    Runs function(*args) for every (function, args, target, start, stop) in
+    jobs on a thread pool and writes the result into target[start:stop].
+    task_done(id) is called with the index of every finished job.
+    The solvers spend their time in NumPy kernels that release the GIL, so
+    threads working on views of the input arrays replace the process pool.
+    The summed solver statistics are logged at the end, as run_tasks reports them.
+    """
+    statistics = Counter()
+    to_do = len(jobs)
+    done = 0
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(parameters["number_of_processes"], to_do))
+    ) as executor:
+        future_to_job = {
+            executor.submit(counted_task, function, *args): (id, target, start, stop)
+            for id, (function, args, target, start, stop) in enumerate(jobs)
+        }
+        try:
+            for future in concurrent.futures.as_completed(future_to_job):
+                id, target, start, stop = future_to_job.pop(future)
+                target[start:stop], task_statistics = future.result()
+                statistics.update(task_statistics)
+                if task_done is not None:
+                    task_done(id)
+                done += 1
+                if progressUpdate is not None:
+                    progressUpdate(done / to_do)
+        except BaseException:
+            # progressUpdate raises to cancel the run, queued tiles are dropped
+            for future in future_to_job:
+                future.cancel()
+            raise
+
+    for line in statistic_lines(statistics):
+        logging.info(f"Solver statistic {line}")
+
+
+def solve_regions_in_threads(images, parameters, progressUpdate=None, stores=None):
+    """In-process counterpart of logic_subprocess.solve_regions, images are not copied."""
+    stores = stores or [None] * len(images)
+    # the benchmark starts process pools, so it is not run inside Slicer
+    n_threads = resolve_worker_count(
+        parameters, sum(img.shape[0] * img.shape[1] for img in images), benchmark=False
+    )
+    logging.info(f"Solver statistic number_of_processes={n_threads}")
+    parameters = {**parameters, "number_of_processes": n_threads}
+    factor = parameters.get("pyramid_factor", 1)
+    if factor > 1:
+        return [
+            (
+                solve_region_pyramid_in_threads(img, parameters, progressUpdate, store)
+                if min(img.shape[:2]) >= PYRAMID_MIN_SIZE * factor
+                else solve_regions_flat_in_threads(
+                    [img], parameters, progressUpdate, [store]
+                )[0]
+            )
+            for img, store in zip(images, stores)
+        ]
+    return solve_regions_flat_in_threads(images, parameters, progressUpdate, stores)
+
+
+def solve_regions_flat_in_threads(images, parameters, progressUpdate=None, stores=None):
+    stores = stores or [None] * len(images)
+    if deduplicates(parameters, stores):
+        pixels = np.concatenate([img.reshape(-1, 3) for img in images], axis=0)
+        unique_pixels, inverse = deduplicate_pixels(pixels)
+        logging.info(
+            f"Unique RGB triplets: {unique_pixels.shape[0] / pixels.shape[0] * 100:.2f}% of all pixels"
+        )
+        unique_doses = np.zeros(unique_pixels.shape[0], dtype=np.uint16)
+        jobs = [
+            (
+                optimize,
+                (unique_pixels[start:stop], parameters),
+                unique_doses,
+                start,
+                stop,
+            )
+            for start, stop in split_into_tiles(
+                unique_pixels.shape[0], 1, 1, tile_rows=DEDUPLICATION_CHUNK_SIZE
+            )
+        ]
+        run_threaded_tasks(jobs, parameters, progressUpdate)
+        doses = unique_doses[inverse]
+
+        result_images = []
+        first_pixel = 0
+        for img in images:
+            n_pixels = img.shape[0] * img.shape[1]
+            result_images.append(
+                doses[first_pixel : first_pixel + n_pixels].reshape(img.shape[:2])
+            )
+            first_pixel += n_pixels
+        return result_images
+
+    result_images = [np.zeros(img.shape[:2], dtype=np.uint16) for img in images]
+    jobs = []
+    job_writers = []
+    for img, target, store in zip(images, result_images, stores):
+        writer = TileRowWriter(store, target) if store is not None else None
+        for start, stop in image_tiles(img, parameters):
+            jobs.append((optimize, (img[start:stop], parameters), target, start, stop))
+            job_writers.append(writer)
+
+    def task_done(id):
+        if job_writers[id] is not None:
+            job_writers[id].rows_solved(*jobs[id][-2:])
+
+    run_threaded_tasks(jobs, parameters, progressUpdate, task_done)
+    return result_images
+
+
+def solve_region_pyramid_in_threads(img, parameters, progressUpdate=None, store=None):
+    factor = parameters["pyramid_factor"]
+    (low_resolution_dose,) = solve_regions_flat_in_threads(
+        [downsample_image(img, factor)], parameters
+    )
+    seeds = upsample_image(low_resolution_dose, img.shape, factor)
+
+    result_image = np.zeros(img.shape[:2], dtype=np.uint16)
+    jobs = [
+        (
+            optimize_seeded,
+            (img[start:stop], seeds[start:stop], parameters),
+            result_image,
+            start,
+            stop,
+        )
+        for start, stop in image_tiles(img, parameters)
+    ]
+    writer = TileRowWriter(store, result_image) if store is not None else None
+
+    def task_done(id):
+        if writer is not None:
+            writer.rows_solved(*jobs[id][-2:])
+
+    run_threaded_tasks(jobs, parameters, progressUpdate, task_done)
+    return result_image
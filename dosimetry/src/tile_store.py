@@ -0,0 +1,215 @@
+"""
+Chunked on-disk store of dose maps, for films too large to save in one piece.
+A store is a directory:
+
+    index.json              shape, dtype, tile size, spacing and origin of the map
+    tile_<row>_<col>.npz    compressed tiles, written as soon as they are solved
+
+Convert a store to NRRD for Slicer with the Python of Slicer from the
+dosimetry module directory:
+
+    PythonSlicer -m src.tile_store <store directory> <output.nrrd>
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+
+INDEX_FILE = "index.json"
+TILE_STORE_EXTENSION = ".tiles"
+NRRD_TYPES = {
+    "uint8": "unsigned char",
+    "int16": "short",
+    "uint16": "unsigned short",
+    "int32": "int",
+    "uint32": "unsigned int",
+    "float32": "float",
+    "float64": "double",
+}
+
+
+def write_json(path, value):
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(value, f, indent=2)
+    os.replace(temporary_path, path)
+
+
+class TileStore(object):
+    """
+    2D image split into tile_size x tile_size tiles saved as compressed .npz
+    files. Tiles are written one by one and a region is read by decoding only
+    the tiles it overlaps, tiles not written yet read as zeros. finish()
+    records the written tiles in the index once the image is complete.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), "r") as f:
+            self.index = json.load(f)
+        self.shape = tuple(self.index["shape"])
+        self.dtype = np.dtype(self.index["dtype"])
+        self.tile_size = self.index["tile_size"]
+
+    @classmethod
+    def create(
+        cls, path, shape, dtype, tile_size, spacing=(1.0, 1.0), origin=(0.0, 0.0)
+    ):
+        """Empty store of an image of shape (rows, columns), tiles of an older store at path are removed."""
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.startswith("tile_"):
+                os.remove(os.path.join(path, name))
+        write_json(
+            os.path.join(path, INDEX_FILE),
+            {
+                "shape": [int(size) for size in shape[:2]],
+                "dtype": np.dtype(dtype).name,
+                "tile_size": int(tile_size),
+                "spacing": [float(value) for value in spacing],
+                "origin": [float(value) for value in origin],
+                "complete": False,
+                "tiles": [],
+            },
+        )
+        return cls(path)
+
+    @property
+    def grid(self):
+        """Number of tile rows and tile columns."""
+        return (
+            -(-self.shape[0] // self.tile_size),
+            -(-self.shape[1] // self.tile_size),
+        )
+
+    def tile_path(self, tile_row, tile_col):
+        return os.path.join(self.path, f"tile_{tile_row}_{tile_col}.npz")
+
+    def write_tile(self, tile_row, tile_col, tile):
+        """Saves a tile, through a temporary file so readers never see half of it."""
+        path = self.tile_path(tile_row, tile_col)
+        with open(path + ".tmp", "wb") as f:
+            np.savez_compressed(f, tile=np.ascontiguousarray(tile, self.dtype))
+        os.replace(path + ".tmp", path)
+
+    def write_tile_row(self, image, tile_row):
+        """Saves every tile of tile_row from image, an array of the whole map."""
+        top = tile_row * self.tile_size
+        for tile_col in range(self.grid[1]):
+            left = tile_col * self.tile_size
+            self.write_tile(
+                tile_row,
+                tile_col,
+                image[top : top + self.tile_size, left : left + self.tile_size],
+            )
+
+    def write_image(self, image):
+        for tile_row in range(self.grid[0]):
+            self.write_tile_row(image, tile_row)
+
+    def finish(self):
+        self.index["tiles"] = sorted(
+            name
+            for name in os.listdir(self.path)
+            if name.startswith("tile_") and name.endswith(".npz")
+        )
+        self.index["complete"] = True
+        write_json(os.path.join(self.path, INDEX_FILE), self.index)
+
+    def read_tile(self, tile_row, tile_col):
+        """The tile, or None when it was not written yet."""
+        path = self.tile_path(tile_row, tile_col)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data["tile"]
+
+    def read(self, row_start=0, row_stop=None, col_start=0, col_stop=None):
+        """Rows [row_start, row_stop) and columns [col_start, col_stop) of the image."""
+        row_stop = self.shape[0] if row_stop is None else min(row_stop, self.shape[0])
+        col_stop = self.shape[1] if col_stop is None else min(col_stop, self.shape[1])
+        region = np.zeros(
+            (max(0, row_stop - row_start), max(0, col_stop - col_start)), self.dtype
+        )
+        size = self.tile_size
+        for tile_row in range(row_start // size, -(-row_stop // size)):
+            for tile_col in range(col_start // size, -(-col_stop // size)):
+                tile = self.read_tile(tile_row, tile_col)
+                if tile is None:
+                    continue
+                top, left = tile_row * size, tile_col * size
+                rows = slice(max(row_start, top), min(row_stop, top + tile.shape[0]))
+                cols = slice(max(col_start, left), min(col_stop, left + tile.shape[1]))
+                region[
+                    rows.start - row_start : rows.stop - row_start,
+                    cols.start - col_start : cols.stop - col_start,
+                ] = tile[
+                    rows.start - top : rows.stop - top,
+                    cols.start - left : cols.stop - left,
+                ]
+        return region
+
+    def to_nrrd(self, nrrd_path):
+        """Writes the image as a raw NRRD file, one tile row at a time."""
+        spacing = self.index["spacing"]
+        origin = self.index["origin"]
+        header = "\n".join(
+            [
+                "NRRD0004",
+                f"type: {NRRD_TYPES[self.dtype.name]}",
+                "dimension: 2",
+                "space dimension: 2",
+                f"sizes: {self.shape[1]} {self.shape[0]}",
+                f"space directions: ({spacing[0]:.17g},0) (0,{spacing[1]:.17g})",
+                "kinds: domain domain",
+                "endian: little",
+                "encoding: raw",
+                f"space origin: ({origin[0]:.17g},{origin[1]:.17g})",
+                "",
+                "",
+            ]
+        )
+        with open(nrrd_path, "wb") as f:
+            f.write(header.encode("ascii"))
+            for tile_row in range(self.grid[0]):
+                band = self.read(
+                    tile_row * self.tile_size, (tile_row + 1) * self.tile_size
+                )
+                f.write(band.astype(self.dtype.newbyteorder("<")).tobytes())
+
+
+class TileRowWriter(object):
+    """
+    Saves the tile rows of image, a map solved in blocks of rows, to store as
+    soon as all their rows are solved.
+    """
+
+    def __init__(self, store, image):
+        self.store = store
+        self.image = image
+        self.solved = np.zeros(store.shape[0], dtype=bool)
+        self.written = np.zeros(store.grid[0], dtype=bool)
+
+    def rows_solved(self, start, stop):
+        self.solved[start:stop] = True
+        size = self.store.tile_size
+        for tile_row in range(start // size, -(-stop // size)):
+            rows = self.solved[tile_row * size : (tile_row + 1) * size]
+            if not self.written[tile_row] and rows.all():
+                self.store.write_tile_row(self.image, tile_row)
+                self.written[tile_row] = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Converts a tiled dose map to NRRD for Slicer."
+    )
+    parser.add_argument("store", help="directory of the tiled dose map")
+    parser.add_argument("output", help="NRRD file to write")
+    arguments = parser.parse_args(argv)
+    TileStore(arguments.store).to_nrrd(arguments.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import os
+import json
+import math
+import time
+import platform
+import numpy as np
+from src.optimize import optimize, calibration_model
+from src.utils import parrarelize_processes
+from src.workspace import user_cache_directory
+
+MIN_PIXELS_PER_WORKER = 16384
+WORKER_MEMORY_BYTES = 256 * 2**20
+BENCHMARK_PIXELS = 2**17
+BENCHMARK_MIN_GAIN = 1.1
+BENCHMARK_FILE = "worker_tuning.json"
+# MemAvailable counts the page cache the kernel can drop, unlike free pages
+MEMINFO_PATH = "/proc/meminfo"
+
+
+def available_memory():
+    """Available physical memory in bytes, None when it cannot be determined."""
+    try:
+        with open(MEMINFO_PATH, "r") as f:
+            for line in f:
+                name, value = line.split(":", 1)
+                if name == "MemAvailable":
+                    return int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def machine_key():
+    return f"{platform.node()}-{os.cpu_count()}"
+
+
+def benchmark_path():
+    return os.path.join(user_cache_directory(), BENCHMARK_FILE)
+
+
+def recorded_worker_count():
+    """Worker count recorded by the benchmark for this machine, None before the first run."""
+    path = benchmark_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        record = json.load(f)
+    return record.get(machine_key(), {}).get("number_of_processes")
+
+
+def benchmark_pixels(parameters, n_pixels):
+    model = calibration_model(parameters)
+    doses = np.linspace(0, parameters["max_dose"], n_pixels)[None]
+    values = model.value(doses).T * parameters["normalization_factor"]
+    return np.clip(np.round(values), 0, 65535).astype(np.uint16)
+
+
+def benchmark_worker_count(parameters, mp_context=None):
+    """
+    Solves BENCHMARK_PIXELS synthetic pixels with 1, 2, 4, ... workers up to
+    the CPU count and returns the fastest worker count. Doubling stops once it
+    speeds the solve up by less than BENCHMARK_MIN_GAIN.
+    The result is stored in the user cache directory, keyed by the machine.
+    """
+    pixels = benchmark_pixels(parameters, BENCHMARK_PIXELS)
+    benchmark_parameters = {**parameters, "cache_size": 0}
+    cpu_count = os.cpu_count() or 1
+    candidates = sorted(
+        {min(2**i, cpu_count) for i in range(int(math.log2(cpu_count)) + 2)}
+    )
+
+    best, best_time = 1, None
+    for n_workers in candidates:
+        chunks = np.array_split(pixels, n_workers * 4)
+        startTime = time.time()
+        for _ in parrarelize_processes(
+            optimize,
+            [(chunk, benchmark_parameters) for chunk in chunks],
+            n_executors=n_workers,
+            mp_context=mp_context,
+        ):
+            pass
+        elapsed = time.time() - startTime
+        if best_time is not None and elapsed * BENCHMARK_MIN_GAIN > best_time:
+            break
+        best, best_time = n_workers, elapsed
+
+    path = benchmark_path()
+    record = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            record = json.load(f)
+    record[machine_key()] = {
+        "number_of_processes": best,
+        "pixels_per_second": BENCHMARK_PIXELS / best_time,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(record, f, indent=2)
+    return best
+
+
+def resolve_worker_count(parameters, n_pixels, benchmark=True, mp_context=None):
+    """
+    number_of_processes as an int. "auto" takes the benchmarked worker count of
+    this machine (running the benchmark on first use when benchmark is set, the
+    CPU count otherwise) and lowers it for regions of n_pixels pixels that are
+    too small to keep all workers busy and for low free memory.
+    """
+    value = parameters["number_of_processes"]
+    if value != "auto":
+        return int(value)
+
+    machine = recorded_worker_count()
+    if machine is None:
+        if benchmark:
+            machine = benchmark_worker_count(parameters, mp_context)
+        else:
+            machine = os.cpu_count() or 1
+
+    n_workers = machine
+    if n_pixels is not None:
+        n_workers = min(n_workers, math.ceil(n_pixels / MIN_PIXELS_PER_WORKER))
+    memory = available_memory()
+    if memory is not None:
+        n_workers = min(n_workers, memory // WORKER_MEMORY_BYTES)
+    return max(1, int(n_workers))
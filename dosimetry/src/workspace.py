@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+
+WORKSPACE_DIRECTORY = "slicer_dosimetry"
+OWNER_FILE = "owner.pid"
+# tmpfs, run files never touch the disk
+LINUX_SCRATCH_ROOT = "/dev/shm"
+# seconds before a workspace without an owner counts as a leftover, it may be just being created
+LEFTOVER_GRACE = 60
+
+
+def default_scratch_root():
+    """tmpfs on Linux, the system temp directory elsewhere."""
+    if os.path.isdir(LINUX_SCRATCH_ROOT) and os.access(LINUX_SCRATCH_ROOT, os.W_OK):
+        return os.path.join(LINUX_SCRATCH_ROOT, WORKSPACE_DIRECTORY)
+    return os.path.join(tempfile.gettempdir(), WORKSPACE_DIRECTORY)
+
+
+def user_cache_directory():
+    """Per-user directory of the files kept between runs, outside of the module install."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or tempfile.gettempdir()
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, WORKSPACE_DIRECTORY)
+
+
+def scratch_root(parameters):
+    return parameters.get("scratch_root") or default_scratch_root()
+
+
+def input_key(arrays, *values):
+    """Short hash of the input arrays and values of a run."""
+    digest = hashlib.blake2b(digest_size=8)
+    for array in arrays:
+        digest.update(str((array.shape, array.dtype.str)).encode("utf-8"))
+        digest.update(
+            memoryview(array).cast("B") if array.flags.c_contiguous else array.tobytes()
+        )
+    for value in values:
+        digest.update(repr(value).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def process_alive(pid):
+    if os.name == "nt":
+        import ctypes
+
+        # PROCESS_QUERY_LIMITED_INFORMATION, STILL_ACTIVE
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return exit_code.value == 259
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def directory_size(path):
+    size = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return size
+
+
+def is_leftover(path):
+    """A workspace whose run failed or whose process is gone."""
+    try:
+        with open(os.path.join(path, OWNER_FILE), "r") as f:
+            return not process_alive(int(f.read()))
+    except (OSError, ValueError):
+        return True
+
+
+def sweep_leftovers(root, size_cap):
+    """Removes leftover workspaces under root, oldest first, until they take at most size_cap bytes."""
+    if not os.path.isdir(root):
+        return
+    leftovers = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path) or not is_leftover(path):
+            continue
+        modified = os.path.getmtime(path)
+        if time.time() - modified > LEFTOVER_GRACE:
+            leftovers.append((modified, directory_size(path), path))
+    total = sum(size for _, size, _ in leftovers)
+    for _, size, path in sorted(leftovers):
+        if total <= size_cap:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+class Workspace(object):
+    """
+    Directory of the files of one dosimetry run under a scratch root, named
+    by the hash of the run's inputs plus a unique suffix, so concurrent runs
+    never share files. Used as a context manager it is removed when the run
+    succeeds or raises one of discard_on (e.g. a cancel). When the run fails
+    otherwise it is kept for its logs, and leftovers of failed or crashed
+    runs are removed oldest first whenever they exceed size_cap bytes.
+    """
+
+    def __init__(self, root, key, size_cap=0, discard_on=()):
+        self.root = root
+        self.size_cap = size_cap
+        self.discard_on = discard_on
+        self.path = os.path.join(root, f"{key}-{uuid.uuid4().hex[:8]}")
+
+    def __enter__(self):
+        os.makedirs(self.root, exist_ok=True)
+        sweep_leftovers(self.root, self.size_cap)
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, OWNER_FILE), "w") as f:
+            f.write(str(os.getpid()))
+        return self.path
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or issubclass(exc_type, self.discard_on):
+            self.remove()
+        else:
+            self.release()
+            logging.info(f"Files of the failed run kept in {self.path}")
+
+    def release(self):
+        """Marks the workspace as a leftover, to be removed by a later sweep."""
+        try:
+            os.remove(os.path.join(self.path, OWNER_FILE))
+        except OSError:
+            pass
+        os.utime(self.path, (time.time(), time.time()))
+
+    def remove(self):
+        # a file still open by a killed process can briefly block removal on Windows
+        shutil.rmtree(self.path, ignore_errors=True)
+        if os.path.exists(self.path):
+            self.release()
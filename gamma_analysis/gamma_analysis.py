@@ -81,6 +81,16 @@ class gamma_analysis(ScriptedLoadableModule):
 
         # Additional initialization step after application startup is complete
         slicer.app.connect("startupCompleted()", registerSampleData)
+        slicer.app.connect("startupCompleted()", registerJobRunner)
+
+
+def registerJobRunner():
+    """Let the shared job queue run (and resume) queued gamma analyses."""
+    from src.job_queue import job_queue
+
+    job_queue().register_runner(
+        "gamma_analysis", gamma_analysisLogic().runGammaAnalysisJob, main_thread=True
+    )
 
 
 def registerSampleData():
@@ -97,6 +97,37 @@ class gamma_analysisLogic(ScriptedLoadableModuleLogic):
 
         return GPR, gammaImage, alignedRtDose, section
 
+    def runGammaAnalysisJob(self, jobId, arguments, cpus, progressUpdate=None):
+        """
+        Runs a queued gamma analysis on the dosimetry result file in arguments
+        and saves the gamma image next to it, returns a summary message.
+        Loads volumes into the scene, so it has to run on the main thread.
+        """
+        dosimetryResultVolume = slicer.util.loadVolume(arguments["dosimetryResultPath"])
+        try:
+            GPR, gammaImage, _, _ = self.runGammaAnalysis(
+                dosimetryResultVolume,
+                arguments["rtDoseFilepath"],
+                arguments["rtPlanFilepath"],
+                arguments["dose"],
+                arguments["dose_threshold"],
+                arguments["dta"],
+                arguments["localGamma"],
+            )
+            gammaImageFile = sitk.GetImageFromArray(gammaImage)
+            gammaImageFile.SetOrigin(dosimetryResultVolume.GetOrigin()[:2])
+            gammaImageFile.SetSpacing(dosimetryResultVolume.GetSpacing()[:2])
+        finally:
+            slicer.mrmlScene.RemoveNode(dosimetryResultVolume)
+
+        resultName = os.path.basename(arguments["dosimetryResultPath"]).split(".")[0]
+        saveFileName = os.path.join(
+            os.path.dirname(arguments["dosimetryResultPath"]),
+            f"{resultName}_gamma.nrrd",
+        )
+        sitk.WriteImage(gammaImageFile, saveFileName)
+        return f"GPR {GPR:.2f}%, saved {saveFileName}"
+
     def __loadVolumeFromDICOMFile(self, dicomFile, name):
         pixelImage = dicomFile.pixel_array.astype(np.uint16)
 
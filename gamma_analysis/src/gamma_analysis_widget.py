@@ -25,6 +25,8 @@ from slicer import vtkMRMLScalarVolumeNode
 from src.gamma_analysis_logic import gamma_analysisLogic
 from src.gamma_analysis_settings_widget import GammaAnalysisSettingsWidget
 from src.gamma_analysis_parameter_node import gamma_analysisParameterNode
+from src.job_queue import job_queue
+from src.job_queue_widget import JobQueueWidget
 
 #
 # gamma_analysisWidget
@@ -74,6 +76,7 @@ class gamma_analysisWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
 
         # Buttons
         self.ui.runButton.connect("clicked(bool)", self.onRunButton)
+        self.ui.queueButton.connect("clicked(bool)", self.onQueueButton)
 
         self.settingsCollapsibleButton = ctk.ctkCollapsibleButton()
         self.settingsCollapsibleButton.text = "Advanced Settings"
@@ -89,6 +92,9 @@ class gamma_analysisWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         )
         self.settingsFormLayout.addWidget(self.settingsWidget.widget)
 
+        self.jobQueueWidget = JobQueueWidget(parentWidget=uiWidget)
+        self.layout.addWidget(self.jobQueueWidget.widget)
+
         self.ui.localGammaCheckbox.connect(
             "stateChanged(int)", self.__onLocalGammaCheckboxChange
         )
@@ -105,6 +111,7 @@ class gamma_analysisWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
     def cleanup(self) -> None:
         """Called when the application closes and the module widget is destroyed."""
         self.removeObservers()
+        self.jobQueueWidget.cleanup()
 
     def enter(self) -> None:
         """Called each time the user opens this module."""
@@ -167,9 +174,11 @@ class gamma_analysisWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
         ):
             self.ui.runButton.toolTip = _("Compute gamma index")
             self.ui.runButton.enabled = True
+            self.ui.queueButton.enabled = True
         else:
             self.ui.runButton.toolTip = _("Select reference and evaluated volume nodes")
             self.ui.runButton.enabled = False
+            self.ui.queueButton.enabled = False
         self.ui.gammaLineEdit.text = ""
 
     def __onRunButtonCheck(self):
@@ -180,6 +189,41 @@ class gamma_analysisWidget(ScriptedLoadableModuleWidget, VTKObservationMixin):
             errors.append("Did not set RT Dose File!")
         return errors
 
+    def onQueueButton(self) -> None:
+        errors = self.__onRunButtonCheck()
+
+        try:
+            advancedSettings = self.settingsWidget.getData()
+        except ValueError as e:
+            errors.append(e.args[0])
+
+        storageNode = None
+        if self._parameterNode and self._parameterNode.dosimetryResultVolume:
+            storageNode = self._parameterNode.dosimetryResultVolume.GetStorageNode()
+        if storageNode is None or not storageNode.GetFileName():
+            errors.append("Dosimetry result has to be saved to a file to be queued")
+
+        if len(errors) > 0:
+            slicer.util.errorDisplay("\n".join(errors))
+            return
+
+        arguments = {
+            "dosimetryResultPath": storageNode.GetFileName(),
+            "rtDoseFilepath": self.ui.rtDoseFileSelector.currentPath,
+            "rtPlanFilepath": self.ui.rtPlanFileSelector.currentPath,
+            "dose": advancedSettings["dose"],
+            "dose_threshold": advancedSettings["dose_threshold"],
+            "dta": advancedSettings["dta"],
+            "localGamma": self.ui.localGammaCheckbox.checked,
+        }
+        job_queue().submit(
+            "gamma_analysis",
+            self._parameterNode.dosimetryResultVolume.GetName(),
+            arguments,
+        )
+        self.jobQueueWidget.widget.collapsed = False
+        self.jobQueueWidget.refresh()
+
     def onRunButton(self) -> None:
         errors = self.__onRunButtonCheck()
 
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+DEFAULT_QUEUE_PATH = os.path.join(
+    os.path.expanduser("~"), ".slicer_dosimetry", "job_queue.json"
+)
+
+# queue shared by the dosimetry and gamma_analysis modules of the Slicer session
+JOB_QUEUE = {}
+
+
+def job_queue(path=DEFAULT_QUEUE_PATH):
+    if "queue" not in JOB_QUEUE:
+        JOB_QUEUE["queue"] = JobQueue(path)
+    return JOB_QUEUE["queue"]
+
+
+class JobQueue(object):
+    """
+    Persistent queue of dosimetry and gamma analysis jobs.
+    A job is a dict with a kind, a title, JSON-serialisable arguments and the
+    number of CPUs it asks for. Modules register a runner per kind:
+    run(job_id, arguments, cpus, progressUpdate) returns a short result message,
+    cancel(job_id) stops a running job. Jobs run when the CPUs they are granted
+    fit into cpu_budget next to the jobs already running, so concurrent pools
+    do not oversubscribe the machine. Runners that touch the scene are
+    registered with main_thread=True and only run from run_main_thread_jobs,
+    the others get a thread each. The queue is saved on every status change
+    and jobs interrupted by a restart are pending again on the next load.
+    """
+
+    def __init__(self, path, cpu_budget=None):
+        self.path = path
+        self.cpu_budget = cpu_budget or os.cpu_count() or 1
+        self.lock = threading.RLock()
+        self.runners = {}
+        self.jobs = self.__load()
+
+    def register_runner(self, kind, run, cancel=None, main_thread=False):
+        with self.lock:
+            self.runners[kind] = {
+                "run": run,
+                "cancel": cancel,
+                "main_thread": main_thread,
+            }
+        self.schedule()
+
+    def submit(self, kind, title, arguments, cpus=1):
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "title": title,
+            "arguments": arguments,
+            "cpus": max(1, int(cpus)),
+            "granted": 0,
+            "status": PENDING,
+            "progress": 0.0,
+            "message": "",
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+        }
+        with self.lock:
+            self.jobs.append(job)
+            self.__save()
+        self.schedule()
+        return job["id"]
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.__job(job_id)
+            if job["status"] == PENDING:
+                job["status"] = CANCELLED
+                job["finished"] = time.time()
+                self.__save()
+                return
+            runner = self.runners.get(job["kind"])
+            if job["status"] != RUNNING or runner is None:
+                return
+            job["cancelRequested"] = True
+        if runner["cancel"] is not None:
+            runner["cancel"](job_id)
+
+    def remove_finished(self):
+        with self.lock:
+            self.jobs = [
+                job for job in self.jobs if job["status"] in [PENDING, RUNNING]
+            ]
+            self.__save()
+
+    def snapshot(self):
+        """Copies of all jobs in submission order, for status displays."""
+        with self.lock:
+            return [dict(job) for job in self.jobs]
+
+    def schedule(self):
+        """Starts every pending background job that fits into the CPU budget."""
+        with self.lock:
+            for job in self.__runnable(main_thread=False):
+                job["granted"] = self.__grant(job)
+                self.__markStarted(job)
+                threading.Thread(
+                    target=self.__runJob,
+                    args=(job, self.runners[job["kind"]]),
+                    daemon=True,
+                ).start()
+
+    def run_main_thread_jobs(self):
+        """Runs pending main thread jobs that fit into the CPU budget, called from a GUI timer."""
+        while True:
+            with self.lock:
+                runnable = self.__runnable(main_thread=True)
+                if len(runnable) == 0:
+                    return
+                job = runnable[0]
+                job["granted"] = self.__grant(job)
+                self.__markStarted(job)
+            self.__runJob(job, self.runners[job["kind"]])
+
+    def __runnable(self, main_thread):
+        runnable = []
+        used = sum(job["granted"] for job in self.jobs if job["status"] == RUNNING)
+        for job in self.jobs:
+            runner = self.runners.get(job["kind"])
+            if job["status"] != PENDING or runner is None:
+                continue
+            if runner["main_thread"] != main_thread:
+                continue
+            granted = self.__grant(job)
+            if used > 0 and used + granted > self.cpu_budget:
+                break
+            used += granted
+            runnable.append(job)
+            if main_thread:
+                break
+        return runnable
+
+    def __grant(self, job):
+        return min(job["cpus"], self.cpu_budget)
+
+    def __markStarted(self, job):
+        job["status"] = RUNNING
+        job["progress"] = 0.0
+        job["started"] = time.time()
+        self.__save()
+
+    def __runJob(self, job, runner):
+        def progressUpdate(value):
+            job["progress"] = value
+
+        try:
+            message = runner["run"](
+                job["id"], job["arguments"], job["granted"], progressUpdate
+            )
+            status = DONE
+        except Exception as e:
+            message = str(e) or type(e).__name__
+            status = CANCELLED if job.get("cancelRequested") else FAILED
+
+        with self.lock:
+            job["status"] = status
+            job["message"] = message or ""
+            job["finished"] = time.time()
+            job["granted"] = 0
+            self.__save()
+        self.schedule()
+
+    def __job(self, job_id):
+        for job in self.jobs:
+            if job["id"] == job_id:
+                return job
+        raise KeyError(f"Unknown job {job_id}")
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r") as f:
+            jobs = json.load(f)
+        for job in jobs:
+            # interrupted by the end of the previous session
+            if job["status"] == RUNNING:
+                job["status"] = PENDING
+                job["granted"] = 0
+                job.pop("cancelRequested", None)
+        return jobs
+
+    def __save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporaryPath = self.path + ".tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump(self.jobs, f, indent=2)
+        os.replace(temporaryPath, self.path)
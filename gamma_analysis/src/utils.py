@@ -1,19 +1,97 @@
 import concurrent.futures
 import concurrent
+import multiprocessing
+import math
 
+TILES_PER_WORKER = 4
+MIN_TILE_PIXELS = 4096
+
+# state shipped once to every pool worker by initialize_worker
+WORKER_STATE = {}
+
+
+def initialize_worker(parameters):
+    WORKER_STATE["parameters"] = parameters
+
+
+def worker_parameters():
+    return WORKER_STATE["parameters"]
+
+
+def split_into_tiles(n_rows, n_columns, n_workers, tile_rows=0):
+    """
+    Splits n_rows image rows into (start, stop) row blocks.
+    With tile_rows <= 0 the block height is chosen so that every worker gets
+    about TILES_PER_WORKER tiles, but no tile is smaller than MIN_TILE_PIXELS.
+    """
+    if tile_rows <= 0:
+        tile_rows = math.ceil(n_rows / (max(1, n_workers) * TILES_PER_WORKER))
+        tile_rows = max(tile_rows, math.ceil(MIN_TILE_PIXELS / max(1, n_columns)))
+    tile_rows = max(1, min(tile_rows, n_rows))
+    return [
+        (start, min(start + tile_rows, n_rows)) for start in range(0, n_rows, tile_rows)
+    ]
+
+
+def process_context(start_method=None, preload=()):
+    """
+    multiprocessing context for start_method (fork | forkserver | spawn),
+    None or "default" keeps the platform default. The forkserver imports the
+    modules in preload once, so workers forked from it start with them loaded.
+    """
+    if start_method in (None, "default"):
+        return multiprocessing.get_context()
+    if start_method not in multiprocessing.get_all_start_methods():
+        raise ValueError(
+            f"Start method {start_method} is not supported on this platform"
+        )
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver" and len(preload) > 0:
+        context.set_forkserver_preload(list(preload))
+    return context
+
+
+def parrarelize_processes(
+    function,
+    args_list,
+    n_executors=5,
+    initializer=None,
+    initargs=(),
+    executor=None,
+    mp_context=None,
+):
+    """
+    Yields (id, result) of function(*args) for every args tuple in args_list
+    as soon as it finishes. A new pool is started for the call unless an
+    already running executor is given.
+    """
+    if executor is not None:
+        yield from collect_results(executor, function, args_list)
+        return
 
-def parrarelize_processes(function, args_list, n_executors=5):
-    assert n_executors < 30
     with concurrent.futures.ProcessPoolExecutor(
-        max_workers=min(n_executors, len(args_list))
+        max_workers=min(n_executors, len(args_list)),
+        mp_context=mp_context,
+        initializer=initializer,
+        initargs=initargs,
     ) as executor:
-        future_to_id = {
-            executor.submit(function, *args): id for id, args in enumerate(args_list)
-        }
+        yield from collect_results(executor, function, args_list)
+
+
+def collect_results(executor, function, args_list):
+    future_to_id = {
+        executor.submit(function, *args): id for id, args in enumerate(args_list)
+    }
+    try:
         for future in concurrent.futures.as_completed(future_to_id):
             id = future_to_id[future]
             yield (id, future.result())
             del future_to_id[future]
+    except BaseException:
+        # on errors and cancellation only the tasks already running are finished
+        for future in future_to_id:
+            future.cancel()
+        raise
 
 
 def isFloat(x):